@@ -1,4 +1,8 @@
 # account_manager.py
+import asyncio
+import logging
+import time
+from collections import OrderedDict
 
 from telethon import TelegramClient
 from telethon.sessions import StringSession
@@ -10,3 +14,192 @@ async def get_client(session_string: str, api_id: int, api_hash: str) -> Telegra
     client = TelegramClient(StringSession(session_string), api_id, api_hash)
     await client.connect()
     return client
+
+class ClientPool:
+    """
+    Lazily connected TelegramClients for every registered account.
+
+    Accounts are registered with their session string only; a client is
+    connected the first time it is asked for. Clients held by a running
+    scheduler are pinned with acquire()/release(). Unpinned clients are
+    disconnected after `idle_timeout` seconds, or least-recently-used first
+    once more than `max_live` are connected. A health check reconnects
+    dropped pinned clients with exponential backoff.
+    """
+
+    def __init__(self, api_id: int, api_hash: str, max_live: int, idle_timeout: float, connect_timeout: float, on_connect=None):
+        self.api_id = api_id
+        self.api_hash = api_hash
+        self.max_live = max_live
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.on_connect = on_connect  # Called as on_connect(client, user_id, acc_name) for every new client
+        self.sessions = {}          # (user_id, acc_name) -> session string
+        self.live = OrderedDict()   # (user_id, acc_name) -> client, least recently used first
+        self.last_used = {}
+        self.pins = {}
+        self._connect_locks = {}
+        self._retry_at = {}
+        self._backoff = {}
+        self.stats = {'connects': 0, 'connect_failures': 0, 'evictions': 0, 'reconnects': 0}
+
+    def register(self, user_id: int, acc_name: str, session: str, client: TelegramClient = None):
+        """Adds an account; pass `client` when a connected one already exists (fresh login)."""
+        key = (user_id, acc_name)
+        self.sessions[key] = session
+        if client is not None:
+            self.live[key] = client
+            self.last_used[key] = time.monotonic()
+            if self.on_connect: self.on_connect(client, user_id, acc_name)
+
+    async def unregister(self, user_id: int, acc_name: str):
+        key = (user_id, acc_name)
+        self.sessions.pop(key, None)
+        self.pins.pop(key, None)
+        await self._disconnect(key)
+
+    def accounts(self, user_id: int) -> list:
+        return [acc_name for (owner, acc_name) in self.sessions if owner == user_id]
+
+    def first_account(self, user_id: int):
+        accounts = self.accounts(user_id)
+        return accounts[0] if accounts else None
+
+    async def get(self, user_id: int, acc_name: str) -> TelegramClient:
+        """Returns a connected client for the account, connecting it if needed."""
+        key = (user_id, acc_name)
+        client = self.live.get(key)
+        if client is None:
+            lock = self._connect_locks.setdefault(key, asyncio.Lock())
+            async with lock:
+                client = self.live.get(key)
+                if client is None:
+                    client = await self._connect(key)
+        self.live.move_to_end(key)
+        self.last_used[key] = time.monotonic()
+        return client
+
+    async def acquire(self, user_id: int, acc_name: str) -> TelegramClient:
+        """Like get(), but pins the client so it is never evicted until release()."""
+        key = (user_id, acc_name)
+        self.pins[key] = self.pins.get(key, 0) + 1
+        try:
+            return await self.get(user_id, acc_name)
+        except Exception:
+            self.release(user_id, acc_name)
+            raise
+
+    def release(self, user_id: int, acc_name: str):
+        key = (user_id, acc_name)
+        remaining = self.pins.get(key, 0) - 1
+        if remaining > 0:
+            self.pins[key] = remaining
+        else:
+            self.pins.pop(key, None)
+        self.last_used[key] = time.monotonic()
+
+    async def _connect(self, key) -> TelegramClient:
+        if key not in self.sessions:
+            raise KeyError(f"Account {key[0]}-{key[1]} is not registered.")
+        try:
+            client = await asyncio.wait_for(get_client(self.sessions[key], self.api_id, self.api_hash), self.connect_timeout)
+        except Exception:
+            self.stats['connect_failures'] += 1
+            raise
+        self.stats['connects'] += 1
+        self.live[key] = client
+        if self.on_connect: self.on_connect(client, *key)
+        await self._evict_over_cap(keep=key)
+        return client
+
+    async def _disconnect(self, key):
+        client = self.live.pop(key, None)
+        self.last_used.pop(key, None)
+        if client is not None:
+            try:
+                await client.disconnect()
+            except Exception as e:
+                logging.warning(f"Error while disconnecting client {key[0]}-{key[1]}: {e}")
+
+    async def _evict_over_cap(self, keep=None):
+        for key in list(self.live):
+            if len(self.live) <= self.max_live:
+                return
+            if key not in self.pins and key != keep:
+                self.stats['evictions'] += 1
+                await self._disconnect(key)
+        if len(self.live) > self.max_live:
+            logging.warning(f"Client pool holds {len(self.live)} live clients (cap {self.max_live}); all are pinned by running schedulers.")
+
+    async def evict_idle(self):
+        """Disconnects unpinned clients that have not been used for `idle_timeout` seconds."""
+        cutoff = time.monotonic() - self.idle_timeout
+        for key in [key for key in self.live if key not in self.pins and self.last_used.get(key, 0) < cutoff]:
+            self.stats['evictions'] += 1
+            await self._disconnect(key)
+
+    async def check_health(self):
+        """Reconnects pinned clients that dropped, backing off exponentially per account."""
+        now = time.monotonic()
+        for key in list(self.pins):
+            client = self.live.get(key)
+            if client is not None and client.is_connected():
+                self._backoff.pop(key, None)
+                continue
+            if self._retry_at.get(key, 0) > now:
+                continue
+            try:
+                if client is not None:
+                    await asyncio.wait_for(client.connect(), self.connect_timeout)
+                else:
+                    await self._connect(key)
+                self.stats['reconnects'] += 1
+                self._backoff.pop(key, None)
+                self._retry_at.pop(key, None)
+            except Exception as e:
+                delay = min(self._backoff.get(key, 5) * 2, 900)
+                self._backoff[key] = delay
+                self._retry_at[key] = now + delay
+                logging.warning(f"Reconnect failed for {key[0]}-{key[1]}: {e}. Retrying in {delay}s.")
+
+    async def maintain(self, interval: float):
+        """Background loop: idle eviction plus health checks every `interval` seconds."""
+        while True:
+            await asyncio.sleep(interval)
+            await self.evict_idle()
+            await self.check_health()
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats.update(registered=len(self.sessions), live=len(self.live), pinned=len(self.pins))
+        return stats
+
+async def warm_up_clients(pool: ClientPool, accounts, limit: int, on_connected=None) -> dict:
+    """
+    Connects the given (user_id, acc_name) accounts through the pool, at most `limit` at a time.
+    `on_connected(user_id, acc_name, client)` is awaited as soon as each client is up, so
+    accounts become usable one by one instead of after the whole batch.
+    Returns a summary with counts, failures and timings.
+    """
+    semaphore = asyncio.Semaphore(limit)
+    started = time.monotonic()
+    summary = {'total': 0, 'connected': 0, 'failed': [], 'first_client_s': None, 'all_clients_s': None}
+
+    async def connect_one(user_id, acc_name):
+        async with semaphore:
+            try:
+                client = await pool.get(user_id, acc_name)
+            except Exception as e:
+                summary['failed'].append((user_id, acc_name, e.__class__.__name__))
+                return
+        summary['connected'] += 1
+        if summary['first_client_s'] is None:
+            summary['first_client_s'] = time.monotonic() - started
+        if on_connected:
+            await on_connected(user_id, acc_name, client)
+
+    tasks = [connect_one(user_id, acc_name) for user_id, acc_name in accounts]
+    summary['total'] = len(tasks)
+    await asyncio.gather(*tasks)
+    summary['all_clients_s'] = time.monotonic() - started
+    return summary
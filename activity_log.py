@@ -0,0 +1,160 @@
+# activity_log.py
+import json
+import sqlite3
+import time
+from datetime import datetime
+from threading import Lock
+
+LOG_DB_FILE = 'activity.db'
+LOG_RING_SIZE = 50  # Entries kept per user; older ones are overwritten in place
+
+# Event code -> text template. Only the code and its arguments are stored;
+# the text is rendered when an admin actually looks at the logs.
+EVENTS = {
+    'start': "Started the bot.",
+    'agreed': "Agreed to terms and joined channel.",
+    'premium_added': "Upgraded to Premium by admin.",
+    'premium_removed': "Downgraded to regular user by admin.",
+    'banned': "Banned by admin.",
+    'unbanned': "Unbanned by admin.",
+    'adbot_toggled': "Toggled AdBot status to {}.",
+    'delay_set': "Set forward delay to {} seconds.",
+    'ad_source_set': "Set ad source to 'Saved Messages'.",
+    'groups_detected': "Detected {} groups.",
+    'schedule_set': "Set {} to {} UTC.",
+    'schedule_cleared': "Cleared schedule.",
+    'account_added': "Successfully added new account: {}.",
+    'account_removed': "Removed account: {}.",
+    'text': "{}",
+}
+
+log_lock = Lock()
+
+class ActivityLog:
+    """Per-user ring buffers of compact (epoch, code, args) entries in their own SQLite file.
+
+    Row (user_id, seq % ring_size) is overwritten as new entries arrive, so each
+    user keeps at most `ring_size` entries. Indexes on ts and (code, ts) let
+    admins search across all users without touching user records.
+    """
+
+    def __init__(self, path=LOG_DB_FILE, ring_size=LOG_RING_SIZE):
+        self.ring_size = ring_size
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS logs ("
+            " user_id INTEGER NOT NULL,"
+            " slot INTEGER NOT NULL,"
+            " seq INTEGER NOT NULL,"
+            " ts INTEGER NOT NULL,"
+            " code TEXT NOT NULL,"
+            " args TEXT,"
+            " PRIMARY KEY (user_id, slot))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_logs_ts ON logs (ts)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_logs_code_ts ON logs (code, ts)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_logs_user_seq ON logs (user_id, seq)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._next_seq = {}
+
+    def _seq_for(self, user_id):
+        seq = self._next_seq.get(user_id)
+        if seq is None:
+            seq = self.conn.execute("SELECT COALESCE(MAX(seq), -1) + 1 FROM logs WHERE user_id = ?", (user_id,)).fetchone()[0]
+        self._next_seq[user_id] = seq + 1
+        return seq
+
+    def append(self, user_id, code, args=(), ts=None):
+        ts = int(time.time()) if ts is None else ts
+        encoded_args = json.dumps(list(args), separators=(',', ':')) if args else None
+        with log_lock:
+            seq = self._seq_for(user_id)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO logs VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, seq % self.ring_size, seq, ts, code, encoded_args)
+            )
+
+    def user_entries(self, user_id):
+        """Returns a user's entries, oldest first, as (ts, code, args) tuples."""
+        with log_lock:
+            rows = self.conn.execute(
+                "SELECT ts, code, args FROM logs WHERE user_id = ? ORDER BY seq", (user_id,)
+            ).fetchall()
+        return [(ts, code, json.loads(args) if args else []) for ts, code, args in rows]
+
+    def query(self, code=None, since=None, until=None, limit=100):
+        """Returns the newest matching entries across all users as (user_id, ts, code, args) tuples."""
+        clauses, params = [], []
+        if code is not None:
+            clauses.append("code = ?")
+            params.append(code)
+        if since is not None:
+            clauses.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("ts < ?")
+            params.append(until)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        with log_lock:
+            rows = self.conn.execute(
+                f"SELECT user_id, ts, code, args FROM logs{where} ORDER BY ts DESC, seq DESC LIMIT ?", (*params, limit)
+            ).fetchall()
+        return [(user_id, ts, code, json.loads(args) if args else []) for user_id, ts, code, args in rows]
+
+    def import_legacy(self, logs_by_user):
+        """One-shot import of the old '[timestamp] message' strings kept in user records.
+
+        Returns True once the import has been done (now or on an earlier run).
+        """
+        with log_lock:
+            if self.conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_imported'").fetchone():
+                return True
+        for user_id, lines in logs_by_user.items():
+            for line in lines[-self.ring_size:]:
+                try:
+                    ts = int(datetime.strptime(line[1:20], "%Y-%m-%d %H:%M:%S").timestamp())
+                    message = line[22:]
+                except ValueError:
+                    ts, message = 0, line
+                self.append(int(user_id), 'text', (message,), ts=ts)
+        with log_lock:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('legacy_imported', '1')")
+        return True
+
+def render_entry(ts, code, args):
+    """Formats an entry the same way the old inline logs looked."""
+    timestamp = datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S")
+    template = EVENTS.get(code, code + " {}")
+    try:
+        message = template.format(*args)
+    except (IndexError, KeyError):
+        message = f"{code} {args}"
+    return f"[{timestamp}] {message}"
+
+_activity_log = None
+
+def get_activity_log():
+    """Returns the shared activity log, opening it on first use."""
+    global _activity_log
+    with log_lock:
+        if _activity_log is None:
+            _activity_log = ActivityLog(LOG_DB_FILE)
+        return _activity_log
+
+def log_event(user_id, code, *args):
+    """Records an activity event for a user."""
+    get_activity_log().append(int(user_id), code, args)
+
+def get_user_logs(user_id):
+    """Returns a user's rendered log lines, oldest first."""
+    return [render_entry(*entry) for entry in get_activity_log().user_entries(int(user_id))]
+
+def query_logs(code=None, since=None, until=None, limit=100):
+    """Searches logs across all users by event code and/or epoch time range."""
+    return get_activity_log().query(code, since, until, limit)
+
+def import_legacy_logs(logs_by_user):
+    """Moves logs from the old per-user 'logs' lists into the activity log."""
+    return get_activity_log().import_legacy(logs_by_user)
@@ -0,0 +1,103 @@
+# async_database.py
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import database
+from activity_log import log_event, get_user_logs, query_logs
+from state_index import StateIndex
+
+class AsyncDatabase:
+    """Async front-end for database.py that keeps blocking I/O off the event loop.
+
+    Every storage call runs on one dedicated worker thread, so calls are
+    serialized against each other without ever blocking the loop. Reads of
+    records already in the user cache are answered inline. Handlers that do a
+    read-modify-write on one user should hold `lock(user_id)` around it.
+
+    Conversation states are mirrored in a StateIndex; the persisted `state`
+    field is only written when a state actually changes.
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db')
+        self._user_locks = {}
+        self.states = StateIndex()
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args))
+
+    def lock(self, user_id):
+        """Returns the asyncio.Lock guarding compound updates to one user."""
+        lock = self._user_locks.get(user_id)
+        if lock is None:
+            lock = self._user_locks[user_id] = asyncio.Lock()
+        return lock
+
+    async def get_user(self, user_id):
+        record = database.peek_user_data(user_id)
+        if record is not None:
+            return record
+        return await self._run(database.get_user_data, user_id)
+
+    async def update(self, user_id, key, value):
+        if key == 'state':
+            return await self.set_state(user_id, value)
+        await self._run(database.update_user_data, user_id, key, value)
+
+    async def update_many(self, user_id, **fields):
+        """Sets several keys on one user as a single mutation."""
+        if 'state' in fields and not self.states.set(user_id, fields['state']):
+            del fields['state']
+        if fields:
+            await self._run(database.update_user_fields, user_id, fields)
+
+    async def load_state_index(self):
+        """Seeds the state index from storage; call once before handlers run."""
+        self.states.load(await self._run(database.load_states))
+
+    def get_state(self, user_id):
+        """O(1) lookup of a user's conversation state, without touching storage."""
+        return self.states.get(user_id)
+
+    async def set_state(self, user_id, state):
+        if self.states.set(user_id, state):
+            await self._run(database.update_user_data, user_id, 'state', state)
+
+    async def expire_states(self):
+        """Clears the persisted state of users whose conversation timed out."""
+        expired = self.states.pop_expired()
+        if expired:
+            await self._run(database.update_user_fields_many, expired, {'state': None})
+        return len(expired)
+
+    async def delete_account(self, user_id, account_name):
+        return await self._run(database.delete_user_account, user_id, account_name)
+
+    async def load_all(self):
+        return await self._run(database.load_data)
+
+    async def aggregates(self):
+        return await self._run(database.get_user_aggregates)
+
+    async def users_page(self, offset, limit):
+        return await self._run(database.get_users_page, offset, limit)
+
+    async def log(self, user_id, code, *args):
+        await self._run(log_event, user_id, code, *args)
+
+    async def user_logs(self, user_id):
+        return await self._run(get_user_logs, user_id)
+
+    async def query_logs(self, code=None, since=None, until=None, limit=100):
+        return await self._run(query_logs, code, since, until, limit)
+
+    async def flush(self):
+        await self._run(database.flush_cache)
+
+    async def close(self):
+        await self.flush()
+        self._executor.shutdown(wait=True)
+
+db = AsyncDatabase()
@@ -0,0 +1,83 @@
+# benchmarks/callback_latency.py
+"""Per-callback latency and user-record reads for main.callback_query_handler.
+
+Feeds fake CallbackQuery events for the common buttons straight into the
+handler (no network) and reports latency percentiles plus the number of
+user-record reads (cache hits + misses) each press costs.
+
+Usage: python benchmarks/callback_latency.py [--users 1000] [--presses 5000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+BUTTONS = [
+    b"main_menu", b"set_delay", b"delay_5", b"delay_10", b"set_schedule", b"clear_schedule",
+    b"manage_accounts", b"manage_saved_message", b"toggle_adbot_status", b"otp_1", b"otp_del",
+]
+
+class FakeCallbackEvent:
+    def __init__(self, user_id, data):
+        self.sender_id = user_id
+        self.data = data
+
+    async def answer(self, *args, **kwargs):
+        pass
+
+    async def edit(self, *args, **kwargs):
+        pass
+
+    async def respond(self, *args, **kwargs):
+        pass
+
+async def run(main, database, n_users, presses):
+    data = {}
+    for i in range(n_users):
+        record = database.default_user_record()
+        record.update(has_agreed=True, is_premium=i % 3 == 0, accounts={'account_1': 'x' * 350})
+        data[str(100000 + i)] = record
+    database.save_data(data)
+    await main.db.load_state_index()
+
+    latencies = []
+    stats_before = database.get_cache_stats()
+    for _ in range(presses):
+        event = FakeCallbackEvent(100000 + random.randrange(n_users), random.choice(BUTTONS))
+        started = time.perf_counter()
+        await main.callback_query_handler(event)
+        latencies.append(time.perf_counter() - started)
+    stats_after = database.get_cache_stats()
+    await main.db.close()
+
+    reads = (stats_after['hits'] + stats_after['misses']) - (stats_before['hits'] + stats_before['misses'])
+    latencies.sort()
+    print(f"presses: {presses}  users: {n_users}")
+    print(f"latency p50: {latencies[len(latencies) // 2] * 1e6:.0f}us  "
+          f"p99: {latencies[int(len(latencies) * 0.99)] * 1e6:.0f}us")
+    print(f"user-record reads per press: {reads / presses:.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--presses', type=int, default=5000)
+    args = parser.parse_args()
+    random.seed(0)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # main.py opens its session file and databases relative to the working directory.
+        os.chdir(tmp_dir)
+        import database
+        database._storage = None
+        import main as bot_main
+        asyncio.run(run(bot_main, database, args.users, args.presses))
+        os.chdir(REPO_ROOT)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# benchmarks/event_loop_lag.py
+"""Event-loop lag under database traffic: direct database.py calls vs the async API.
+
+A probe coroutine sleeps PROBE_INTERVAL in a loop and records how late it wakes
+up, while a workload reads and updates random users. With the synchronous API
+every cache miss reads storage on the loop, so lag tracks the cost of a storage
+read; with `async_database` that work moves to the DB thread and lag stays flat
+as the database grows. With `--backend json` a read parses the whole file while
+holding the GIL, so some lag remains even in async mode.
+
+Usage: python benchmarks/event_loop_lag.py [--sizes 1000 10000 50000] [--ops 300] [--backend sqlite]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import activity_log
+import database
+from async_database import AsyncDatabase
+
+PROBE_INTERVAL = 0.005
+
+def configure(tmp_dir, backend):
+    """Points database.py and activity_log.py at a scratch directory."""
+    database.DB_FILE = os.path.join(tmp_dir, 'database.json')
+    database.SQLITE_FILE = os.path.join(tmp_dir, 'database.db')
+    database.JOURNAL_FILE = os.path.join(tmp_dir, 'database.journal')
+    database.STORAGE_BACKEND = backend
+    database._storage = None
+    activity_log.LOG_DB_FILE = os.path.join(tmp_dir, 'activity.db')
+    activity_log._activity_log = None
+
+def populate(n_users):
+    data = {}
+    for i in range(n_users):
+        record = database.default_user_record()
+        record.update(username=f"user{i}", accounts={'account_1': 'x' * 350}, forward_delay=random.choice([2, 5, 10]))
+        data[str(100000 + i)] = record
+    database.save_data(data)
+    database.get_storage().records.clear()
+
+async def probe(lags, stop):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(loop.time() - started - PROBE_INTERVAL)
+
+async def run_workload(mode, n_users, ops):
+    lags, stop = [], asyncio.Event()
+    probe_task = asyncio.create_task(probe(lags, stop))
+    db = AsyncDatabase()
+    user_ids = [100000 + random.randrange(n_users) for _ in range(ops)]
+    started = time.perf_counter()
+    for user_id in user_ids:
+        if mode == 'sync':
+            database.get_user_data(user_id)
+            database.update_user_data(user_id, 'state', 'waiting_for_phone')
+            await asyncio.sleep(0)
+        else:
+            await db.get_user(user_id)
+            await db.update(user_id, 'state', 'waiting_for_phone')
+    elapsed = time.perf_counter() - started
+    await db.close()
+    stop.set()
+    await probe_task
+    lags.sort()
+    return {
+        'ops_per_s': ops / elapsed,
+        'lag_p50_ms': lags[len(lags) // 2] * 1000 if lags else 0.0,
+        'lag_p99_ms': lags[int(len(lags) * 0.99)] * 1000 if lags else 0.0,
+        'lag_max_ms': lags[-1] * 1000 if lags else 0.0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--ops', type=int, default=300)
+    parser.add_argument('--backend', default='sqlite', choices=['sqlite', 'journal', 'json'])
+    args = parser.parse_args()
+    random.seed(0)
+
+    print(f"{'users':>8} {'mode':>6} {'ops/s':>9} {'lag p50':>9} {'lag p99':>9} {'lag max':>9}")
+    for n_users in args.sizes:
+        for mode in ('sync', 'async'):
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                configure(tmp_dir, args.backend)
+                populate(n_users)
+                result = asyncio.run(run_workload(mode, n_users, args.ops))
+                database.flush_cache()
+            print(f"{n_users:>8} {mode:>6} {result['ops_per_s']:>9.0f} {result['lag_p50_ms']:>7.2f}ms "
+                  f"{result['lag_p99_ms']:>7.2f}ms {result['lag_max_ms']:>7.2f}ms")
+
+if __name__ == '__main__':
+    main()
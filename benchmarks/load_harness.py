@@ -0,0 +1,329 @@
+# benchmarks/load_harness.py
+"""End-to-end load harness: simulated users driving the handlers registered in main.py.
+
+Every simulated user walks the common flows: /start, agreeing to the terms,
+the menus, setting a delay, the schedule text flow (premium users), and an
+account login that enters a phone number and an OTP and then cancels. Each
+step is a synthetic NewMessage or CallbackQuery event. The event is dispatched
+the way Telethon dispatches an update: in its own task, through every handler
+registered on main.bot in order, each filter checked just before its handler
+runs. The user waits for the handlers to finish, then thinks for a moment
+before the next step.
+
+The bot and the temporary login clients are local stand-ins that record
+outgoing calls, so no network or credentials are needed. Storage, the user
+cache, the state index and the activity log are the real ones, in a scratch
+directory. The simulated users run on the same event loop as the handlers,
+so once the loop saturates the latencies include the harness's own overhead.
+
+Users are ramped in stages (e.g. 100, 1000, 5000 at once). For each stage the
+harness reports latency percentiles per interaction, user-record reads and
+writes per interaction, and event-loop lag measured by loop_monitor. With
+--max-p99-ms it exits non-zero when a stage's overall p99 exceeds the limit,
+so it can gate CI.
+
+Usage: python benchmarks/load_harness.py [--stages 100 1000 5000] [--think-ms 50] [--output load_results.json] [--max-p99-ms 250]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from telethon import events
+
+FIRST_USER_ID = 100000
+BACKGROUND_USERS = 10000  # Idle users in the database besides the simulated ones
+LAG_INTERVAL = 0.01
+
+class Recorder:
+    """Counts every outgoing call the handlers make, by method."""
+
+    def __init__(self):
+        self.calls = Counter()
+
+    def record(self, method):
+        self.calls[method] += 1
+
+class FakeSentMessage:
+    def __init__(self, recorder, id=1):
+        self.recorder = recorder
+        self.id = id
+
+    async def edit(self, *args, **kwargs):
+        self.recorder.record('message.edit')
+        return self
+
+    async def delete(self, *args, **kwargs):
+        self.recorder.record('message.delete')
+
+class RecordingBot:
+    """Stands in for main.bot: records sends instead of talking to Telegram."""
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+
+    async def __call__(self, request, *args, **kwargs):
+        self.recorder.record(type(request).__name__)
+
+    async def send_message(self, entity, *args, **kwargs):
+        self.recorder.record('bot.send_message')
+        return FakeSentMessage(self.recorder)
+
+    async def send_file(self, entity, *args, **kwargs):
+        self.recorder.record('bot.send_file')
+        return FakeSentMessage(self.recorder)
+
+class FakeSentCode:
+    phone_code_hash = 'hash'
+
+class FakeLoginClient:
+    """Stands in for the temporary TelegramClient of an account login; every code is rejected."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    async def connect(self):
+        pass
+
+    async def disconnect(self):
+        pass
+
+    async def send_code_request(self, phone):
+        return FakeSentCode()
+
+    async def sign_in(self, *args, **kwargs):
+        raise ValueError("The code is invalid (load harness)")
+
+class FakeSender:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.username = f"user{user_id}"
+        self.first_name = f"User {user_id}"
+
+class FakeEvent:
+    def __init__(self, recorder, user_id):
+        self.recorder = recorder
+        self.sender_id = user_id
+        self.chat_id = user_id
+        self.is_private = True
+        self.pattern_match = None
+
+    async def get_sender(self):
+        return FakeSender(self.sender_id)
+
+    async def respond(self, *args, **kwargs):
+        self.recorder.record('event.respond')
+        return FakeSentMessage(self.recorder)
+
+    async def reply(self, *args, **kwargs):
+        self.recorder.record('event.reply')
+        return FakeSentMessage(self.recorder)
+
+    async def edit(self, *args, **kwargs):
+        self.recorder.record('event.edit')
+        return FakeSentMessage(self.recorder)
+
+    async def delete(self, *args, **kwargs):
+        self.recorder.record('event.delete')
+
+class FakeNewMessage(FakeEvent):
+    def __init__(self, recorder, user_id, text):
+        super().__init__(recorder, user_id)
+        self.text = self.raw_text = text
+
+class FakeCallbackQuery(FakeEvent):
+    def __init__(self, recorder, user_id, data):
+        super().__init__(recorder, user_id)
+        self.data = data
+
+    async def answer(self, *args, **kwargs):
+        self.recorder.record('event.answer')
+
+def user_script(premium):
+    """The (kind, payload) steps one simulated user goes through."""
+    steps = [('command', '/start'), ('button', b'agree_and_continue'), ('button', b'main_menu'),
+             ('button', b'set_delay'), ('button', b'delay_5'), ('button', b'cycle_report_mode'),
+             ('button', b'excluded_groups')]
+    if premium:
+        steps += [('button', b'set_schedule'), ('button', b'set_start_time'), ('text', '22:00'),
+                  ('button', b'set_stop_time'), ('text', '06:00'), ('button', b'clear_schedule')]
+    steps += [('button', b'manage_accounts'), ('button', b'add_new_account'), ('text', '+15550001234')]
+    steps += [('button', f"otp_{digit}".encode()) for digit in '12345']
+    steps += [('button', b'cancel_login'), ('button', b'main_menu')]
+    return steps
+
+class Harness:
+    def __init__(self, main, handlers, recorder):
+        self.main = main
+        self.handlers = handlers
+        self.recorder = recorder
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+
+    def _label(self, kind, payload, user_id):
+        if kind == 'command':
+            return payload
+        if kind == 'text':
+            return f"text:{self.main.db.get_state(user_id)}"
+        handler, _ = self.main.router.resolve(payload.decode())
+        return f"button:{handler.__name__ if handler else payload.decode()}"
+
+    def _matches(self, builder, event):
+        if isinstance(builder, events.CallbackQuery) != isinstance(event, FakeCallbackQuery):
+            return False
+        if isinstance(builder, events.NewMessage) and builder.pattern is not None:
+            event.pattern_match = builder.pattern(event.text)
+            if not event.pattern_match: return False
+        return builder.func is None or builder.func(event)
+
+    async def _dispatch(self, event, label):
+        for callback, builder in self.handlers:
+            if not self._matches(builder, event):
+                continue
+            try:
+                await callback(event)
+            except Exception as e:
+                # Telethon logs handler errors and goes on with the next handler.
+                if not self.errors[label]:
+                    print(f"  first error in {label}: {e!r}")
+                self.errors[label] += 1
+
+    async def interact(self, user_id, kind, payload):
+        label = self._label(kind, payload, user_id)
+        if kind == 'button':
+            event = FakeCallbackQuery(self.recorder, user_id, payload)
+        else:
+            event = FakeNewMessage(self.recorder, user_id, payload)
+        started = time.perf_counter()
+        await asyncio.create_task(self._dispatch(event, label))
+        self.latencies[label].append(time.perf_counter() - started)
+
+    async def simulate_user(self, user_id, premium, start_delay, think):
+        await asyncio.sleep(start_delay)
+        for kind, payload in user_script(premium):
+            await self.interact(user_id, kind, payload)
+            await asyncio.sleep(random.uniform(0, 2 * think))
+
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+def populate(database, n_users):
+    data = {}
+    for i in range(n_users):
+        record = database.default_user_record()
+        record.update(username=f"user{FIRST_USER_ID + i}", has_agreed=i % 2 == 0, is_premium=i % 3 == 0)
+        data[str(FIRST_USER_ID + i)] = record
+    database.save_data(data)
+    database.get_storage().records.clear()
+
+async def run(main, database, args):
+    from loop_monitor import LoopMonitor
+
+    recorder = Recorder()
+    handlers = main.bot.list_event_handlers()
+    main.bot = RecordingBot(recorder)
+    main.TelegramClient = FakeLoginClient
+    await main.db.load_state_index()
+    monitor = LoopMonitor(interval=LAG_INTERVAL, threshold=args.slow_ms / 1000)
+    monitor.start()
+
+    stages = []
+    next_user = FIRST_USER_ID + BACKGROUND_USERS
+    for n_users in args.stages:
+        harness = Harness(main, handlers, recorder)
+        monitor.lags.clear()
+        monitor.slow.clear()
+        calls_before = sum(recorder.calls.values())
+        cache_before = database.get_cache_stats()
+        user_ids = range(next_user, next_user + n_users)
+        next_user += n_users
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            harness.simulate_user(user_id, user_id % 3 == 0, random.uniform(0, args.ramp), args.think_ms / 1000)
+            for user_id in user_ids))
+        elapsed = time.perf_counter() - started
+        cache_after = database.get_cache_stats()
+
+        interactions = sum(len(values) for values in harness.latencies.values())
+        every = sorted(value for values in harness.latencies.values() for value in values)
+        lags = sorted(lag for _, lag in monitor.lags) or [0.0]
+        stage = {
+            'users': n_users, 'interactions': interactions, 'seconds': elapsed,
+            'interactions_per_s': interactions / elapsed,
+            'p50_ms': percentile(every, 0.5) * 1000, 'p99_ms': percentile(every, 0.99) * 1000,
+            'reads_per_interaction': ((cache_after['hits'] + cache_after['misses']) - (cache_before['hits'] + cache_before['misses'])) / interactions,
+            'writes_per_interaction': (cache_after['mutations'] - cache_before['mutations']) / interactions,
+            'storage_reads_per_interaction': (cache_after['misses'] - cache_before['misses']) / interactions,
+            'outgoing_calls_per_interaction': (sum(recorder.calls.values()) - calls_before) / interactions,
+            'loop_lag_p50_ms': percentile(lags, 0.5) * 1000, 'loop_lag_p99_ms': percentile(lags, 0.99) * 1000,
+            'loop_lag_max_ms': lags[-1] * 1000, 'slow_callbacks': len(monitor.slow),
+            'errors': sum(harness.errors.values()),
+            'by_interaction': {
+                label: {'count': len(values), 'p50_ms': percentile(sorted(values), 0.5) * 1000,
+                        'p99_ms': percentile(sorted(values), 0.99) * 1000}
+                for label, values in sorted(harness.latencies.items())
+            },
+        }
+        stages.append(stage)
+        print_stage(stage)
+
+    monitor.stop()
+    await main.db.close()
+    return {'args': vars(args), 'stages': stages, 'outgoing_calls': dict(recorder.calls)}
+
+def print_stage(stage):
+    print(f"\n{stage['users']} concurrent users: {stage['interactions']} interactions in {stage['seconds']:.1f}s "
+          f"({stage['interactions_per_s']:.0f}/s), {stage['errors']} handler errors")
+    print(f"  latency p50 {stage['p50_ms']:.2f}ms  p99 {stage['p99_ms']:.2f}ms")
+    print(f"  per interaction: {stage['reads_per_interaction']:.2f} record reads "
+          f"({stage['storage_reads_per_interaction']:.2f} from storage), {stage['writes_per_interaction']:.2f} writes, "
+          f"{stage['outgoing_calls_per_interaction']:.2f} outgoing calls")
+    print(f"  loop lag p50 {stage['loop_lag_p50_ms']:.2f}ms  p99 {stage['loop_lag_p99_ms']:.2f}ms  "
+          f"max {stage['loop_lag_max_ms']:.1f}ms, {stage['slow_callbacks']} slow callbacks")
+    print(f"  {'interaction':<40} {'count':>7} {'p50':>9} {'p99':>9}")
+    for label, row in stage['by_interaction'].items():
+        print(f"  {label:<40} {row['count']:>7} {row['p50_ms']:>7.2f}ms {row['p99_ms']:>7.2f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stages', type=int, nargs='+', default=[100, 1000, 5000], help="concurrent users per stage")
+    parser.add_argument('--ramp', type=float, default=2.0, help="seconds over which a stage's users start")
+    parser.add_argument('--think-ms', type=float, default=50, help="mean pause between a user's steps")
+    parser.add_argument('--slow-ms', type=float, default=50, help="loop stalls longer than this count as slow callbacks")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--max-p99-ms', type=float, help="exit with status 1 if any stage's p99 latency exceeds this")
+    args = parser.parse_args()
+    random.seed(0)
+    logging.disable(logging.CRITICAL)
+
+    output = os.path.abspath(args.output) if args.output else None
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # main.py opens its session file and databases relative to the working directory.
+        os.chdir(tmp_dir)
+        import database
+        database._storage = None
+        populate(database, BACKGROUND_USERS)
+        import main as bot_main
+        results = asyncio.run(run(bot_main, database, args))
+        os.chdir(REPO_ROOT)
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nWrote results to {output}")
+    if args.max_p99_ms is not None:
+        worst = max(stage['p99_ms'] for stage in results['stages'])
+        if worst > args.max_p99_ms:
+            sys.exit(f"p99 latency {worst:.1f}ms exceeds --max-p99-ms {args.max_p99_ms:g}")
+
+if __name__ == '__main__':
+    main()
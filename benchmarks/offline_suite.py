@@ -0,0 +1,298 @@
+# benchmarks/offline_suite.py
+"""Offline benchmark suite for database.py, the master scheduler and the forwarding loop.
+
+Everything runs against synthetic data in a scratch directory; no network and
+no Telegram credentials are needed. The data is seeded, so every run does
+exactly the same work and only the timings differ between runs.
+
+  db.*            database.py operations on 1k/10k/100k-user databases (two
+                  accounts per user, LOG_ENTRIES activity-log entries each).
+                  Per-user operations are timed over SAMPLE random users and
+                  reported per call.
+  schedule.*      the master scheduler's ScheduleIndex work: indexing every
+                  user at startup, the first tick (every scheduled user is
+                  reconciled) and an hourly tick (one hour's transitions).
+  forwarding.*    MessageScheduler.start_forwarding against a fake account
+                  client and bot, on an event loop whose clock jumps ahead
+                  instead of sleeping, so forward delays and FloodWaits cost
+                  nothing and only the loop's own work is measured.
+
+Results go to a JSON file; pass an earlier one with --baseline to print the
+ratio of every timing against it.
+
+Usage: python benchmarks/offline_suite.py [--sizes 1000 10000 100000] [--output bench_results.json] [--baseline old.json]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telethon.errors.rpcerrorlist import ChatWriteForbiddenError, FloodWaitError
+
+import activity_log
+import database
+import destination_health
+import group_cache
+from benchmarks.event_loop_lag import configure
+from benchmarks.user_record_memory import synthetic_user
+from group_cache import CachedGroup
+from message_scheduler import MessageScheduler
+from schedule_index import ScheduleIndex
+
+SAMPLE = 1000       # Users touched by each per-user operation
+LOG_ENTRIES = 20    # Activity-log entries per synthetic user
+FIRST_USER_ID = 100000
+EPOCH = datetime(2024, 5, 1, tzinfo=timezone.utc)  # "now" for the schedule benchmarks
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """Event loop whose clock jumps to the next timer instead of sleeping when nothing is ready."""
+
+    def __init__(self):
+        super().__init__()
+        self.virtual_time = 0.0
+        real_select = self._selector.select
+
+        def select(timeout=None):
+            if timeout is None:
+                return real_select(None)  # Nothing scheduled: wait for real I/O (e.g. executor results)
+            events = real_select(0)
+            if not events and timeout > 0:
+                self.virtual_time += timeout
+            return events
+
+        self._selector.select = select
+
+    def time(self):
+        return self.virtual_time
+
+class FakeMessage:
+    def __init__(self, id):
+        self.id = id
+
+    async def edit(self, text, **kwargs):
+        return self
+
+class FakeBot:
+    def __init__(self):
+        self.sent = 0
+
+    async def send_message(self, entity, text, **kwargs):
+        self.sent += 1
+        return FakeMessage(self.sent)
+
+class FakeMe:
+    user_id = 1
+
+class FakeAccountClient:
+    """Stands in for an account's TelegramClient with scripted forward results.
+
+    Groups whose id is a multiple of `forbidden_every` refuse every forward;
+    every `flood_every`-th forward call raises a FloodWait of `flood_seconds`.
+    """
+
+    def __init__(self, flood_every=50, flood_seconds=30, forbidden_every=97):
+        self.flood_every = flood_every
+        self.flood_seconds = flood_seconds
+        self.forbidden_every = forbidden_every
+        self.calls = 0
+        self.forwarded = 0
+
+    async def get_me(self, input_peer=False):
+        return FakeMe()
+
+    async def get_messages(self, entity, limit=None):
+        return [FakeMessage(1)]
+
+    def add_event_handler(self, callback, event=None):
+        pass
+
+    def remove_event_handler(self, callback, event=None):
+        pass
+
+    def is_connected(self):
+        return True
+
+    async def forward_messages(self, entity, messages):
+        self.calls += 1
+        if entity.channel_id % self.forbidden_every == 0:
+            raise ChatWriteForbiddenError(None)
+        if self.calls % self.flood_every == 0:
+            raise FloodWaitError(None, capture=self.flood_seconds)
+        self.forwarded += 1
+
+def close_storage():
+    if database._storage is not None:
+        conn = getattr(database._storage.storage, 'conn', None)
+        if conn is not None: conn.close()
+    database._storage = None
+
+def reopen():
+    """Drops the user cache and reopens storage, so the next call starts cold."""
+    close_storage()
+    database.get_storage()
+
+def populate(n_users, n_accounts):
+    data = {}
+    for i in range(n_users):
+        record = synthetic_user(i, n_accounts, False)
+        if record['is_premium']:
+            record.update(start_time=f"{i % 24:02d}:00", stop_time=f"{(i + 8) % 24:02d}:30")
+        data[str(FIRST_USER_ID + i)] = database.UserRecord.from_dict(record)
+    database.save_data(data)
+    templates = [('adbot_toggled', ['ON']), ('delay_set', [5]), ('groups_detected', [120]), ('text', ['Forwarding cycle complete.'])]
+    rows = []
+    for i in range(n_users):
+        for seq in range(LOG_ENTRIES):
+            code, args = templates[(i + seq) % len(templates)]
+            rows.append((FIRST_USER_ID + i, seq % activity_log.LOG_RING_SIZE, seq,
+                         int(EPOCH.timestamp()) - (LOG_ENTRIES - seq) * 3600, code, json.dumps(args)))
+    log = activity_log.get_activity_log()
+    log.conn.execute("BEGIN")
+    log.conn.executemany("INSERT OR REPLACE INTO logs VALUES (?, ?, ?, ?, ?, ?)", rows)
+    log.conn.execute("COMMIT")
+
+def timed(repeat, func, setup=None):
+    """Median wall time in seconds of `repeat` calls of func(), each after an untimed setup()."""
+    timings = []
+    for _ in range(repeat):
+        if setup is not None: setup()
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+def bench_database(n_users, args):
+    """Returns [(benchmark name, seconds, calls)] for one database size."""
+    results = []
+    sample = [FIRST_USER_ID + random.randrange(n_users) for _ in range(min(SAMPLE, n_users))]
+
+    def add(name, seconds, calls=1):
+        results.append((name, seconds, calls))
+
+    add('db.load_data', timed(args.repeat, database.load_data, setup=reopen))
+    data = database.load_data()
+    add('db.save_data', timed(args.repeat, lambda: database.save_data(data)))
+    add('db.get_user_data.cold', timed(args.repeat, lambda: [database.get_user_data(u) for u in sample], setup=reopen), len(sample))
+    add('db.get_user_data.hot', timed(args.repeat, lambda: [database.get_user_data(u) for u in sample]), len(sample))
+    add('db.update_user_data', timed(args.repeat, lambda: [database.update_user_data(u, 'forward_delay', 10) for u in sample],
+                                     setup=database.flush_cache), len(sample))
+    add('db.flush', timed(args.repeat, database.flush_cache,
+                          setup=lambda: [database.update_user_data(u, 'forward_delay', 5) for u in sample]))
+    add('db.update_user_fields_many', timed(args.repeat, lambda: database.update_user_fields_many(sample, {'report_mode': 'errors'})))
+    database.flush_cache()
+    add('db.add_log_entry', timed(args.repeat, lambda: [database.add_log_entry(u, "Benchmark entry.") for u in sample]), len(sample))
+    add('db.get_user_logs', timed(args.repeat, lambda: [activity_log.get_user_logs(u) for u in sample[:100]]), min(100, len(sample)))
+    add('db.get_user_aggregates.cold', timed(args.repeat, database.get_user_aggregates, setup=reopen))
+    add('db.get_users_page', timed(args.repeat, lambda: database.get_users_page(n_users // 2, 25)))
+    add('db.load_states', timed(args.repeat, database.load_states))
+
+    all_data = database.load_data()
+    index = ScheduleIndex()
+    add('schedule.load', timed(args.repeat, lambda: ScheduleIndex().load(all_data, now=EPOCH)))
+    index.load(all_data, now=EPOCH)
+    add('schedule.first_tick', timed(1, lambda: index.pop_due(EPOCH)))
+    next_due = index.next_due()
+    add('schedule.hourly_tick', timed(1, lambda: index.pop_due(next_due + timedelta(seconds=1))))
+    return results
+
+def bench_forwarding(args, tmp_dir):
+    """Runs start_forwarding for `args.cycles` cycles over `args.groups` groups; returns a result dict."""
+    group_cache.GROUP_CACHE_FILE = destination_health.GROUP_CACHE_FILE = os.path.join(tmp_dir, 'groups.db')
+    group_cache._group_cache = destination_health._destination_health = None
+    user_id, acc_name = FIRST_USER_ID, 'account_1'
+    group_cache.get_group_cache().replace(user_id, acc_name, [
+        CachedGroup(1000 + n, f"Group {n}", 'channel', 10 ** 9 + n) for n in range(args.groups)])
+    database.update_user_fields(user_id, {'adbot_status': True, 'report_mode': 'summary'})
+
+    client, bot = FakeAccountClient(), FakeBot()
+    scheduler = MessageScheduler(user_id, client, args.delay, bot, acc_name)
+    cycles = 0
+    finish_cycle = scheduler.reporter.finish_cycle
+
+    async def count_cycle():
+        nonlocal cycles
+        await finish_cycle()
+        cycles += 1
+        if cycles >= args.cycles: scheduler.stop_event.set()
+
+    scheduler.reporter.finish_cycle = count_cycle
+    loop = VirtualClockLoop()
+    try:
+        started = time.perf_counter()
+        loop.run_until_complete(scheduler.start_forwarding())
+        elapsed = time.perf_counter() - started
+    finally:
+        loop.close()
+    return {
+        'benchmark': 'forwarding.start_forwarding', 'groups': args.groups, 'cycles': cycles,
+        'seconds': elapsed, 'calls': client.calls, 'per_call_us': elapsed / max(client.calls, 1) * 1e6,
+        'virtual_seconds': loop.virtual_time, 'forwarded': client.forwarded, 'bot_messages': bot.sent,
+    }
+
+def print_comparison(results, baseline_path):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(r['benchmark'], r.get('users'), r.get('groups')): r for r in json.load(f)['results']}
+    print(f"\nAgainst {baseline_path} (new / old, below 1.00 is faster):")
+    for result in results:
+        old = baseline.get((result['benchmark'], result.get('users'), result.get('groups')))
+        if old and old['seconds']:
+            size = result.get('users', result.get('groups'))
+            print(f"  {result['benchmark']:<30} {size:>8} {result['seconds'] / old['seconds']:>6.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--accounts', type=int, default=2, help="accounts (session strings) per user")
+    parser.add_argument('--backend', default='sqlite', choices=['sqlite', 'journal', 'json'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--groups', type=int, default=500, help="groups per forwarding cycle")
+    parser.add_argument('--cycles', type=int, default=3, help="forwarding cycles to run")
+    parser.add_argument('--delay', type=int, default=5, help="forward delay in (virtual) seconds")
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline', help="earlier --output file to compare against")
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)  # The forwarding loop logs every send; keep the output to results
+
+    results = []
+    print(f"{'benchmark':<30} {'size':>8} {'total':>10} {'per call':>10}")
+    for n_users in args.sizes:
+        random.seed(0)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            configure(tmp_dir, args.backend)
+            database.CACHE_FLUSH_INTERVAL = None  # Flushes happen only where the suite times them
+            populate(n_users, args.accounts)
+            for name, seconds, calls in bench_database(n_users, args):
+                results.append({'benchmark': name, 'users': n_users, 'seconds': seconds, 'calls': calls,
+                                'per_call_us': seconds / calls * 1e6, 'backend': args.backend})
+                print(f"{name:<30} {n_users:>8} {seconds * 1000:>8.1f}ms {seconds / calls * 1e6:>8.1f}us")
+            if n_users == args.sizes[-1]:
+                forwarding = bench_forwarding(args, tmp_dir)
+                results.append(forwarding)
+                print(f"{forwarding['benchmark']:<30} {args.groups:>8} {forwarding['seconds'] * 1000:>8.1f}ms "
+                      f"{forwarding['per_call_us']:>8.1f}us  ({forwarding['cycles']} cycles, {forwarding['calls']} forward calls, "
+                      f"{forwarding['virtual_seconds'] / 60:.0f} virtual min)")
+            close_storage()
+            activity_log.get_activity_log().conn.close()
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'platform': platform.platform(),
+            'args': vars(args), 'results': results,
+        }, f, indent=2)
+    print(f"\nWrote {len(results)} results to {args.output}")
+    if args.baseline:
+        print_comparison(results, args.baseline)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+# benchmarks/serialization_formats.py
+"""Serialize/deserialize time and file size of the database.py snapshot formats.
+
+For a synthetic database, each format is timed on:
+
+  dump      serializing records that were just built in memory
+  load      parsing the serialized bytes back into UserRecords
+  re-dump   serializing the records that `load` returned, which is what every
+            snapshot after a restart does; 'records' reuses the stored account
+            JSON here instead of re-encoding each StringSession
+
+Usage: python benchmarks/serialization_formats.py [--users 10000] [--accounts 2] [--repeat 3]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from benchmarks.user_record_memory import synthetic_user
+
+def best_of(repeat, func):
+    """Returns (result, fastest wall time in seconds) of `repeat` calls."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--accounts', type=int, default=2, help="accounts (session strings) per user")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    random.seed(0)
+
+    data = {str(100000 + i): database.UserRecord.from_dict(synthetic_user(i, args.accounts, False)) for i in range(args.users)}
+    print(f"{args.users} users, {args.accounts} accounts each")
+    print(f"{'format':<12} {'size':>10} {'dump':>9} {'load':>9} {'re-dump':>9}")
+    for name, fmt in database.FORMATS.items():
+        payload, dump_s = best_of(args.repeat, lambda: fmt.dumps(data))
+        _, load_s = best_of(args.repeat, lambda: fmt.loads(payload))
+        # Each re-dump gets freshly loaded records, as a real snapshot after a restart would.
+        redump_s = min(best_of(1, lambda loaded=fmt.loads(payload): fmt.dumps(loaded))[1] for _ in range(args.repeat))
+        print(f"{name:<12} {len(payload) / 2**20:>8.2f}MB {dump_s * 1000:>7.0f}ms {load_s * 1000:>7.0f}ms {redump_s * 1000:>7.0f}ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+# benchmarks/user_record_memory.py
+"""Memory and load time of user records: plain dicts vs UserRecord.
+
+Builds a synthetic database and measures, with tracemalloc, what holding every
+user in memory costs in three representations:
+
+  dict            the old shape: one dict per user, as json.load returns it,
+                  including the 50-entry inline 'logs' list records used to carry
+  dict (no logs)  the same dicts after the logs moved to activity_log
+  UserRecord      __slots__ records as SqliteStorage.load_all() now returns them,
+                  with each user's account sessions still JSON-encoded
+
+Usage: python benchmarks/user_record_memory.py [--sizes 10000 100000] [--accounts 2]
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+SESSION_LENGTH = 353  # Length of a Telethon StringSession
+LOG_ENTRIES = 50
+
+def synthetic_user(i, n_accounts, with_logs):
+    record = database.default_user_record().to_dict()
+    record.update(
+        username=f"user{i}", has_agreed=True, is_premium=i % 5 == 0, adbot_status=i % 3 == 0,
+        forward_delay=random.choice([2, 5, 10]),
+        accounts={f"account_{n}": ''.join(random.choices('ABCDEFabcdef0123456789', k=SESSION_LENGTH))
+                  for n in range(1, n_accounts + 1)},
+    )
+    if with_logs:
+        record['logs'] = [f"[2024-05-01 12:{m % 60:02d}:00] AdBot status changed to ON." for m in range(LOG_ENTRIES)]
+    return record
+
+def measure(load):
+    """Returns (bytes allocated and still held, seconds) for `load()`; timing is taken without tracemalloc."""
+    gc.collect()
+    started = time.perf_counter()
+    load()
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    tracemalloc.start()
+    data = load()
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del data
+    return held, elapsed
+
+def run(n_users, n_accounts):
+    random.seed(0)
+    rows = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        legacy_json = json.dumps({str(i): synthetic_user(i, n_accounts, True) for i in range(n_users)})
+        plain_json = json.dumps({str(i): synthetic_user(i, n_accounts, False) for i in range(n_users)})
+        storage = database.SqliteStorage(os.path.join(tmp_dir, 'database.db'))
+        storage.save_all(json.loads(plain_json))
+
+        for name, load in (
+            ('dict', lambda: json.loads(legacy_json)),
+            ('dict (no logs)', lambda: json.loads(plain_json)),
+            ('UserRecord', storage.load_all),
+        ):
+            rows[name] = measure(load)
+        storage.conn.close()
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--accounts', type=int, default=2, help="accounts (session strings) per user")
+    args = parser.parse_args()
+
+    print(f"{'users':>8} {'representation':>15} {'memory':>10} {'per user':>10} {'load':>9}")
+    for n_users in args.sizes:
+        for name, (held, elapsed) in run(n_users, args.accounts).items():
+            print(f"{n_users:>8} {name:>15} {held / 2**20:>8.1f}MB {held / n_users:>9.0f}B {elapsed * 1000:>7.0f}ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+# broadcast.py
+import asyncio
+import json
+import logging
+import os
+import time
+
+from telethon.errors.rpcerrorlist import (
+    FloodWaitError, UserIsBlockedError, InputUserDeactivatedError, PeerIdInvalidError
+)
+
+from config import BROADCAST_RATE, BROADCAST_CONCURRENCY
+from database import write_file_atomic
+from outbound import set_outbound_priority, PRIORITY_BROADCAST
+from rate_limit import TokenBucket
+
+BROADCAST_JOB_FILE = 'broadcast_job.json'
+BROADCAST_PROGRESS_FILE = 'broadcast_job.progress'  # Cursor and counters, rewritten while the job runs
+BROADCAST_PROGRESS_INTERVAL = 5  # Minimum seconds between edits of the admin's progress message
+BROADCAST_SAVE_INTERVAL = 2      # Minimum seconds between progress writes
+BROADCAST_MAX_ATTEMPTS = 3       # Sends per recipient before a repeated FloodWait counts as a failure
+
+# Errors meaning the recipient can't receive messages from the bot until they /start it again.
+UNREACHABLE_ERRORS = (UserIsBlockedError, InputUserDeactivatedError, PeerIdInvalidError)
+
+PROGRESS_FIELDS = ('cursor', 'sent', 'failed', 'blocked')
+
+class BroadcastJob:
+    """A broadcast in progress: what to send, to whom, and how far it got.
+
+    The job itself, recipient list included, is written once when it is
+    created; while it runs only the small progress record is rewritten.
+    """
+
+    def __init__(self, admin_id, source_chat_id, source_message_id, recipients,
+                 cursor=0, sent=0, failed=0, blocked=0, skipped=0, started_at=None):
+        self.admin_id = admin_id
+        self.source_chat_id = source_chat_id
+        self.source_message_id = source_message_id
+        self.recipients = recipients
+        self.cursor = cursor  # Every recipient before this index has been handled
+        self.sent = sent
+        self.failed = failed
+        self.blocked = blocked
+        self.skipped = skipped  # Known-blocked users left out when the job was created
+        self.started_at = started_at or int(time.time())
+
+    @property
+    def done(self):
+        return self.cursor >= len(self.recipients)
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in (
+            'admin_id', 'source_chat_id', 'source_message_id', 'recipients',
+            'cursor', 'sent', 'failed', 'blocked', 'skipped', 'started_at'
+        )}
+
+    def save(self, path):
+        write_file_atomic(path, json.dumps(self.to_dict()).encode('utf-8'))
+
+    def save_progress(self, path):
+        # started_at ties the record to this job, so a leftover from another job is ignored.
+        progress = {key: getattr(self, key) for key in ('started_at',) + PROGRESS_FIELDS}
+        write_file_atomic(path, json.dumps(progress).encode('utf-8'))
+
+    @classmethod
+    def load(cls, path, progress_path=None):
+        try:
+            with open(path, 'r') as f:
+                job = cls(**json.load(f))
+        except FileNotFoundError:
+            return None
+        except (ValueError, TypeError) as e:
+            logging.error(f"Ignoring unreadable broadcast job file {path}: {e}")
+            return None
+        if progress_path is not None:
+            job._load_progress(progress_path)
+        return job
+
+    def _load_progress(self, path):
+        try:
+            with open(path, 'r') as f:
+                progress = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            logging.error(f"Ignoring unreadable broadcast progress file {path}: {e}")
+            return
+        if progress.get('started_at') == self.started_at:
+            for key in PROGRESS_FIELDS:
+                setattr(self, key, progress.get(key, getattr(self, key)))
+
+class BroadcastEngine:
+    """
+    Runs one broadcast at a time: sends concurrently under a token bucket,
+    pauses the whole bucket on FloodWait, and persists its cursor so a
+    broadcast interrupted by a restart picks up where it stopped.
+
+    The cursor is written every BROADCAST_SAVE_INTERVAL seconds, so after a
+    crash the last few recipients before it may receive the message twice.
+    Those writes only cover the cursor and counters, not the recipient list.
+    """
+
+    def __init__(self, bot, db, job_file=BROADCAST_JOB_FILE, rate=BROADCAST_RATE, concurrency=BROADCAST_CONCURRENCY,
+                 progress_file=BROADCAST_PROGRESS_FILE):
+        self.bot = bot
+        self.db = db
+        self.job_file = job_file
+        self.progress_file = progress_file
+        self.bucket = TokenBucket(rate)
+        self.concurrency = concurrency
+        self.job = None
+        self.task = None
+        self._cancelled = False
+
+    def is_running(self):
+        return self.task is not None and not self.task.done()
+
+    async def start(self, admin_id, source_message, recipients, skipped=0):
+        """Creates a job for `source_message` and starts sending it in the background."""
+        self.job = BroadcastJob(admin_id, source_message.chat_id, source_message.id, recipients, skipped=skipped)
+        await asyncio.to_thread(self._save_new_job)
+        progress = await self.bot.send_message(admin_id, self._status_text(), parse_mode='md')
+        self._spawn(source_message, progress)
+
+    async def resume(self):
+        """Restarts a job left over from a previous run, if there is one."""
+        job = await asyncio.to_thread(BroadcastJob.load, self.job_file, self.progress_file)
+        if job is None or self.is_running():
+            return
+        if job.done:
+            self._discard()
+            return
+        try:
+            source_message = await self.bot.get_messages(job.source_chat_id, ids=job.source_message_id)
+        except Exception as e:
+            source_message = None
+            logging.error(f"Could not reload the message of an interrupted broadcast: {e}")
+        if source_message is None:
+            logging.error("The message of an interrupted broadcast no longer exists; dropping the job.")
+            self._discard()
+            return
+        self.job = job
+        logging.info(f"Resuming broadcast at {job.cursor}/{len(job.recipients)} recipients.")
+        progress = await self.bot.send_message(job.admin_id, "📣 **Resuming interrupted broadcast...**\n\n" + self._status_text(), parse_mode='md')
+        self._spawn(source_message, progress)
+
+    async def cancel(self):
+        """Stops the running job and discards it. Returns False if nothing was running."""
+        if not self.is_running():
+            return False
+        self._cancelled = True
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        return True
+
+    def _save_new_job(self):
+        self.job.save(self.job_file)
+        self.job.save_progress(self.progress_file)
+
+    def _discard(self):
+        for path in (self.job_file, self.progress_file):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _spawn(self, source_message, progress):
+        self._cancelled = False
+        self.task = asyncio.create_task(self._run(source_message, progress))
+
+    def _status_text(self, title="📣 **Broadcast in progress**"):
+        job = self.job
+        return (
+            f"{title} — {job.cursor}/{len(job.recipients)} users\n"
+            f"✅ Sent: `{job.sent}`  ❌ Failed: `{job.failed}`  🚫 Blocked: `{job.blocked}`  ⏭ Skipped: `{job.skipped}`"
+        )
+
+    async def _edit(self, progress, text):
+        try:
+            await progress.edit(text, parse_mode='md')
+        except Exception as e:
+            logging.warning(f"Could not update broadcast progress: {e}")
+
+    async def _send_one(self, user_id, source_message):
+        for attempt in range(BROADCAST_MAX_ATTEMPTS):
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(user_id, source_message)
+                self.job.sent += 1
+                return
+            except FloodWaitError as e:
+                logging.warning(f"Broadcast hit a flood wait of {e.seconds}s; pausing all sends.")
+                self.bucket.pause(e.seconds)
+            except UNREACHABLE_ERRORS as e:
+                logging.info(f"Broadcast: user {user_id} is unreachable ({type(e).__name__}); marking as blocked.")
+                self.job.blocked += 1
+                await self.db.update(user_id, 'bot_blocked', True)
+                return
+            except Exception as e:
+                logging.warning(f"Broadcast failed for user {user_id}: {e}")
+                self.job.failed += 1
+                return
+        self.job.failed += 1
+
+    async def _run(self, source_message, progress):
+        set_outbound_priority(PRIORITY_BROADCAST)
+        job = self.job
+        last_save = last_edit = time.monotonic()
+        try:
+            while not job.done:
+                batch = job.recipients[job.cursor:job.cursor + self.concurrency]
+                await asyncio.gather(*(self._send_one(user_id, source_message) for user_id in batch))
+                job.cursor += len(batch)
+                now = time.monotonic()
+                if now - last_save >= BROADCAST_SAVE_INTERVAL:
+                    await asyncio.to_thread(job.save_progress, self.progress_file)
+                    last_save = now
+                if now - last_edit >= BROADCAST_PROGRESS_INTERVAL:
+                    await self._edit(progress, self._status_text())
+                    last_edit = now
+        except asyncio.CancelledError:
+            if not self._cancelled:
+                # Shutdown: keep the job on disk so the next start resumes it.
+                await asyncio.to_thread(job.save_progress, self.progress_file)
+                raise
+            self._discard()
+            await self._edit(progress, self._status_text("🛑 **Broadcast cancelled**"))
+            raise
+        except Exception as e:
+            logging.error(f"Broadcast stopped unexpectedly; it will resume on restart: {e}")
+            await asyncio.to_thread(job.save_progress, self.progress_file)
+            await self._edit(progress, self._status_text("⚠️ **Broadcast interrupted**"))
+            return
+        self._discard()
+        elapsed = int(time.time()) - job.started_at
+        await self._edit(progress, self._status_text("**📣 Broadcast Complete!**") + f"\n⏱ Took {elapsed}s.")
+        logging.info(f"Broadcast finished: {job.sent} sent, {job.failed} failed, {job.blocked} blocked, {job.skipped} skipped.")
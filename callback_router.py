@@ -0,0 +1,81 @@
+# callback_router.py
+import time
+
+from metrics import registry
+
+CALLBACK_SECONDS = registry.histogram('adbot_callback_seconds', "Button press handling time by route, including the user lookup")
+
+class CallbackContext:
+    """Everything a callback handler needs, resolved once per button press.
+
+    `user` is the live cached user record, so changes made through
+    `db.update` are already visible on it when a keyboard is rebuilt.
+    `arg` is whatever followed the matched prefix (empty for exact routes).
+    """
+    __slots__ = ('event', 'user_id', 'data', 'arg', 'user')
+
+    def __init__(self, event, user_id, data, arg='', user=None):
+        self.event = event
+        self.user_id = user_id
+        self.data = data
+        self.arg = arg
+        self.user = user
+
+class CallbackRouter:
+    """Dispatches callback payloads through an exact-match table, then a prefix table.
+
+    Middleware runs once per press before the handler; returning True from a
+    middleware stops the dispatch.
+    """
+
+    def __init__(self, load_user):
+        self.load_user = load_user
+        self.routes = {}
+        self.prefix_routes = []
+        self.middleware = []
+
+    def route(self, *payloads):
+        def decorator(handler):
+            for payload in payloads:
+                self.routes[payload] = handler
+            return handler
+        return decorator
+
+    def prefix(self, prefix):
+        def decorator(handler):
+            self.prefix_routes.append((prefix, handler))
+            # Longest prefix first so "remove_account_" can't be shadowed by a shorter one.
+            self.prefix_routes.sort(key=lambda item: len(item[0]), reverse=True)
+            return handler
+        return decorator
+
+    def use(self, middleware):
+        self.middleware.append(middleware)
+        return middleware
+
+    def resolve(self, data):
+        """Returns (handler, arg) for a payload, or (None, '') if nothing matches."""
+        handler = self.routes.get(data)
+        if handler is not None:
+            return handler, ''
+        for prefix, handler in self.prefix_routes:
+            if data.startswith(prefix):
+                return handler, data[len(prefix):]
+        return None, ''
+
+    async def dispatch(self, event):
+        started = time.perf_counter()
+        data = event.data.decode()
+        handler, arg = self.resolve(data)
+        route = handler.__name__ if handler is not None else 'unmatched'
+        try:
+            ctx = CallbackContext(event, event.sender_id, data, arg)
+            ctx.user = await self.load_user(ctx.user_id)
+            for middleware in self.middleware:
+                if await middleware(ctx):
+                    route = middleware.__name__
+                    return
+            if handler is not None:
+                await handler(ctx)
+        finally:
+            CALLBACK_SECONDS.observe(time.perf_counter() - started, route=route)
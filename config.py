@@ -9,3 +9,36 @@ BOT_TOKEN = "7216502845:AAGRPaUPVuinMzdqeEnbU8nCU-dMeTl4gog"  # Replace with you
 
 # Admin user IDs (list of integers)
 ADMIN_IDS = [8145805918, 987654321]  # Replace with actual admin user IDs
+
+# Startup: how many stored sessions may connect at once, and how long one connect may take (seconds)
+CLIENT_CONNECT_CONCURRENCY = 20
+CLIENT_CONNECT_TIMEOUT = 30
+
+# Account client pool: cap on live connections, idle seconds before an unused client is
+# disconnected, and seconds between health checks of the live clients
+CLIENT_POOL_MAX_LIVE = 200
+CLIENT_IDLE_TIMEOUT = 600
+CLIENT_HEALTH_INTERVAL = 60
+
+# Broadcasts: messages per second across all recipients (the bot API allows about 30)
+# and how many sends may be in flight at once
+BROADCAST_RATE = 20
+BROADCAST_CONCURRENCY = 10
+
+# Outbound bot messages: global messages per second, per-chat rate and burst, and how many
+# sends may be in flight at once. Interactive replies are served before scheduler notices
+# and broadcasts whenever the global limit is reached.
+OUTBOUND_GLOBAL_RATE = 28
+OUTBOUND_CHAT_RATE = 1
+OUTBOUND_CHAT_BURST = 5
+OUTBOUND_WORKERS = 8
+
+# Metrics: set METRICS_PORT (e.g. 9108) to serve Prometheus text at http://METRICS_HOST:METRICS_PORT/metrics.
+# Keep the host on loopback; the endpoint has no authentication.
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = None
+
+# Event-loop monitor: seconds between lag probes, and how long the loop may be blocked
+# before the blocking code is recorded with a stack sample (see /admin loop)
+LOOP_LAG_INTERVAL = 0.1
+SLOW_CALLBACK_THRESHOLD = 0.1
@@ -1,83 +1,805 @@
 # database.py
+import atexit
 import json
+import logging
 import os
-from threading import Lock
-from datetime import datetime
+import sqlite3
+import struct
+from itertools import islice
+from threading import RLock, Thread, Timer
+
+from activity_log import log_event
+from metrics import registry
 
 DB_FILE = 'database.json'
-db_lock = Lock()
+SQLITE_FILE = 'database.db'
+JOURNAL_FILE = 'database.journal'
+STORAGE_BACKEND = 'sqlite'  # 'sqlite', 'journal' or 'json'
+JOURNAL_COMPACT_RECORDS = 1000  # Journal records always allowed before a snapshot is taken
+JOURNAL_COMPACT_RATIO = 2  # ...and beyond that, journal records allowed per live user record
+CACHE_FLUSH_INTERVAL = 2.0  # Seconds dirty records may wait before being written in one batch
+SNAPSHOT_FORMAT = 'json'  # How the JSON/journal backends write database.json: 'json', 'json-pretty' or 'records'
 
-def load_data():
-    """Loads user data from the JSON file."""
-    with db_lock:
-        if not os.path.exists(DB_FILE):
-            return {}
+DB_OP_SECONDS = registry.histogram('adbot_db_op_seconds', "Duration of user database operations that reach storage")
+DB_BYTES_READ = registry.counter('adbot_db_bytes_read_total', "Serialized user data read from storage")
+DB_BYTES_WRITTEN = registry.counter('adbot_db_bytes_written_total', "Serialized user data written to storage")
+DB_RECORDS_FLUSHED = registry.counter('adbot_db_records_flushed_total', "Dirty user records written by cache flushes")
+db_lock = RLock()
+
+# Fields mirrored into their own indexed SQLite columns so they can be queried
+# without decoding every user record.
+INDEXED_FIELDS = ('is_premium', 'is_banned', 'adbot_status', 'state')
+
+# Admin counters kept up to date on every write; see UserCache.get_aggregates().
+AGGREGATE_FIELDS = ('premium', 'banned', 'adbot_active', 'accounts')
+
+def record_contribution(record):
+    """A record's share of each aggregate counter, in AGGREGATE_FIELDS order."""
+    return (
+        int(bool(record.get('is_premium'))),
+        int(bool(record.get('is_banned'))),
+        int(bool(record.get('adbot_status'))),
+        UserRecord.coerce(record).account_count(),
+    )
+
+# Every user field with its default. 'accounts' (name -> StringSession) is kept
+# out of this table because UserRecord decodes it lazily.
+USER_FIELDS = {
+    'username': None,
+    'is_banned': False, # New: Ban status
+    'adbot_status': False,
+    'forward_delay': 5,
+    'saved_message': None,
+    'state': None,
+    'has_agreed': False,
+    'is_premium': False,
+    'start_time': None,
+    'stop_time': None,
+    'report_mode': 'summary',
+    'bot_blocked': False,
+}
+
+class UserRecord:
+    """
+    One user's data, with a slot per field instead of a per-user dict.
+
+    It supports the dict operations the handlers use (get, [], in, update,
+    items), so it can be passed anywhere a record dict was. The account
+    session strings are the heavy part of a record: when a backend hands
+    them over as raw JSON they stay encoded until `accounts` is first read,
+    and are written back without re-encoding if nobody touched them. Keys
+    that aren't known fields (e.g. legacy 'logs') are kept in `_extra`.
+    """
+    __slots__ = tuple(USER_FIELDS) + ('_accounts', '_accounts_raw', '_extra')
+
+    def __init__(self, **fields):
+        for name, default in USER_FIELDS.items():
+            setattr(self, name, default)
+        self._accounts = None
+        self._accounts_raw = None
+        self._extra = None
+        self.update(fields)
+
+    @classmethod
+    def from_dict(cls, data, accounts_raw=None):
+        """Builds a record from a stored dict; `accounts_raw` is the accounts JSON if it was stored separately."""
+        record = cls.__new__(cls)
+        get = data.get
+        for name, default in USER_FIELDS.items():
+            setattr(record, name, get(name, default))
+        record._accounts = get('accounts')
+        record._accounts_raw = accounts_raw if record._accounts is None else None
+        extra = data.keys() - _KNOWN_KEYS
+        record._extra = {key: data[key] for key in extra} if extra else None
+        return record
+
+    @classmethod
+    def coerce(cls, value):
+        return value if isinstance(value, cls) else cls.from_dict(value)
+
+    @property
+    def accounts(self):
+        if self._accounts is None:
+            self._accounts = json.loads(self._accounts_raw) if self._accounts_raw else {}
+            self._accounts_raw = None
+        return self._accounts
+
+    @accounts.setter
+    def accounts(self, value):
+        self._accounts = value
+        self._accounts_raw = None
+
+    def accounts_json(self):
+        """The accounts as JSON, reusing the stored encoding if they were never decoded."""
+        if self._accounts is None:
+            return self._accounts_raw or '{}'
+        return json.dumps(self._accounts, separators=(',', ':'))
+
+    def account_count(self):
+        """Number of accounts, counted on the stored JSON if it was never decoded.
+
+        That JSON comes from accounts_json(): compact, mapping names to session
+        strings. Quotes inside names are escaped, so '":"' occurs exactly once
+        per entry and nowhere else.
+        """
+        if self._accounts is None:
+            return self._accounts_raw.count('":"') if self._accounts_raw else 0
+        return len(self._accounts)
+
+    def to_json(self):
+        """The whole record as compact JSON; accounts that were never decoded are copied in as stored."""
+        fields = _compact_json.encode(self.to_dict(include_accounts=False))
+        return fields[:-1] + ',"accounts":' + self.accounts_json() + '}'
+
+    def __getitem__(self, key):
+        if key == 'accounts':
+            return self.accounts
+        if key in USER_FIELDS:
+            return getattr(self, key)
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key == 'accounts' or key in USER_FIELDS:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if self._extra is None or key not in self._extra:
+            raise KeyError(key)
+        del self._extra[key]
+
+    def __contains__(self, key):
+        return key == 'accounts' or key in USER_FIELDS or (self._extra is not None and key in self._extra)
+
+    def get(self, key, default=None):
         try:
-            with open(DB_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, IOError):
-            return {}
+            return self[key]
+        except KeyError:
+            return default
 
-def save_data(data):
-    """Saves the provided data to the JSON file."""
+    def update(self, fields=(), **more):
+        for key, value in dict(fields, **more).items():
+            self[key] = value
+
+    def keys(self):
+        return list(USER_FIELDS) + ['accounts'] + list(self._extra or ())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def to_dict(self, include_accounts=True):
+        data = {name: getattr(self, name) for name in USER_FIELDS}
+        if include_accounts:
+            data['accounts'] = self.accounts
+        if self._extra:
+            data.update(self._extra)
+        return data
+
+# Login-flow fields older versions persisted; they now live in login_sessions and are dropped on load.
+OBSOLETE_FIELDS = frozenset({'temp_phone_number', 'temp_phone_code_hash', 'temp_otp_digits'})
+_KNOWN_KEYS = frozenset(USER_FIELDS) | {'accounts'} | OBSOLETE_FIELDS
+
+def default_user_record():
+    """Returns the record a brand new user starts with."""
+    return UserRecord()
+
+def plain_records(data):
+    """Turns {user_id_str: record} into JSON-serializable dicts."""
+    return {user_id_str: UserRecord.coerce(record).to_dict() for user_id_str, record in data.items()}
+
+def write_file_atomic(path, payload):
+    """Writes bytes to a temp file, fsyncs it and renames it over `path`."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class JsonFormat:
+    """Compact JSON: one object mapping user ids to records."""
+    name = 'json'
+    indent = None
+    separators = (',', ':')
+
+    def dumps(self, data):
+        if self.indent is None:
+            encode = _compact_json.encode
+            return ('{' + ','.join(f'{encode(user_id_str)}:{UserRecord.coerce(record).to_json()}'
+                                   for user_id_str, record in data.items()) + '}').encode('utf-8')
+        return json.dumps(plain_records(data), indent=self.indent, separators=self.separators).encode('utf-8')
+
+    def loads(self, payload):
+        return {user_id_str: UserRecord.from_dict(record) for user_id_str, record in json.loads(payload).items()}
+
+class PrettyJsonFormat(JsonFormat):
+    """The original indented layout; about twice the size of compact JSON."""
+    name = 'json-pretty'
+    indent = 4
+    separators = None
+
+class RecordFileFormat:
+    """
+    Binary file of length-prefixed records: a magic header, then per user a
+    struct of three lengths followed by the user id, the record's fields as
+    compact JSON, and its accounts JSON. The accounts are stored as their own
+    blob so UserRecord can keep them encoded, and a record loaded from this
+    format writes its untouched sessions back without re-encoding them.
+    """
+    name = 'records'
+    MAGIC = b'UREC\x01'
+    HEADER = struct.Struct('<HII')
+
+    def dumps(self, data):
+        parts = [self.MAGIC]
+        encode = _compact_json.encode
+        for user_id_str, record in data.items():
+            record = UserRecord.coerce(record)
+            key = user_id_str.encode('utf-8')
+            fields = encode(record.to_dict(include_accounts=False)).encode('utf-8')
+            accounts = record.accounts_json().encode('utf-8')
+            parts += (self.HEADER.pack(len(key), len(fields), len(accounts)), key, fields, accounts)
+        return b''.join(parts)
+
+    def loads(self, payload):
+        if not payload.startswith(self.MAGIC):
+            raise ValueError('not a record file')
+        offset = len(self.MAGIC)
+        keys, fields, accounts = [], [], []
+        while offset < len(payload):
+            if offset + self.HEADER.size > len(payload):
+                raise ValueError('truncated record header')
+            key_len, fields_len, accounts_len = self.HEADER.unpack_from(payload, offset)
+            offset += self.HEADER.size
+            end = offset + key_len + fields_len + accounts_len
+            if end > len(payload):
+                raise ValueError('truncated record')
+            keys.append(payload[offset:offset + key_len].decode('utf-8'))
+            fields.append(payload[offset + key_len:end - accounts_len])
+            accounts.append(payload[end - accounts_len:end].decode('utf-8'))
+            offset = end
+        # One json.loads over all the field blobs is much faster than one call per record.
+        parsed = json.loads(b'[' + b','.join(fields) + b']')
+        if len(parsed) != len(keys):
+            # A damaged length can shift blob boundaries and still leave valid JSON behind.
+            raise ValueError('corrupt record lengths')
+        return {key: UserRecord.from_dict(record, raw) for key, record, raw in zip(keys, parsed, accounts)}
+
+_compact_json = json.JSONEncoder(separators=(',', ':'))
+
+FORMATS = {fmt.name: fmt for fmt in (JsonFormat(), PrettyJsonFormat(), RecordFileFormat())}
+
+def detect_format(payload):
+    """Returns the format a serialized database was written in (any JSON layout reads as 'json')."""
+    return FORMATS['records'] if payload.startswith(RecordFileFormat.MAGIC) else FORMATS['json']
+
+class JsonStorage:
+    """Legacy storage: the whole database lives in one file, written in SNAPSHOT_FORMAT.
+
+    Reading detects the format from the file itself, so changing
+    SNAPSHOT_FORMAT converts the file on the next write.
+    """
+
+    def __init__(self, path=DB_FILE, fmt=None):
+        self.path = path
+        self.format = FORMATS[fmt or SNAPSHOT_FORMAT]
+
+    def load_all(self):
+        with db_lock:
+            if not os.path.exists(self.path):
+                return {}
+            try:
+                with open(self.path, 'rb') as f:
+                    payload = f.read()
+                DB_BYTES_READ.inc(len(payload), backend='json')
+                return detect_format(payload).loads(payload)
+            except (ValueError, IOError):
+                return {}
+
+    def save_all(self, data):
+        with db_lock:
+            payload = self.format.dumps(data)
+            write_file_atomic(self.path, payload)
+            DB_BYTES_WRITTEN.inc(len(payload), backend='json')
+
+    def get(self, user_id_str):
+        return self.load_all().get(user_id_str)
+
+    def put(self, user_id_str, record):
+        with db_lock:
+            data = self.load_all()
+            data[user_id_str] = record
+            self.save_all(data)
+
+    def put_many(self, records):
+        with db_lock:
+            data = self.load_all()
+            data.update(records)
+            self.save_all(data)
+
+    def load_states(self):
+        return {user_id_str: record['state'] for user_id_str, record in self.load_all().items() if record.get('state')}
+
+    def page(self, offset, limit):
+        return list(islice(self.load_all().items(), offset, offset + limit))
+
+class SqliteStorage:
+    """One row per user, with the hot flags copied into indexed columns."""
+
+    def __init__(self, path=SQLITE_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            " user_id TEXT PRIMARY KEY,"
+            " is_premium INTEGER NOT NULL DEFAULT 0,"
+            " is_banned INTEGER NOT NULL DEFAULT 0,"
+            " adbot_status INTEGER NOT NULL DEFAULT 0,"
+            " state TEXT,"
+            " data TEXT NOT NULL,"
+            " accounts TEXT)"
+        )
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(users)")]
+        if 'accounts' not in columns:
+            # Older databases keep the accounts inside `data`; rows move them out as they are rewritten.
+            self.conn.execute("ALTER TABLE users ADD COLUMN accounts TEXT")
+        for field in INDEXED_FIELDS:
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS idx_users_{field} ON users ({field})")
+
+    INSERT = "INSERT OR REPLACE INTO users (user_id, is_premium, is_banned, adbot_status, state, data, accounts) VALUES (?, ?, ?, ?, ?, ?, ?)"
+
+    @staticmethod
+    def _row(user_id_str, record):
+        record = UserRecord.coerce(record)
+        return (
+            user_id_str,
+            int(bool(record.is_premium)),
+            int(bool(record.is_banned)),
+            int(bool(record.adbot_status)),
+            record.state,
+            json.dumps(record.to_dict(include_accounts=False), separators=(',', ':')),
+            record.accounts_json(),
+        )
+
+    @staticmethod
+    def _size(rows, data_column):
+        """Bytes of serialized user data (data + accounts columns) in `rows`."""
+        return sum(len(row[data_column]) + len(row[data_column + 1] or '') for row in rows)
+
+    def load_all(self):
+        with db_lock:
+            rows = self.conn.execute("SELECT user_id, data, accounts FROM users").fetchall()
+        DB_BYTES_READ.inc(self._size(rows, 1), backend='sqlite')
+        return {user_id_str: UserRecord.from_dict(json.loads(data), accounts) for user_id_str, data, accounts in rows}
+
+    def save_all(self, data):
+        with db_lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.execute("DELETE FROM users")
+                rows = [self._row(user_id_str, record) for user_id_str, record in data.items()]
+                self.conn.executemany(self.INSERT, rows)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            DB_BYTES_WRITTEN.inc(self._size(rows, 5), backend='sqlite')
+
+    def get(self, user_id_str):
+        with db_lock:
+            row = self.conn.execute("SELECT data, accounts FROM users WHERE user_id = ?", (user_id_str,)).fetchone()
+        if row:
+            DB_BYTES_READ.inc(self._size([row], 0), backend='sqlite')
+        return UserRecord.from_dict(json.loads(row[0]), row[1]) if row else None
+
+    def put(self, user_id_str, record):
+        row = self._row(user_id_str, record)
+        with db_lock:
+            self.conn.execute(self.INSERT, row)
+        DB_BYTES_WRITTEN.inc(self._size([row], 5), backend='sqlite')
+
+    def put_many(self, records):
+        with db_lock:
+            self.conn.execute("BEGIN")
+            try:
+                rows = [self._row(user_id_str, record) for user_id_str, record in records.items()]
+                self.conn.executemany(self.INSERT, rows)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            DB_BYTES_WRITTEN.inc(self._size(rows, 5), backend='sqlite')
+
+    def load_states(self):
+        with db_lock:
+            return dict(self.conn.execute("SELECT user_id, state FROM users WHERE state IS NOT NULL").fetchall())
+
+    def count(self):
+        with db_lock:
+            return self.conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def page(self, offset, limit):
+        with db_lock:
+            rows = self.conn.execute(
+                "SELECT user_id, data, accounts FROM users ORDER BY user_id LIMIT ? OFFSET ?", (limit, offset)
+            ).fetchall()
+        DB_BYTES_READ.inc(self._size(rows, 1), backend='sqlite')
+        return [(user_id_str, UserRecord.from_dict(json.loads(data), accounts)) for user_id_str, data, accounts in rows]
+
+    def migrate_from_json(self, json_path=DB_FILE):
+        """One-shot import of a legacy database.json into an empty SQLite database.
+
+        The JSON file is renamed to `<name>.migrated` afterwards so it is never imported twice.
+        Returns the number of users imported.
+        """
+        if self.count() or not os.path.exists(json_path):
+            return 0
+        data = JsonStorage(json_path).load_all()
+        self.save_all(data)
+        os.replace(json_path, json_path + '.migrated')
+        return len(data)
+
+class JournalStorage:
+    """Snapshot file plus an append-only journal of per-user upserts.
+
+    Every write appends one small line to the journal, so its cost does not
+    depend on the size of the database. On startup the snapshot is loaded and
+    the journal replayed on top of it. Once the journal holds more than
+    `compact_records` entries and more than `compact_ratio` entries per live
+    record, a background thread writes a fresh snapshot (atomic rename) and
+    truncates the journal. Scaling the threshold with the snapshot size keeps
+    the snapshot cost amortized O(1) per write, and recovery time bounded.
+    """
+
+    def __init__(self, snapshot_path=DB_FILE, journal_path=JOURNAL_FILE, compact_records=JOURNAL_COMPACT_RECORDS,
+                 compact_ratio=JOURNAL_COMPACT_RATIO):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.compact_records = compact_records
+        self.compact_ratio = compact_ratio
+        self.data = JsonStorage(snapshot_path).load_all()
+        self.journal_records = self._replay()
+        self._journal = open(journal_path, 'a', encoding='utf-8')
+        self._compacting = False
+
+    def _replay(self):
+        if not os.path.exists(self.journal_path):
+            return 0
+        replayed = 0
+        good_bytes = 0
+        with open(self.journal_path, 'rb') as f:
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError('unterminated record')
+                    entry = json.loads(line)
+                except ValueError:
+                    # A torn final line from a crash mid-append; drop it so new records start clean.
+                    logging.warning(f"Discarding truncated journal record in {self.journal_path}.")
+                    break
+                self.data[entry['u']] = UserRecord.from_dict(entry['r'])
+                replayed += 1
+                good_bytes += len(line)
+        os.truncate(self.journal_path, good_bytes)
+        return replayed
+
+    def _append(self, records):
+        encode = _compact_json.encode
+        lines = ''.join(f'{{"u":{encode(user_id_str)},"r":{UserRecord.coerce(record).to_json()}}}\n'
+                        for user_id_str, record in records.items())
+        self._journal.write(lines)
+        self._journal.flush()
+        DB_BYTES_WRITTEN.inc(len(lines), backend='journal')
+        os.fsync(self._journal.fileno())
+        self.journal_records += len(records)
+        if self.journal_records >= max(self.compact_records, self.compact_ratio * len(self.data)) and not self._compacting:
+            self._compacting = True
+            Thread(target=self.compact, daemon=True).start()
+
+    def load_all(self):
+        with db_lock:
+            return dict(self.data)
+
+    def save_all(self, data):
+        with db_lock:
+            self.data = {user_id_str: UserRecord.coerce(record) for user_id_str, record in data.items()}
+            self.compact()
+
+    def get(self, user_id_str):
+        with db_lock:
+            return self.data.get(user_id_str)
+
+    def load_states(self):
+        with db_lock:
+            return {user_id_str: record['state'] for user_id_str, record in self.data.items() if record.get('state')}
+
+    def page(self, offset, limit):
+        with db_lock:
+            return list(islice(self.data.items(), offset, offset + limit))
+
+    def put(self, user_id_str, record):
+        self.put_many({user_id_str: record})
+
+    def put_many(self, records):
+        with db_lock:
+            self.data.update((user_id_str, UserRecord.coerce(record)) for user_id_str, record in records.items())
+            self._append(records)
+
+    def compact(self):
+        """Writes a fresh snapshot and truncates the journal."""
+        with db_lock:
+            try:
+                payload = FORMATS[SNAPSHOT_FORMAT].dumps(self.data)
+                write_file_atomic(self.snapshot_path, payload)
+                DB_BYTES_WRITTEN.inc(len(payload), backend='json')
+                self._journal.close()
+                self._journal = open(self.journal_path, 'w', encoding='utf-8')
+                self.journal_records = 0
+            finally:
+                self._compacting = False
+
+class UserCache:
+    """Write-back cache of user records in front of a storage backend.
+
+    Reads are served from memory after the first miss. Mutations only mark the
+    record dirty; dirty records are written to storage in one batch after
+    CACHE_FLUSH_INTERVAL seconds, on flush(), or at interpreter exit.
+
+    The admin aggregates are counted with one full scan the first time they
+    are asked for; after that every put() adjusts them by the difference
+    between the record's old and new contribution.
+    """
+
+    def __init__(self, storage, flush_interval=CACHE_FLUSH_INTERVAL):
+        self.storage = storage
+        self.flush_interval = flush_interval
+        self.records = {}
+        self.dirty = set()
+        self._timer = None
+        self.stats = {'hits': 0, 'misses': 0, 'mutations': 0, 'flushes': 0, 'records_flushed': 0}
+        self._contributions = None  # user_id_str -> record_contribution(), once aggregates are built
+        self._aggregates = None
+
+    def get(self, user_id_str):
+        with db_lock:
+            record = self.records.get(user_id_str)
+            if record is not None:
+                self.stats['hits'] += 1
+                return record
+            self.stats['misses'] += 1
+            with DB_OP_SECONDS.time(op='get'):
+                record = self.storage.get(user_id_str)
+            if record is not None:
+                self.records[user_id_str] = record
+            return record
+
+    def peek(self, user_id_str):
+        """Returns the cached record, or None if it isn't cached or the lock is busy. Never blocks."""
+        if not db_lock.acquire(blocking=False):
+            return None
+        try:
+            record = self.records.get(user_id_str)
+            if record is not None:
+                self.stats['hits'] += 1
+            return record
+        finally:
+            db_lock.release()
+
+    def put(self, user_id_str, record):
+        record = UserRecord.coerce(record)
+        with db_lock:
+            self.records[user_id_str] = record
+            self.dirty.add(user_id_str)
+            self.stats['mutations'] += 1
+            self._track(user_id_str, record)
+            if self._timer is None and self.flush_interval is not None:
+                self._timer = Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Writes every dirty record to storage in a single batch."""
+        with db_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self.dirty:
+                return 0
+            batch = {user_id_str: self.records[user_id_str] for user_id_str in self.dirty}
+            with DB_OP_SECONDS.time(op='flush'):
+                self.storage.put_many(batch)
+            DB_RECORDS_FLUSHED.inc(len(batch))
+            self.dirty.clear()
+            self.stats['flushes'] += 1
+            self.stats['records_flushed'] += len(batch)
+            return len(batch)
+
+    def load_all(self):
+        with db_lock, DB_OP_SECONDS.time(op='load_all'):
+            data = self.storage.load_all()
+            data.update(self.records)
+            return data
+
+    def load_states(self):
+        with db_lock:
+            states = self.storage.load_states()
+            for user_id_str, record in self.records.items():
+                if record.get('state'):
+                    states[user_id_str] = record['state']
+                else:
+                    states.pop(user_id_str, None)
+            return states
+
+    def save_all(self, data):
+        with db_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self.records.clear()
+            self.dirty.clear()
+            self._contributions = self._aggregates = None
+            with DB_OP_SECONDS.time(op='save_all'):
+                self.storage.save_all(data)
+
+    def page(self, offset, limit):
+        """Returns up to `limit` (user_id_str, record) pairs in the backend's stable order, starting at `offset`."""
+        with db_lock:
+            self.flush()
+            return self.storage.page(offset, limit)
+
+    def _track(self, user_id_str, record):
+        if self._contributions is None:
+            return
+        new = record_contribution(record)
+        old = self._contributions.get(user_id_str)
+        if old is None:
+            self._aggregates['total'] += 1
+            old = (0,) * len(AGGREGATE_FIELDS)
+        if new != old:
+            for field, before, after in zip(AGGREGATE_FIELDS, old, new):
+                self._aggregates[field] += after - before
+        self._contributions[user_id_str] = new
+
+    def get_aggregates(self):
+        """Returns {'total', 'premium', 'banned', 'adbot_active', 'accounts'} counts over all users."""
+        with db_lock:
+            if self._contributions is None:
+                self._contributions = {}
+                self._aggregates = dict.fromkeys(('total',) + AGGREGATE_FIELDS, 0)
+                for user_id_str, record in self.load_all().items():
+                    self._track(user_id_str, record)
+            return dict(self._aggregates)
+
+    def get_stats(self):
+        """Reads the counters without db_lock, like peek(), so the event loop never waits on a flush.
+
+        Each value is read atomically, but a flush running meanwhile may leave
+        them a few records apart.
+        """
+        stats = dict(self.stats)
+        stats['cached'] = len(self.records)
+        stats['dirty'] = len(self.dirty)
+        stats['writes_saved'] = max(0, stats['mutations'] - stats['records_flushed'] - stats['dirty'])
+        return stats
+
+_storage = None
+
+def get_storage():
+    """Returns the cached storage backend, opening it on first use."""
+    global _storage
+    if _storage is not None:
+        return _storage
     with db_lock:
-        with open(DB_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=4)
+        if _storage is None:
+            if STORAGE_BACKEND == 'sqlite':
+                backend = SqliteStorage(SQLITE_FILE)
+                backend.migrate_from_json(DB_FILE)
+            elif STORAGE_BACKEND == 'journal':
+                backend = JournalStorage(DB_FILE, JOURNAL_FILE)
+            else:
+                backend = JsonStorage(DB_FILE)
+            _storage = UserCache(backend, CACHE_FLUSH_INTERVAL)
+        return _storage
+
+def flush_cache():
+    """Writes any pending cached changes to disk. Called automatically at exit."""
+    if _storage is not None:
+        _storage.flush()
+
+def get_cache_stats():
+    """Returns hit/miss/flush counters for the user cache."""
+    return get_storage().get_stats()
+
+atexit.register(flush_cache)
+
+def get_user_aggregates():
+    """Returns the admin counters (total, premium, banned, adbot_active, accounts)."""
+    return get_storage().get_aggregates()
+
+def get_users_page(offset, limit):
+    """Returns one page of (user_id_str, record) pairs, so callers never hold every user at once."""
+    return get_storage().page(offset, limit)
+
+def peek_user_data(user_id):
+    """Returns a user's record only if it can be served from memory right now, else None."""
+    return get_storage().peek(str(user_id))
+
+def load_data():
+    """Loads all user data from storage."""
+    return get_storage().load_all()
+
+def save_data(data):
+    """Replaces the stored data with the provided data."""
+    get_storage().save_all(data)
 
 def get_user_data(user_id):
     """Retrieves data for a specific user, creating it if it doesn't exist."""
     user_id_str = str(user_id)
-    data = load_data()
-    if user_id_str not in data:
-        data[user_id_str] = {
-            'username': None,
-            'logs': [],
-            'is_banned': False, # New: Ban status
-            'adbot_status': False,
-            'forward_delay': 5,
-            'saved_message': None,
-            'accounts': {},
-            'state': None,
-            'has_agreed': False,
-            'is_premium': False,
-            'start_time': None,
-            'stop_time': None,
-            'temp_phone_number': None,
-            'temp_phone_code_hash': None,
-            'temp_otp_digits': ""
-        }
-        save_data(data)
-    return data[user_id_str]
+    storage = get_storage()
+    with db_lock:
+        record = storage.get(user_id_str)
+        if record is None:
+            record = default_user_record()
+            storage.put(user_id_str, record)
+    return record
 
 def update_user_data(user_id, key, value):
     """Updates a specific key for a user."""
     user_id_str = str(user_id)
-    data = load_data()
-    if user_id_str not in data:
-        get_user_data(user_id)
-        data = load_data()
-    data[user_id_str][key] = value
-    save_data(data)
+    with db_lock:
+        record = get_user_data(user_id)
+        record[key] = value
+        get_storage().put(user_id_str, record)
 
-def add_log_entry(user_id, log_message):
-    """Adds a new timestamped log entry for a user."""
+def load_states():
+    """Returns {user_id_str: state} for every user with a conversation state set."""
+    return get_storage().load_states()
+
+def update_user_fields(user_id, fields):
+    """Updates several keys for a user as one mutation."""
     user_id_str = str(user_id)
-    data = load_data()
-    if user_id_str in data:
-        if 'logs' not in data[user_id_str]:
-            data[user_id_str]['logs'] = []
-        
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        data[user_id_str]['logs'] = data[user_id_str]['logs'][-49:] 
-        data[user_id_str]['logs'].append(f"[{timestamp}] {log_message}")
-        save_data(data)
+    with db_lock:
+        record = get_user_data(user_id)
+        record.update(fields)
+        get_storage().put(user_id_str, record)
+
+def update_user_fields_many(user_ids, fields):
+    """Applies the same field updates to several users."""
+    with db_lock:
+        for user_id in user_ids:
+            update_user_fields(user_id, fields)
+
+def add_log_entry(user_id, log_message):
+    """Adds a free-text entry to a user's activity log (see activity_log.log_event for coded events)."""
+    log_event(user_id, 'text', log_message)
+
+def strip_legacy_logs():
+    """Drops the old inline 'logs' lists from user records once they live in the activity log."""
+    storage = get_storage()
+    with db_lock:
+        for user_id_str, record in storage.load_all().items():
+            if 'logs' in record:
+                del record['logs']
+                storage.put(user_id_str, record)
 
 def delete_user_account(user_id, account_name):
     """Deletes a specific account for a user."""
     user_id_str = str(user_id)
-    data = load_data()
-    if user_id_str in data and account_name in data[user_id_str].get('accounts', {}):
-        del data[user_id_str]['accounts'][account_name]
-        save_data(data)
-        return True
+    storage = get_storage()
+    with db_lock:
+        record = storage.get(user_id_str)
+        if record is not None and account_name in record.get('accounts', {}):
+            del record['accounts'][account_name]
+            storage.put(user_id_str, record)
+            return True
     return False
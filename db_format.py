@@ -0,0 +1,126 @@
+# db_format.py
+"""Converts the user database between storage formats and verifies round-trips.
+
+  python db_format.py info FILE
+  python db_format.py convert SRC DST --to {json,json-pretty,records,sqlite} [--force]
+  python db_format.py verify FILE
+
+FILE/SRC may be any format database.py can read, including an SQLite
+database.db. `convert` reloads what it wrote and compares it with the source
+before reporting success; `verify` round-trips FILE through every format.
+Stop the bot before converting the database it is using.
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+from database import FORMATS, SqliteStorage, detect_format, plain_records, write_file_atomic
+
+SQLITE_MAGIC = b'SQLite format 3\x00'
+
+def read_database(path):
+    """Returns (format name, {user_id_str: UserRecord}) for a database file."""
+    with open(path, 'rb') as f:
+        payload = f.read()
+    if payload.startswith(SQLITE_MAGIC):
+        storage = SqliteStorage(path)
+        try:
+            return 'sqlite', storage.load_all()
+        finally:
+            storage.conn.close()
+    fmt = detect_format(payload)
+    return fmt.name, fmt.loads(payload)
+
+def write_database(path, data, fmt):
+    if fmt == 'sqlite':
+        storage = SqliteStorage(path)
+        try:
+            storage.save_all(data)
+        finally:
+            storage.conn.close()
+    else:
+        write_file_atomic(path, FORMATS[fmt].dumps(data))
+
+def first_difference(expected, actual):
+    """Returns a description of the first mismatch between two databases, or None if they are equal."""
+    expected, actual = plain_records(expected), plain_records(actual)
+    if expected.keys() != actual.keys():
+        missing = sorted(expected.keys() - actual.keys())[:5]
+        extra = sorted(actual.keys() - expected.keys())[:5]
+        return f"user ids differ (missing {missing}, unexpected {extra})"
+    for user_id_str, record in expected.items():
+        if actual[user_id_str] != record:
+            fields = sorted(key for key in record.keys() | actual[user_id_str].keys()
+                            if record.get(key) != actual[user_id_str].get(key))
+            return f"user {user_id_str} differs in {fields}"
+    return None
+
+def cmd_info(args):
+    fmt, data = read_database(args.file)
+    print(f"{args.file}: {fmt}, {len(data)} users, {os.path.getsize(args.file)} bytes")
+
+def cmd_convert(args):
+    if os.path.exists(args.dst):
+        if os.path.samefile(args.src, args.dst):
+            sys.exit(f"{args.src} and {args.dst} are the same file; convert into a new file and rename it afterwards.")
+        if not args.force:
+            sys.exit(f"{args.dst} already exists; pass --force to overwrite it.")
+    src_fmt, data = read_database(args.src)
+    # DST is only replaced once the converted copy has been read back and matches.
+    tmp_path = args.dst + '.tmp'
+    remove_database(tmp_path)
+    try:
+        write_database(tmp_path, data, args.to)
+        _, written = read_database(tmp_path)
+        difference = first_difference(data, written)
+        if difference:
+            sys.exit(f"Verification failed: {difference}")
+        remove_database(args.dst, keep_main=True)
+        os.replace(tmp_path, args.dst)
+    finally:
+        remove_database(tmp_path)
+    print(f"Converted {len(data)} users: {args.src} ({src_fmt}, {os.path.getsize(args.src)} bytes) -> "
+          f"{args.dst} ({args.to}, {os.path.getsize(args.dst)} bytes). Round-trip verified.")
+
+def remove_database(path, keep_main=False):
+    """Deletes a database file and any SQLite -wal/-shm files next to it."""
+    for suffix in ('-wal', '-shm') if keep_main else ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+def cmd_verify(args):
+    src_fmt, data = read_database(args.file)
+    print(f"{args.file}: {src_fmt}, {len(data)} users")
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for fmt in list(FORMATS) + ['sqlite']:
+            path = os.path.join(tmp_dir, f"roundtrip.{fmt}")
+            write_database(path, data, fmt)
+            _, reloaded = read_database(path)
+            difference = first_difference(data, reloaded)
+            failed = failed or difference is not None
+            print(f"  {fmt:<12} {os.path.getsize(path):>12} bytes  {'OK' if difference is None else 'FAILED: ' + difference}")
+    if failed:
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    info = commands.add_parser('info', help="show a database file's format and size")
+    info.add_argument('file')
+    info.set_defaults(func=cmd_info)
+    convert = commands.add_parser('convert', help="rewrite a database in another format")
+    convert.add_argument('src')
+    convert.add_argument('dst')
+    convert.add_argument('--to', required=True, choices=list(FORMATS) + ['sqlite'])
+    convert.add_argument('--force', action='store_true', help="overwrite DST if it exists")
+    convert.set_defaults(func=cmd_convert)
+    verify = commands.add_parser('verify', help="round-trip a database through every format")
+    verify.add_argument('file')
+    verify.set_defaults(func=cmd_verify)
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+# destination_health.py
+import asyncio
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from telethon.errors.rpcerrorlist import (
+    ChatWriteForbiddenError, UserPrivacyRestrictedError, ChannelPrivateError, ChatGuestSendForbiddenError,
+    ChatSendPlainForbiddenError, ChatRestrictedError, ChatAdminRequiredError, UserBannedInChannelError,
+    ChannelInvalidError, ChatIdInvalidError, PeerIdInvalidError, ChatSendMediaForbiddenError, ChatSendGifsForbiddenError,
+    ChatSendStickersForbiddenError, ChatSendPhotosForbiddenError, ChatSendVideosForbiddenError,
+    ChatSendVoicesForbiddenError, ChatSendPollForbiddenError
+)
+
+from group_cache import GROUP_CACHE_FILE
+
+HEALTH_BACKOFF_BASE = 30 * 60        # Seconds a group is skipped after its first transient failure
+HEALTH_BACKOFF_MAX = 24 * 60 * 60    # Upper bound for the doubling back-off
+
+# Errors meaning the account can't post in that group until something changes on
+# the group's side; such groups are excluded until the user or an admin resets them.
+PERMANENT_ERRORS = (
+    ChatWriteForbiddenError, UserPrivacyRestrictedError, ChannelPrivateError, ChatGuestSendForbiddenError,
+    ChatSendPlainForbiddenError, ChatRestrictedError, ChatAdminRequiredError, UserBannedInChannelError
+)
+
+# Errors about that one group that may clear up on their own (or once the ad
+# changes type); the group is backed off instead of excluded.
+DESTINATION_ERRORS = PERMANENT_ERRORS + (
+    ChannelInvalidError, ChatIdInvalidError, PeerIdInvalidError, ChatSendMediaForbiddenError, ChatSendGifsForbiddenError,
+    ChatSendStickersForbiddenError, ChatSendPhotosForbiddenError, ChatSendVideosForbiddenError,
+    ChatSendVoicesForbiddenError, ChatSendPollForbiddenError
+)
+
+health_lock = Lock()
+
+class DestinationEntry:
+    """Why one group is being skipped by one account."""
+    __slots__ = ('peer_id', 'title', 'reason', 'failures', 'retry_at')
+
+    def __init__(self, peer_id, title, reason, failures, retry_at):
+        self.peer_id = peer_id
+        self.title = title
+        self.reason = reason
+        self.failures = failures
+        self.retry_at = retry_at  # None for permanently excluded groups
+
+    @property
+    def excluded(self):
+        return self.retry_at is None
+
+class DestinationHealth:
+    """Per-account record of groups that can't receive forwards, persisted next to the group cache.
+
+    Only DESTINATION_ERRORS are recorded. Groups that raised one of
+    PERMANENT_ERRORS are left out of every cycle; the others are backed off
+    for HEALTH_BACKOFF_BASE seconds, doubling with each consecutive failure.
+    One successful forward clears a group.
+    Like GroupCache, the memory copy is updated inline and SQLite is only
+    touched from one worker thread.
+    """
+
+    def __init__(self, path=GROUP_CACHE_FILE, backoff_base=HEALTH_BACKOFF_BASE, backoff_max=HEALTH_BACKOFF_MAX):
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS destination_health ("
+            " user_id INTEGER NOT NULL,"
+            " acc_name TEXT NOT NULL,"
+            " peer_id INTEGER NOT NULL,"
+            " title TEXT,"
+            " reason TEXT NOT NULL,"
+            " failures INTEGER NOT NULL,"
+            " retry_at INTEGER,"
+            " PRIMARY KEY (user_id, acc_name, peer_id))"
+        )
+        self._entries = {}  # (user_id, acc_name) -> {peer_id: DestinationEntry}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='health')
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _write(self, sql, params):
+        self._executor.submit(self.conn.execute, sql, params).add_done_callback(self._check_write)
+
+    @staticmethod
+    def _check_write(future):
+        if future.exception() is not None:
+            logging.error(f"Destination health write failed: {future.exception()}")
+
+    def _read(self, key):
+        return self.conn.execute(
+            "SELECT peer_id, title, reason, failures, retry_at FROM destination_health WHERE user_id = ? AND acc_name = ?", key
+        ).fetchall()
+
+    async def _load(self, key):
+        if key not in self._entries:
+            rows = await self._run(self._read, key)
+            with health_lock:
+                self._entries.setdefault(key, {row[0]: DestinationEntry(*row) for row in rows})
+        return self._entries[key]
+
+    async def filter(self, user_id, acc_name, groups, now=None):
+        """Returns the groups worth forwarding to right now, in their original order."""
+        now = now or time.time()
+        entries = await self._load((user_id, acc_name))
+        with health_lock:
+            if not entries:
+                return list(groups)
+            return [g for g in groups if g.id not in entries or
+                    (entries[g.id].retry_at is not None and entries[g.id].retry_at <= now)]
+
+    def record_success(self, user_id, acc_name, peer_id):
+        with health_lock:
+            entries = self._entries.get((user_id, acc_name))
+            if entries is None or entries.pop(peer_id, None) is None:
+                return
+        self._write("DELETE FROM destination_health WHERE user_id = ? AND acc_name = ? AND peer_id = ?", (user_id, acc_name, peer_id))
+
+    def record_failure(self, user_id, acc_name, group, error, now=None, confirmed=True):
+        """Excludes or backs off `group` depending on `error`. Returns the entry now stored for it.
+
+        Without `confirmed` (nothing has shown the account itself can post) the
+        group is only backed off, even for one of PERMANENT_ERRORS.
+        Only valid after filter() has loaded the account's entries.
+        """
+        now = now or time.time()
+        with health_lock:
+            entries = self._entries.setdefault((user_id, acc_name), {})
+            previous = entries.get(group.id)
+            failures = (previous.failures if previous else 0) + 1
+            if confirmed and isinstance(error, PERMANENT_ERRORS):
+                retry_at = None
+            else:
+                retry_at = int(now + min(self.backoff_base * 2 ** (failures - 1), self.backoff_max))
+            entry = entries[group.id] = DestinationEntry(group.id, group.title, error.__class__.__name__, failures, retry_at)
+        self._write("INSERT OR REPLACE INTO destination_health VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (user_id, acc_name, entry.peer_id, entry.title, entry.reason, entry.failures, entry.retry_at))
+        return entry
+
+    def next_retry(self, user_id, acc_name, groups):
+        """Earliest retry_at among the back-offs of `groups`, or None if none is backed off. Call after filter()."""
+        with health_lock:
+            entries = self._entries.get((user_id, acc_name), {})
+            return min((entries[g.id].retry_at for g in groups if g.id in entries and entries[g.id].retry_at is not None), default=None)
+
+    async def entries(self, user_id, acc_name=None):
+        """Returns [(acc_name, DestinationEntry)] for every skipped group of a user, or of one of their accounts."""
+        if acc_name is None:
+            rows = await self._run(lambda: self.conn.execute(
+                "SELECT DISTINCT acc_name FROM destination_health WHERE user_id = ?", (user_id,)).fetchall())
+            acc_names = [row[0] for row in rows]
+        else:
+            acc_names = [acc_name]
+        return [(name, entry) for name in acc_names for entry in list((await self._load((user_id, name))).values())]
+
+    async def reset(self, user_id, acc_name=None, peer_id=None):
+        """Clears the exclusions and back-offs of a user, one of their accounts, or one group. Returns how many were cleared."""
+        sql, params = "DELETE FROM destination_health WHERE user_id = ?", [user_id]
+        if acc_name is not None:
+            sql, params = sql + " AND acc_name = ?", params + [acc_name]
+        if peer_id is not None:
+            sql, params = sql + " AND peer_id = ?", params + [peer_id]
+        with health_lock:
+            for key in [key for key in self._entries if key[0] == user_id and acc_name in (None, key[1])]:
+                if peer_id is None:
+                    del self._entries[key]
+                else:
+                    self._entries[key].pop(peer_id, None)
+        cursor = await self._run(self.conn.execute, sql, params)
+        return cursor.rowcount
+
+_destination_health = None
+
+def get_destination_health():
+    """Returns the shared destination-health table, opening it on first use."""
+    global _destination_health
+    with health_lock:
+        if _destination_health is None:
+            _destination_health = DestinationHealth(GROUP_CACHE_FILE)
+        return _destination_health
@@ -0,0 +1,209 @@
+# group_cache.py
+import asyncio
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from telethon import events, utils
+from telethon.tl.types import Channel, Chat, InputPeerChannel, InputPeerChat
+
+GROUP_CACHE_FILE = 'groups.db'
+GROUP_CACHE_TTL = 6 * 60 * 60  # Seconds before an account's group list is re-walked from its dialogs
+
+cache_lock = Lock()
+
+class CachedGroup:
+    """Enough of a group to forward into it without resolving the entity again."""
+    __slots__ = ('id', 'title', 'kind', 'access_hash')
+
+    def __init__(self, id, title, kind, access_hash=None):
+        self.id = id
+        self.title = title
+        self.kind = kind
+        self.access_hash = access_hash
+
+    @classmethod
+    def from_entity(cls, entity):
+        if isinstance(entity, Channel):
+            return cls(entity.id, entity.title, 'channel', entity.access_hash)
+        if isinstance(entity, Chat):
+            return cls(entity.id, entity.title, 'chat')
+        return None
+
+    @property
+    def input_peer(self):
+        if self.kind == 'channel':
+            return InputPeerChannel(self.id, self.access_hash)
+        return InputPeerChat(self.id)
+
+class GroupCache:
+    """Per-account group lists persisted in SQLite and mirrored in memory.
+
+    An account's list comes from one full dialog walk; after that it is kept
+    current by chat-action and new-message events (see `watch`) and only
+    re-walked once it is older than `ttl` seconds.
+
+    The in-memory lists are updated inline; SQLite reads and writes run in
+    order on one worker thread, so event handlers never block the loop on disk.
+    """
+
+    def __init__(self, path=GROUP_CACHE_FILE, ttl=GROUP_CACHE_TTL):
+        self.ttl = ttl
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS groups ("
+            " user_id INTEGER NOT NULL,"
+            " acc_name TEXT NOT NULL,"
+            " peer_id INTEGER NOT NULL,"
+            " kind TEXT NOT NULL,"
+            " access_hash INTEGER,"
+            " title TEXT,"
+            " PRIMARY KEY (user_id, acc_name, peer_id))"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS group_sync ("
+            " user_id INTEGER NOT NULL,"
+            " acc_name TEXT NOT NULL,"
+            " synced_at INTEGER NOT NULL,"
+            " PRIMARY KEY (user_id, acc_name))"
+        )
+        self._groups = {}   # (user_id, acc_name) -> {peer_id: CachedGroup}
+        self._synced_at = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='groups')
+
+    def _write(self, func, *args):
+        """Queues a write for the worker thread; failures are logged, the memory copy stays authoritative."""
+        self._executor.submit(func, *args).add_done_callback(self._check_write)
+
+    @staticmethod
+    def _check_write(future):
+        if future.exception() is not None:
+            logging.error(f"Group cache write failed: {future.exception()}")
+
+    def _read(self, key):
+        row = self.conn.execute("SELECT synced_at FROM group_sync WHERE user_id = ? AND acc_name = ?", key).fetchone()
+        if row is None:
+            return None
+        rows = self.conn.execute(
+            "SELECT peer_id, title, kind, access_hash FROM groups WHERE user_id = ? AND acc_name = ?", key
+        ).fetchall()
+        return {peer_id: CachedGroup(peer_id, title, kind, access_hash) for peer_id, title, kind, access_hash in rows}, row[0]
+
+    async def get(self, user_id, acc_name):
+        """Returns the cached groups, or None if the account was never walked or the list is stale."""
+        key = (user_id, acc_name)
+        if key not in self._groups:
+            # Runs behind any queued write, so it never reads rows that are about to change.
+            stored = await asyncio.get_running_loop().run_in_executor(self._executor, self._read, key)
+            with cache_lock:
+                if stored is not None and key not in self._groups:
+                    self._groups[key], self._synced_at[key] = stored
+        with cache_lock:
+            if key not in self._groups or time.time() - self._synced_at[key] > self.ttl:
+                return None
+            return list(self._groups[key].values())
+
+    def contains(self, user_id, acc_name, peer_id):
+        with cache_lock:
+            groups = self._groups.get((user_id, acc_name))
+            return groups is not None and peer_id in groups
+
+    def is_tracked(self, user_id, acc_name):
+        with cache_lock:
+            return (user_id, acc_name) in self._groups
+
+    def replace(self, user_id, acc_name, groups):
+        """Stores the result of a full dialog walk."""
+        key = (user_id, acc_name)
+        now = int(time.time())
+        with cache_lock:
+            self._groups[key] = {g.id: g for g in groups}
+            self._synced_at[key] = now
+        self._write(self._store, key, [(user_id, acc_name, g.id, g.kind, g.access_hash, g.title) for g in groups], now)
+
+    def _store(self, key, rows, synced_at):
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.execute("DELETE FROM groups WHERE user_id = ? AND acc_name = ?", key)
+            self.conn.executemany("INSERT OR REPLACE INTO groups VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self.conn.execute("INSERT OR REPLACE INTO group_sync VALUES (?, ?, ?)", key + (synced_at,))
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def upsert(self, user_id, acc_name, group):
+        with cache_lock:
+            groups = self._groups.get((user_id, acc_name))
+            if groups is None:
+                return
+            groups[group.id] = group
+        self._write(self.conn.execute, "INSERT OR REPLACE INTO groups VALUES (?, ?, ?, ?, ?, ?)",
+                    (user_id, acc_name, group.id, group.kind, group.access_hash, group.title))
+
+    def remove(self, user_id, acc_name, peer_id):
+        with cache_lock:
+            groups = self._groups.get((user_id, acc_name))
+            if groups is None or groups.pop(peer_id, None) is None:
+                return
+        self._write(self.conn.execute, "DELETE FROM groups WHERE user_id = ? AND acc_name = ? AND peer_id = ?",
+                    (user_id, acc_name, peer_id))
+
+    def forget(self, user_id, acc_name):
+        """Drops everything stored for an account (e.g. when it is removed)."""
+        with cache_lock:
+            self._groups.pop((user_id, acc_name), None)
+            self._synced_at.pop((user_id, acc_name), None)
+        self._write(self._delete_account, (user_id, acc_name))
+
+    def _delete_account(self, key):
+        self.conn.execute("DELETE FROM groups WHERE user_id = ? AND acc_name = ?", key)
+        self.conn.execute("DELETE FROM group_sync WHERE user_id = ? AND acc_name = ?", key)
+
+    def watch(self, client, user_id, acc_name, on_join=None):
+        """Keeps the account's list current from its own updates instead of re-walking dialogs.
+
+        `on_join(peer_id)` is awaited whenever the account turns up in a group it wasn't listed in.
+        """
+
+        async def add(group):
+            self.upsert(user_id, acc_name, group)
+            if on_join is not None:
+                await on_join(group.id)
+
+        async def on_chat_action(event):
+            if not event.is_group or not self.is_tracked(user_id, acc_name):
+                return
+            me = await client.get_me(input_peer=True)
+            if me.user_id not in (event.user_ids or []):
+                return
+            if event.user_left or event.user_kicked:
+                self.remove(user_id, acc_name, utils.resolve_id(event.chat_id)[0])
+            elif event.user_joined or event.user_added:
+                group = CachedGroup.from_entity(await event.get_chat())
+                if group: await add(group)
+
+        async def on_group_message(event):
+            if self.contains(user_id, acc_name, utils.resolve_id(event.chat_id)[0]):
+                return
+            group = CachedGroup.from_entity(await event.get_chat())
+            if group: await add(group)
+
+        client.add_event_handler(on_chat_action, events.ChatAction())
+        client.add_event_handler(
+            on_group_message,
+            events.NewMessage(func=lambda e: e.is_group and self.is_tracked(user_id, acc_name))
+        )
+
+_group_cache = None
+
+def get_group_cache():
+    """Returns the shared group cache, opening it on first use."""
+    global _group_cache
+    with cache_lock:
+        if _group_cache is None:
+            _group_cache = GroupCache(GROUP_CACHE_FILE)
+        return _group_cache
@@ -0,0 +1,76 @@
+# login_sessions.py
+import logging
+import time
+
+LOGIN_SESSION_TTL = 10 * 60  # Seconds an unfinished login may sit idle before its client is disconnected
+
+class LoginSession:
+    """An account login in progress. Lives only in memory; nothing here is ever persisted."""
+    __slots__ = ('client', 'phone', 'phone_code_hash', 'otp', 'expires_at')
+
+    def __init__(self, client, phone, phone_code_hash, expires_at):
+        self.client = client
+        self.phone = phone
+        self.phone_code_hash = phone_code_hash
+        self.otp = ""
+        self.expires_at = expires_at
+
+class LoginSessionStore:
+    """User id -> LoginSession, with TTL eviction.
+
+    Every get() pushes the expiry back by `ttl`, so only logins that were
+    abandoned expire. expire() disconnects the temporary client of each
+    expired session and returns the affected user ids.
+    """
+
+    def __init__(self, ttl=LOGIN_SESSION_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self._sessions = {}
+        self.stats = {'started': 0, 'completed': 0, 'cancelled': 0, 'expired': 0}
+
+    def __len__(self):
+        return len(self._sessions)
+
+    async def start(self, user_id, client, phone, phone_code_hash):
+        """Opens a session for `user_id`, closing any earlier one of theirs first."""
+        await self.close(user_id)
+        self._sessions[user_id] = LoginSession(client, phone, phone_code_hash, self.clock() + self.ttl)
+        self.stats['started'] += 1
+
+    def get(self, user_id):
+        """Returns the user's live session (refreshing its expiry), or None."""
+        session = self._sessions.get(user_id)
+        if session is None or self.clock() >= session.expires_at:
+            return None
+        session.expires_at = self.clock() + self.ttl
+        return session
+
+    async def close(self, user_id, disconnect=True, completed=False):
+        """Ends the user's session; the client is kept connected when `disconnect` is False (e.g. it now belongs to the pool)."""
+        session = self._sessions.pop(user_id, None)
+        if session is None:
+            return
+        self.stats['completed' if completed else 'cancelled'] += 1
+        if disconnect:
+            await self._disconnect(user_id, session)
+
+    async def expire(self):
+        now = self.clock()
+        expired = [user_id for user_id, session in self._sessions.items() if now >= session.expires_at]
+        for user_id in expired:
+            session = self._sessions.pop(user_id)
+            self.stats['expired'] += 1
+            await self._disconnect(user_id, session)
+        return expired
+
+    async def _disconnect(self, user_id, session):
+        try:
+            await session.client.disconnect()
+        except Exception as e:
+            logging.warning(f"User {user_id}: Could not disconnect temporary login client: {e}")
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['active'] = len(self._sessions)
+        return stats
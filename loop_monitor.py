@@ -0,0 +1,176 @@
+# loop_monitor.py
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from config import LOOP_LAG_INTERVAL, SLOW_CALLBACK_THRESHOLD
+from metrics import registry
+
+LAG_WINDOW = 60 * 60     # Seconds of lag samples kept for the rolling report
+MAX_SLOW_RECORDS = 50    # Slow-callback records kept, newest first
+STACK_DEPTH = 12         # Innermost frames kept per stack sample
+PROFILE_INTERVAL = 0.005 # Seconds between samples of an on-demand profile
+PROFILE_MAX_SECONDS = 120
+
+LOOP_LAG_SECONDS = registry.histogram('adbot_loop_lag_seconds', "How late the event-loop probe woke up")
+SLOW_CALLBACKS = registry.counter('adbot_slow_callbacks_total', "Times the event loop was blocked longer than SLOW_CALLBACK_THRESHOLD")
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _format_stack(frame):
+    lines = []
+    while frame is not None and len(lines) < STACK_DEPTH:
+        lines.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno} in {frame.f_code.co_name}")
+        frame = frame.f_back
+    return lines[::-1]
+
+def _describe_task(task):
+    if task is None:
+        return "callback (no task)"
+    coro = task.get_coro()
+    return f"{task.get_name()} [{getattr(coro, '__qualname__', type(coro).__name__)}]"
+
+class SlowCallback:
+    __slots__ = ('at', 'duration', 'task', 'stack')
+
+    def __init__(self, at, duration, task, stack):
+        self.at = at
+        self.duration = duration
+        self.task = task
+        self.stack = stack
+
+class LoopMonitor:
+    """Measures event-loop lag and catches whatever blocks the loop.
+
+    A probe task sleeps `interval` seconds in a loop; how late it wakes up is
+    the lag. A watchdog thread checks the probe's heartbeat and, once the loop
+    has been silent for longer than `threshold`, samples the loop thread's
+    stack and the task that is running. When the probe wakes up again the
+    stall is recorded with its length, task and stack sample.
+    """
+
+    def __init__(self, interval=LOOP_LAG_INTERVAL, threshold=SLOW_CALLBACK_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.lags = deque()  # (wall time, lag seconds) within LAG_WINDOW
+        self.slow = deque(maxlen=MAX_SLOW_RECORDS)
+        self.loop = None
+        self.loop_thread_id = None
+        self._heartbeat = None
+        self._stall = None  # (task description, stack) sampled by the watchdog during the current stall
+        self._stopped = threading.Event()
+        self._profile_lock = threading.Lock()
+
+    def start(self):
+        """Starts the probe and the watchdog; must be called from the loop thread."""
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        threading.Thread(target=self._watchdog, name='loop-watchdog', daemon=True).start()
+        return asyncio.create_task(self._probe(), name='loop-monitor')
+
+    def stop(self):
+        self._stopped.set()
+
+    async def _probe(self):
+        try:
+            while True:
+                expected = time.monotonic() + self.interval
+                await asyncio.sleep(self.interval)
+                now = time.monotonic()
+                self._heartbeat = now
+                lag = max(0.0, now - expected)
+                LOOP_LAG_SECONDS.observe(lag)
+                self._record_lag(lag)
+                stall, self._stall = self._stall, None
+                if lag >= self.threshold:
+                    task, stack = stall or ("unknown (not sampled)", [])
+                    self.slow.appendleft(SlowCallback(time.time(), lag, task, stack))
+                    SLOW_CALLBACKS.inc()
+                    logging.warning(f"Event loop blocked for {lag * 1000:.0f}ms by {task}" + (f" at {stack[-1]}" if stack else ""))
+        finally:
+            self.stop()
+
+    def _record_lag(self, lag):
+        now = time.time()
+        self.lags.append((now, lag))
+        while self.lags and self.lags[0][0] < now - LAG_WINDOW:
+            self.lags.popleft()
+
+    def _watchdog(self):
+        check_every = min(self.threshold, self.interval) / 2
+        while not self._stopped.wait(check_every):
+            silent = time.monotonic() - self._heartbeat
+            if silent < self.interval + self.threshold or self._stall is not None:
+                continue
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is None:
+                continue
+            try:
+                task = _describe_task(asyncio.current_task(self.loop))
+            except RuntimeError:
+                task = "unknown"
+            self._stall = (task, _format_stack(frame))
+
+    def report(self, slow_listed=5):
+        """Rolling text report: lag percentiles over LAG_WINDOW and the latest slow callbacks."""
+        lags = sorted(lag for _, lag in self.lags)
+        if not lags:
+            return "No loop lag samples yet."
+        pick = lambda q: lags[min(len(lags) - 1, int(q * len(lags)))] * 1000
+        window_min = (self.lags[-1][0] - self.lags[0][0]) / 60
+        lines = [
+            f"Loop lag over {window_min:.0f} min ({len(lags)} samples): p50 {pick(0.5):.1f}ms, "
+            f"p99 {pick(0.99):.1f}ms, max {lags[-1] * 1000:.0f}ms",
+            f"Blocked > {self.threshold * 1000:.0f}ms: {len(self.slow)} recorded (keeping {MAX_SLOW_RECORDS})",
+        ]
+        for record in list(self.slow)[:slow_listed]:
+            lines.append("")
+            lines.append(f"{time.strftime('%H:%M:%S', time.localtime(record.at))} {record.duration * 1000:.0f}ms {record.task}")
+            lines.extend(f"  {frame}" for frame in record.stack[-6:])
+        return "\n".join(lines)
+
+    async def profile(self, seconds, top=15):
+        """Samples the loop thread's stack for `seconds` and returns the hottest functions as text.
+
+        Runs in a worker thread, so the loop keeps serving while it is profiled.
+        Only one profile runs at a time; returns None if one is already running.
+        """
+        if not self._profile_lock.acquire(blocking=False):
+            return None
+        try:
+            seconds = min(seconds, PROFILE_MAX_SECONDS)
+            samples, own, total = await asyncio.get_running_loop().run_in_executor(None, self._sample, seconds)
+        finally:
+            self._profile_lock.release()
+        if not samples:
+            return "No samples taken."
+        lines = [f"{samples} samples over {seconds:g}s (every {PROFILE_INTERVAL * 1000:g}ms)", "", "Self time:"]
+        lines.extend(f"{count / samples:6.1%}  {label}" for label, count in own.most_common(top))
+        lines.extend(["", "Total time (function on the stack):"])
+        lines.extend(f"{count / samples:6.1%}  {label}" for label, count in total.most_common(top))
+        return "\n".join(lines)
+
+    def _sample(self, seconds):
+        own, total = Counter(), Counter()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is not None:
+                samples += 1
+                own[_frame_label(frame.f_code)] += 1
+                seen = set()
+                while frame is not None:
+                    label = _frame_label(frame.f_code)
+                    if label not in seen:
+                        seen.add(label)
+                        total[label] += 1
+                    frame = frame.f_back
+            time.sleep(PROFILE_INTERVAL)
+        return samples, own, total
@@ -2,8 +2,11 @@
 import asyncio
 import logging
 import re
-from datetime import datetime, time, timezone
-import io
+from datetime import datetime, timedelta, timezone
+import os
+import tempfile
+import time
+from functools import partial
 
 from telethon import TelegramClient, events, Button
 from telethon.sessions import StringSession
@@ -11,36 +14,79 @@ from telethon.tl.functions.account import UpdateProfileRequest
 from telethon.tl.functions.channels import GetParticipantRequest
 from telethon.errors.rpcerrorlist import UserNotParticipantError, SessionPasswordNeededError, FloodWaitError
 
-from config import API_ID, API_HASH, BOT_TOKEN, ADMIN_IDS
-from database import get_user_data, update_user_data, delete_user_account, load_data, add_log_entry
-from account_manager import get_client
-from message_scheduler import MessageScheduler
+from config import (
+    API_ID, API_HASH, BOT_TOKEN, ADMIN_IDS, CLIENT_CONNECT_CONCURRENCY, CLIENT_CONNECT_TIMEOUT,
+    CLIENT_POOL_MAX_LIVE, CLIENT_IDLE_TIMEOUT, CLIENT_HEALTH_INTERVAL, METRICS_HOST, METRICS_PORT
+)
+from database import get_cache_stats, strip_legacy_logs
+from async_database import db
+from callback_router import CallbackRouter
+from schedule_index import ScheduleIndex
+from activity_log import EVENTS, render_entry, import_legacy_logs
+from account_manager import ClientPool, warm_up_clients
+from message_scheduler import MessageScheduler, get_groups
+from task_registry import SchedulerRegistry
+from login_sessions import LoginSessionStore
+from group_cache import get_group_cache
+from destination_health import get_destination_health
+from progress_reporter import REPORT_MODES, DEFAULT_REPORT_MODE
+from broadcast import BroadcastEngine
+from outbound import OutboundClient, set_outbound_priority, PRIORITY_ADMIN, PRIORITY_NAMES
+from metrics import registry as metrics
+from loop_monitor import LoopMonitor
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 CHANNEL_ID = -1003011891418 # Replace with your channel's actual ID
 
-user_schedulers = {}
-user_clients = {}
-temp_login_clients = {}
-
-bot = TelegramClient('ad_bot_session', API_ID, API_HASH)
+scheduler_tasks = SchedulerRegistry()
+
+def watch_account_groups(client, user_id, acc_name):
+    # A group the account (re)joins gets a fresh start, e.g. after a ChannelPrivate exclusion from having left it.
+    get_group_cache().watch(client, user_id, acc_name, on_join=partial(get_destination_health().reset, user_id, acc_name))
+
+client_pool = ClientPool(API_ID, API_HASH, CLIENT_POOL_MAX_LIVE, CLIENT_IDLE_TIMEOUT, CLIENT_CONNECT_TIMEOUT,
+                         on_connect=watch_account_groups)
+login_sessions = LoginSessionStore()
+schedules = ScheduleIndex()
+startup_metrics = {}
+USERS_PAGE_SIZE = 25     # Users per page of the /admin users view
+USER_EXPORT_CHUNK = 1000 # Users read per step when exporting the list to a file
+MAX_LISTED_EXCLUSIONS = 40
+LOGIN_STATES = ('waiting_for_otp', 'waiting_for_password')
+MAX_REPORT_MESSAGE = 3800  # Longer admin reports (metrics, loop, profile) are sent as a file instead
+START_RETRY_SECONDS = 60   # Wait before retrying a scheduled start whose account could not connect
+pending_transitions = {}   # user_id -> task applying that user's latest start/stop
+
+MASTER_TICK_SECONDS = metrics.histogram('adbot_master_scheduler_tick_seconds', "Time the master scheduler spent applying due transitions")
+MASTER_TRANSITIONS = metrics.counter('adbot_master_scheduler_transitions_total', "Scheduler starts and stops applied by the master scheduler")
+
+bot = OutboundClient('ad_bot_session', API_ID, API_HASH)
+broadcasts = BroadcastEngine(bot, db)
+loop_monitor = LoopMonitor()
+
+metrics.gauge('adbot_schedulers_running', "Forwarding tasks currently running", lambda: len(scheduler_tasks))
+metrics.gauge('adbot_clients_live', "Account clients currently connected", lambda: client_pool.get_stats()['live'])
+metrics.gauge('adbot_logins_active', "Account logins in progress", lambda: len(login_sessions))
+metrics.gauge('adbot_outbound_queue_depth', "Outbound bot messages waiting to be sent",
+              lambda: sum(bot.outbound.get_stats()[name]['depth'] for name in PRIORITY_NAMES))
+metrics.gauge('adbot_db_cached_users', "User records held in the database cache", lambda: get_cache_stats()['cached'])
 
 # --- Keyboards (No changes) ---
-def get_main_keyboard(user_id):
-    user_data = get_user_data(user_id)
+def get_main_keyboard(user_data):
     status = user_data.get('adbot_status', False)
     status_text = "ON 🟢" if status else "OFF 🔴"
+    report_mode = REPORT_MODES.get(user_data.get('report_mode'), REPORT_MODES[DEFAULT_REPORT_MODE])
     return [
         [Button.inline("📝 Set Ad Source (Saved Messages)", b"manage_saved_message")],
         [Button.inline(f"AdBot Status: {status_text}", b"toggle_adbot_status")],
         [Button.inline("🕒 Set Delay", b"set_delay"), Button.inline("⏰ Set Schedule", b"set_schedule")],
-        [Button.inline("🔍 Detect Groups", b"detect_groups")],
-        [Button.inline("👤 Add/Remove Accounts", b"manage_accounts")]
+        [Button.inline("🔍 Detect Groups", b"detect_groups"), Button.inline(f"📣 Reports: {report_mode}", b"cycle_report_mode")],
+        [Button.inline("🚫 Excluded Groups", b"excluded_groups"), Button.inline("👤 Add/Remove Accounts", b"manage_accounts")]
     ]
 
-def get_delay_keyboard(user_id):
-    is_premium = get_user_data(user_id).get('is_premium', False)
+def get_delay_keyboard(user_data):
+    is_premium = user_data.get('is_premium', False)
     keyboard = []
     if is_premium:
         keyboard.append([Button.inline("2 Seconds (Fast - Premium)", b"delay_2")])
@@ -52,8 +98,7 @@ def get_delay_keyboard(user_id):
     ])
     return keyboard
 
-def get_schedule_keyboard(user_id):
-    user_data = get_user_data(user_id)
+def get_schedule_keyboard(user_data):
     start = user_data.get('start_time', 'Not Set')
     stop = user_data.get('stop_time', 'Not Set')
     return [
@@ -63,8 +108,8 @@ def get_schedule_keyboard(user_id):
         [Button.inline("⬅️ Back", b"main_menu")]
     ]
 
-def get_account_management_keyboard(user_id):
-    accounts = get_user_data(user_id).get('accounts', {})
+def get_account_management_keyboard(user_data):
+    accounts = user_data.get('accounts', {})
     keyboard = [[Button.inline(f"❌ Remove {name}", f"remove_account_{name}".encode())] for name in accounts]
     keyboard.append([Button.inline("➕ Add New Account", b"add_new_account")])
     keyboard.append([Button.inline("⬅️ Back", b"main_menu")])
@@ -84,19 +129,22 @@ def get_otp_keyboard():
 @bot.on(events.NewMessage(pattern='/start'))
 async def start_handler(event):
     user_id = event.sender_id
-    user_data = get_user_data(user_id)
+    user_data = await db.get_user(user_id)
 
     # New: Check if user is banned
     if user_data.get('is_banned'):
         return await event.respond("❌ You are banned from using this bot.")
 
+    if user_data.get('bot_blocked'):
+        await db.update(user_id, 'bot_blocked', False)
+
     user = await event.get_sender()
     if not user_data.get('username') or user_data.get('username') != user.username:
-        update_user_data(user_id, 'username', user.username)
-    add_log_entry(user_id, "Started the bot.")
+        await db.update(user_id, 'username', user.username)
+    await db.log(user_id, 'start')
 
     if user_data.get('has_agreed'):
-        await event.respond("Welcome back!", buttons=get_main_keyboard(user_id))
+        await event.respond("Welcome back!", buttons=get_main_keyboard(user_data))
     else:
         name = user.first_name
         msg = (
@@ -120,10 +168,12 @@ async def start_handler(event):
 @bot.on(events.NewMessage(pattern=r'/addpremium (\d+)'))
 async def add_premium_handler(event):
     if event.sender_id not in ADMIN_IDS: return
+    set_outbound_priority(PRIORITY_ADMIN)
     try:
         user_id_to_add = int(event.pattern_match.group(1))
-        update_user_data(user_id_to_add, 'is_premium', True)
-        add_log_entry(user_id_to_add, "Upgraded to Premium by admin.")
+        await db.update(user_id_to_add, 'is_premium', True)
+        schedules.update(user_id_to_add, await db.get_user(user_id_to_add))
+        await db.log(user_id_to_add, 'premium_added')
         await event.respond(f"✅ User {user_id_to_add} has been upgraded to Premium.")
         await bot.get_entity(user_id_to_add)
         await bot.send_message(user_id_to_add, "🎉 Congratulations! You have been upgraded to a Premium user.")
@@ -133,10 +183,12 @@ async def add_premium_handler(event):
 @bot.on(events.NewMessage(pattern=r'/removepremium (\d+)'))
 async def remove_premium_handler(event):
     if event.sender_id not in ADMIN_IDS: return
+    set_outbound_priority(PRIORITY_ADMIN)
     try:
         user_id_to_remove = int(event.pattern_match.group(1))
-        update_user_data(user_id_to_remove, 'is_premium', False)
-        add_log_entry(user_id_to_remove, "Downgraded to regular user by admin.")
+        await db.update(user_id_to_remove, 'is_premium', False)
+        schedules.update(user_id_to_remove, await db.get_user(user_id_to_remove))
+        await db.log(user_id_to_remove, 'premium_removed')
         await event.respond(f"✅ User {user_id_to_remove} has been downgraded to a regular user.")
     except Exception as e:
         await event.respond(f"Error: {e}")
@@ -145,10 +197,11 @@ async def remove_premium_handler(event):
 @bot.on(events.NewMessage(pattern=r'/ban (\d+)'))
 async def ban_handler(event):
     if event.sender_id not in ADMIN_IDS: return
+    set_outbound_priority(PRIORITY_ADMIN)
     try:
         user_id_to_ban = int(event.pattern_match.group(1))
-        update_user_data(user_id_to_ban, 'is_banned', True)
-        add_log_entry(user_id_to_ban, "Banned by admin.")
+        await db.update(user_id_to_ban, 'is_banned', True)
+        await db.log(user_id_to_ban, 'banned')
         await event.respond(f"🚫 User {user_id_to_ban} has been banned.")
         await bot.get_entity(user_id_to_ban)
         await bot.send_message(user_id_to_ban, "❌ You have been banned from using this bot.")
@@ -158,10 +211,11 @@ async def ban_handler(event):
 @bot.on(events.NewMessage(pattern=r'/unban (\d+)'))
 async def unban_handler(event):
     if event.sender_id not in ADMIN_IDS: return
+    set_outbound_priority(PRIORITY_ADMIN)
     try:
         user_id_to_unban = int(event.pattern_match.group(1))
-        update_user_data(user_id_to_unban, 'is_banned', False)
-        add_log_entry(user_id_to_unban, "Unbanned by admin.")
+        await db.update(user_id_to_unban, 'is_banned', False)
+        await db.log(user_id_to_unban, 'unbanned')
         await event.respond(f"✅ User {user_id_to_unban} has been unbanned.")
         await bot.get_entity(user_id_to_unban)
         await bot.send_message(user_id_to_unban, "🎉 You have been unbanned. You can now use the bot again.")
@@ -171,184 +225,378 @@ async def unban_handler(event):
 @bot.on(events.NewMessage(pattern='/admin'))
 async def admin_handler(event):
     if event.sender_id not in ADMIN_IDS: return
+    set_outbound_priority(PRIORITY_ADMIN)
     command_parts = event.text.split()
     
     if len(command_parts) == 1 or command_parts[1] == 'stats':
         msg = await event.respond("📊 **Fetching Admin Stats...**")
-        all_data = load_data()
-        total_users = len(all_data)
-        premium_users = sum(1 for data in all_data.values() if data.get('is_premium'))
-        banned_users = sum(1 for data in all_data.values() if data.get('is_banned'))
-        active_schedulers = len(user_schedulers)
+        counts = await db.aggregates()
+        tasks = scheduler_tasks.get_stats()
+        cache = get_cache_stats()
+        pool = client_pool.get_stats()
+        logins = login_sessions.get_stats()
+        outbound = bot.outbound.get_stats()
+        outbound_text = ", ".join(
+            f"{name} `{outbound[name]['depth']}` queued / `{outbound[name]['wait_avg'] * 1000:.0f}ms` avg wait"
+            for name in PRIORITY_NAMES)
+        all_clients_s = startup_metrics.get('all_clients_s')
+        warm_up_text = f"in {all_clients_s:.1f}s" if all_clients_s is not None else "(still connecting)"
         stats_message = (
             f"**🤖 SphereAd Bot Admin Panel**\n\n"
-            f"👤 **Total Users:** `{total_users}`\n"
-            f"⭐ **Premium Users:** `{premium_users}`\n"
-            f"🚫 **Banned Users:** `{banned_users}`\n" # New stat
-            f"🚀 **Active Schedulers:** `{active_schedulers}`\n\n"
-            f"Use `/admin users` to list all users.\n"
-            f"Use `/admin logs <user_id>` to see a user's activity."
+            f"👤 **Total Users:** `{counts['total']}`\n"
+            f"⭐ **Premium Users:** `{counts['premium']}`\n"
+            f"🚫 **Banned Users:** `{counts['banned']}`\n" # New stat
+            f"🟢 **AdBot Enabled:** `{counts['adbot_active']}` users, `{counts['accounts']}` accounts linked\n"
+            f"🚀 **Active Schedulers:** `{tasks['live']}` running, `{tasks['draining']}` stopping, `{tasks['zombies']}` zombie\n"
+            f"💾 **DB Cache:** `{cache['hits']}` hits / `{cache['misses']}` misses, "
+            f"`{cache['flushes']}` flushes, `{cache['writes_saved']}` writes saved\n"
+            f"⏱ **Startup:** ready in `{startup_metrics.get('ready_s', 0):.1f}s`, "
+            f"clients `{startup_metrics.get('clients_connected', 0)}` up / `{startup_metrics.get('clients_failed', 0)}` failed"
+            f" {warm_up_text}\n"
+            f"🔌 **Client Pool:** `{pool['live']}` live / `{pool['registered']}` accounts, `{pool['pinned']}` in use, "
+            f"`{pool['evictions']}` evicted, `{pool['reconnects']}` reconnects\n"
+            f"🔑 **Logins:** `{logins['active']}` in progress, `{logins['completed']}` completed, "
+            f"`{logins['expired']}` expired, `{logins['cancelled']}` cancelled\n"
+            f"📮 **Outbound Queue:** {outbound_text}, `{outbound['flood_waits']}` flood waits\n\n"
+            f"Use `/admin users` to browse users, or `/admin users file` to export them.\n"
+            f"Use `/admin logs <user_id>` to see a user's activity.\n"
+            f"Use `/admin events <event|all> [hours]` to search activity across users.\n"
+            f"Use `/admin excluded <user_id> [reset [group_id]]` to see or clear a user's excluded groups.\n"
+            f"Use `/admin metrics [raw]` for latency and throughput metrics.\n"
+            f"Use `/admin loop` for event-loop lag, or `/admin profile <seconds>` to profile the loop."
         )
         await msg.edit(stats_message, parse_mode='md')
     # ... (rest of the admin handler is the same)
     elif command_parts[1] == 'users':
-        msg = await event.respond("👥 **Fetching User List...**")
-        all_data = load_data()
-        if not all_data: return await msg.edit("No users found.")
-        user_list_text = "--- SphereAd User List ---\n\n"
-        for user_id, data in all_data.items():
-            username = data.get('username', 'N/A')
-            premium_status = "⭐" if data.get('is_premium') else ""
-            banned_status = "🚫" if data.get('is_banned') else ""
-            user_list_text += f"ID: {user_id} | @{username} {premium_status}{banned_status}\n"
-        if len(user_list_text) > 4000:
-            user_list_file = io.BytesIO(user_list_text.encode('utf-8'))
-            user_list_file.name = 'user_list.txt'
-            await msg.delete()
-            await event.respond("User list is too long, sending as a file.", file=user_list_file)
-        else:
-            await msg.edit(f"```{user_list_text}```", parse_mode='md')
+        if command_parts[2:] == ['file']:
+            return await send_user_list_file(event)
+        text, buttons = await render_users_page(0)
+        await event.respond(text, buttons=buttons, parse_mode='md')
     elif command_parts[1] == 'logs' and len(command_parts) > 2:
         try:
             user_id_to_log = int(command_parts[2])
-            user_data = get_user_data(user_id_to_log)
-            logs = user_data.get('logs', [])
+            logs = await db.user_logs(user_id_to_log)
             if not logs: return await event.respond(f"No logs found for user `{user_id_to_log}`.")
             log_text = f"--- Activity Logs for User {user_id_to_log} ---\n\n" + "\n".join(logs)
             await event.respond(f"```{log_text}```", parse_mode='md')
         except (ValueError, IndexError):
             await event.respond("Invalid command. Use `/admin logs <user_id>`.")
+    elif command_parts[1] == 'events' and len(command_parts) > 2:
+        code = None if command_parts[2] == 'all' else command_parts[2]
+        if code is not None and code not in EVENTS:
+            return await event.respond(f"Unknown event. Choose from: `{'`, `'.join(EVENTS)}`.", parse_mode='md')
+        try:
+            hours = float(command_parts[3]) if len(command_parts) > 3 else 24
+        except ValueError:
+            return await event.respond("Invalid command. Use `/admin events <event|all> [hours]`.")
+        entries = await db.query_logs(code=code, since=int(datetime.now().timestamp() - hours * 3600), limit=50)
+        if not entries: return await event.respond(f"No matching events in the last {hours:g} hours.")
+        log_text = f"--- Events ({command_parts[2]}, last {hours:g}h, newest first) ---\n\n" + "\n".join(
+            f"{user_id} {render_entry(ts, entry_code, args)}" for user_id, ts, entry_code, args in entries)
+        await event.respond(f"```{log_text}```", parse_mode='md')
+    elif command_parts[1] == 'excluded' and len(command_parts) > 2:
+        try:
+            target_id = int(command_parts[2])
+        except ValueError:
+            return await event.respond("Invalid command. Use `/admin excluded <user_id> [reset [group_id]]`.")
+        health = get_destination_health()
+        if command_parts[3:4] == ['reset']:
+            if len(command_parts) > 4:
+                if not command_parts[4].isdigit(): return await event.respond("Invalid group id.")
+                cleared = await health.reset(target_id, peer_id=int(command_parts[4]))
+                return await event.respond(f"♻️ Cleared **{cleared}** entries for group `{command_parts[4]}` of user `{target_id}`.")
+            return await event.respond(f"♻️ Cleared **{await health.reset(target_id)}** excluded groups for user `{target_id}`.")
+        entries = await health.entries(target_id)
+        if not entries: return await event.respond(f"User `{target_id}` has no excluded groups.")
+        await event.respond(f"**🚫 Excluded groups of `{target_id}`:**\n\n" + format_excluded_groups(entries, show_ids=True), parse_mode='md')
+    elif command_parts[1] == 'metrics':
+        raw = command_parts[2:] == ['raw']
+        report = metrics.render_prometheus() if raw else metrics.render_summary()
+        if not report: return await event.respond("No metrics recorded yet.")
+        await send_report(event, report, 'metrics.txt', "Bot metrics.", as_file=raw)
+    elif command_parts[1] == 'loop':
+        await send_report(event, loop_monitor.report(), 'loop_report.txt', "Event-loop report.")
+    elif command_parts[1] == 'profile' and len(command_parts) > 2:
+        try:
+            seconds = float(command_parts[2])
+        except ValueError:
+            return await event.respond("Invalid command. Use `/admin profile <seconds>`.")
+        msg = await event.respond(f"🔬 Profiling the event loop for {seconds:g}s...")
+        report = await loop_monitor.profile(seconds)
+        if report is None: return await msg.edit("A profile is already running.")
+        await msg.delete()
+        await send_report(event, report, 'loop_profile.txt', "Event-loop profile.")
     else:
-        await event.respond("Invalid admin command. Use `/admin stats`, `/admin users`, or `/admin logs <user_id>`.")
+        await event.respond("Invalid admin command. Use `/admin stats`, `/admin users`, `/admin logs <user_id>`, `/admin events <event|all> [hours]`, `/admin excluded <user_id> [reset [group_id]]`, `/admin metrics [raw]`, `/admin loop`, or `/admin profile <seconds>`.")
+
+async def send_report(event, report, file_name, caption, as_file=False):
+    """Sends a plain-text report as a code block, or as a file when it is too long for a message."""
+    if not as_file and len(report) <= MAX_REPORT_MESSAGE:
+        return await event.respond(f"```{report}```", parse_mode='md')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, file_name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(report)
+        await bot.send_file(event.chat_id, path, caption=caption)
+
+def format_excluded_groups(entries, show_ids=False):
+    lines = []
+    for acc_name, entry in entries[:MAX_LISTED_EXCLUSIONS]:
+        if entry.excluded:
+            status = "excluded"
+        else:
+            status = f"paused until {datetime.fromtimestamp(entry.retry_at, timezone.utc):%Y-%m-%d %H:%M} UTC"
+        group_id = f" `{entry.peer_id}`" if show_ids else ""
+        lines.append(f"• **{entry.title}**{group_id} ({acc_name}) — {entry.reason}, {status}")
+    if len(entries) > MAX_LISTED_EXCLUSIONS:
+        lines.append(f"…and {len(entries) - MAX_LISTED_EXCLUSIONS} more")
+    return "\n".join(lines)
+
+def format_user_line(user_id, data):
+    premium_status = "⭐" if data.get('is_premium') else ""
+    banned_status = "🚫" if data.get('is_banned') else ""
+    return f"ID: {user_id} | @{data.get('username', 'N/A')} {premium_status}{banned_status}"
+
+async def render_users_page(page):
+    total = (await db.aggregates())['total']
+    if not total: return "No users found.", None
+    pages = (total + USERS_PAGE_SIZE - 1) // USERS_PAGE_SIZE
+    page = min(max(page, 0), pages - 1)
+    rows = await db.users_page(page * USERS_PAGE_SIZE, USERS_PAGE_SIZE)
+    user_list_text = f"--- SphereAd User List ({total} users) ---\n\n" + "\n".join(format_user_line(*row) for row in rows)
+    nav = []
+    if page > 0: nav.append(Button.inline("◀️ Prev", f"admin_users_{page - 1}"))
+    nav.append(Button.inline(f"{page + 1}/{pages}", "admin_users_noop"))
+    if page < pages - 1: nav.append(Button.inline("Next ▶️", f"admin_users_{page + 1}"))
+    return f"```{user_list_text}```", [nav, [Button.inline("📄 Export as File", "admin_users_file")]]
+
+async def send_user_list_file(event):
+    """Streams the user list into a temp file page by page and sends it as a document."""
+    msg = await event.respond("👥 **Exporting User List...**")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'user_list.txt')
+        offset = 0
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("--- SphereAd User List ---\n\n")
+            while True:
+                rows = await db.users_page(offset, USER_EXPORT_CHUNK)
+                if not rows: break
+                f.write("".join(format_user_line(*row) + "\n" for row in rows))
+                offset += len(rows)
+        if not offset: return await msg.edit("No users found.")
+        await msg.delete()
+        await bot.send_file(event.chat_id, path, caption=f"User list ({offset} users).")
 
 @bot.on(events.NewMessage(pattern='/broadcast'))
 async def broadcast_handler(event):
     if event.sender_id not in ADMIN_IDS: return
+    set_outbound_priority(PRIORITY_ADMIN)
+    if event.text.split()[1:] == ['cancel']:
+        if await broadcasts.cancel(): return await event.respond("🛑 Broadcast cancelled.")
+        return await event.respond("No broadcast is running.")
+    if broadcasts.is_running():
+        return await event.respond("A broadcast is already running. Use `/broadcast cancel` to stop it.")
     reply = await event.get_reply_message()
     if not reply: return await event.respond("Please reply to a message to broadcast it.")
-    msg = await event.respond("📣 **Starting broadcast...**")
-    all_users = load_data().keys()
-    success_count = 0
-    fail_count = 0
-    for user_id_str in all_users:
-        user_id = int(user_id_str)
-        try:
-            await bot.send_message(user_id, reply)
-            success_count += 1
-            await asyncio.sleep(0.1)
-        except Exception as e:
-            logging.warning(f"Broadcast failed for user {user_id}: {e}")
-            fail_count += 1
-    report = (f"**📣 Broadcast Complete!**\n\n✅ Sent to **{success_count}** users.\n❌ Failed for **{fail_count}** users.")
-    await msg.edit(report, parse_mode='md')
+    all_data = await db.load_all()
+    recipients = [int(user_id_str) for user_id_str, data in all_data.items() if not data.get('bot_blocked')]
+    await broadcasts.start(event.sender_id, reply, recipients, skipped=len(all_data) - len(recipients))
 
 # --- Callback Handlers ---
 
-@bot.on(events.CallbackQuery)
-async def callback_query_handler(event):
-    user_id = event.sender_id
-    data = event.data.decode()
-    user_data = get_user_data(user_id)
+router = CallbackRouter(load_user=db.get_user)
 
+@router.use
+async def reject_banned(ctx):
     # New: Check if user is banned at the start of every interaction
-    if user_data.get('is_banned'):
-        return await event.answer("❌ You are banned from using this bot.", alert=True)
-
-    # ... (rest of the callback handler is the same, no changes needed)
-    if data == "agree_and_continue":
-        try:
-            await bot(GetParticipantRequest(channel=CHANNEL_ID, participant=user_id))
-            update_user_data(user_id, 'has_agreed', True)
-            add_log_entry(user_id, "Agreed to terms and joined channel.")
-            await event.edit("Thanks for joining! You can now use the bot.", buttons=get_main_keyboard(user_id))
-        except UserNotParticipantError:
-            await event.answer("❗ You must join our channel first to continue.", alert=True)
-        except Exception as e:
-            logging.error(f"Force join error for {user_id}: {e}")
-            await event.answer("Error: Could not verify channel membership.", alert=True)
-    elif data == "toggle_adbot_status":
-        new_status = not user_data.get('adbot_status', False)
-        add_log_entry(user_id, f"Toggled AdBot status to {('ON' if new_status else 'OFF')}.")
-        if new_status:
-            if not user_data.get('saved_message'): return await event.answer("Please set ad source.", alert=True)
-            if not user_clients.get(user_id): return await event.answer("Please add an account.", alert=True)
-            update_user_data(user_id, 'adbot_status', True)
-            if not user_data.get('start_time'): start_scheduler_for_user(user_id)
-            await event.answer("AdBot ON 🟢")
-        else:
-            if user_id in user_schedulers: await user_schedulers[user_id].stop_forwarding(); del user_schedulers[user_id]
-            update_user_data(user_id, 'adbot_status', False)
-            await event.answer("AdBot OFF 🔴")
-        await event.edit(buttons=get_main_keyboard(user_id))
-    elif data.startswith("delay_"):
-        delay = int(data.split('_')[1])
-        update_user_data(user_id, 'forward_delay', delay)
-        add_log_entry(user_id, f"Set forward delay to {delay} seconds.")
-        await event.answer(f"✅ Delay set to {delay} seconds.", alert=True)
-        await event.edit(buttons=get_main_keyboard(user_id))
-    elif data == "main_menu":
-        update_user_data(user_id, 'state', None)
-        await event.edit("Main Menu:", buttons=get_main_keyboard(user_id))
-    elif data == "manage_saved_message":
-        update_user_data(user_id, 'saved_message', {'source': 'saved_messages'})
-        add_log_entry(user_id, "Set ad source to 'Saved Messages'.")
-        await event.answer("✅ Ad source set!", alert=True)
-    elif data == "detect_groups":
-        if not user_clients.get(user_id): return await event.answer("Please add an account first.", alert=True)
-        await event.answer("🔍 Detecting groups...")
-        client = next(iter(user_clients[user_id].values()))
-        scheduler = MessageScheduler(user_id, client, 0, bot)
-        groups = await scheduler.get_all_groups()
-        add_log_entry(user_id, f"Detected {len(groups)} groups.")
-        await event.respond(f"✅ Detected **{len(groups)}** groups.")
-    elif data == "set_delay":
-        await event.edit("Select a delay time. A longer delay is safer.", buttons=get_delay_keyboard(user_id))
-    elif data == "set_schedule":
-        if not user_data.get('is_premium'): return await event.answer("⏰ Scheduling is a Premium feature.", alert=True)
-        await event.edit("Set a schedule for the bot to run automatically.", buttons=get_schedule_keyboard(user_id))
-    elif data == "set_start_time":
-        update_user_data(user_id, 'state', 'waiting_for_start_time')
-        await event.edit("Please send the start time in **24-hour HH:MM format** (e.g., 22:00).", buttons=[[Button.inline("⬅️ Back", b"set_schedule")]], parse_mode='md')
-    elif data == "set_stop_time":
-        update_user_data(user_id, 'state', 'waiting_for_stop_time')
-        await event.edit("Please send the stop time in **24-hour HH:MM format** (e.g., 06:00).", buttons=[[Button.inline("⬅️ Back", b"set_schedule")]], parse_mode='md')
-    elif data == "clear_schedule":
-        update_user_data(user_id, 'start_time', None)
-        update_user_data(user_id, 'stop_time', None)
-        add_log_entry(user_id, "Cleared schedule.")
-        await event.answer("✅ Schedule cleared.", alert=True)
-        await event.edit(buttons=get_schedule_keyboard(user_id))
-    elif data == "manage_accounts":
-        await event.edit("Manage your accounts:", buttons=get_account_management_keyboard(user_id))
-    elif data == "add_new_account":
-        if not user_data.get('is_premium') and len(user_data.get('accounts', {})) >= 1:
-            return await event.answer("❌ Free users can only add one account.", alert=True)
-        update_user_data(user_id, 'state', 'waiting_for_phone')
-        await event.edit("Please send the phone number to add (e.g., +919876543210).", buttons=[[Button.inline("⬅️ Back", b"manage_accounts")]])
-    elif data.startswith("remove_account_"):
-        acc_name = data.replace("remove_account_", "")
-        add_log_entry(user_id, f"Removed account: {acc_name}.")
-        if delete_user_account(user_id, acc_name):
-            if user_id in user_clients and acc_name in user_clients[user_id]:
-                await user_clients[user_id][acc_name].disconnect()
-                del user_clients[user_id][acc_name]
-            await event.answer(f"Account '{acc_name}' removed.", alert=True)
-        await event.edit(buttons=get_account_management_keyboard(user_id))
-    elif data.startswith("otp_"):
-        await handle_otp_input(event)
-    elif data == "cancel_login":
-        await cleanup_login_session(user_id)
-        await event.edit("Login cancelled.", buttons=get_account_management_keyboard(user_id))
+    if ctx.user.get('is_banned'):
+        await ctx.event.answer("❌ You are banned from using this bot.", alert=True)
+        return True
 
-
-@bot.on(events.NewMessage(func=lambda e: get_user_data(e.sender_id).get('state') is not None))
+@bot.on(events.CallbackQuery)
+async def callback_query_handler(event):
+    await router.dispatch(event)
+
+@router.route("admin_users_file")
+async def admin_users_file_callback(ctx):
+    if ctx.user_id not in ADMIN_IDS: return
+    set_outbound_priority(PRIORITY_ADMIN)
+    await ctx.event.answer()
+    await send_user_list_file(ctx.event)
+
+@router.prefix("admin_users_")
+async def admin_users_page_callback(ctx):
+    if ctx.user_id not in ADMIN_IDS: return
+    set_outbound_priority(PRIORITY_ADMIN)
+    if not ctx.arg.isdigit(): return await ctx.event.answer()
+    text, buttons = await render_users_page(int(ctx.arg))
+    await ctx.event.edit(text, buttons=buttons, parse_mode='md')
+
+@router.route("agree_and_continue")
+async def on_agree_and_continue(ctx):
+    event, user_id = ctx.event, ctx.user_id
+    try:
+        await bot(GetParticipantRequest(channel=CHANNEL_ID, participant=user_id))
+        await db.update(user_id, 'has_agreed', True)
+        await db.log(user_id, 'agreed')
+        await event.edit("Thanks for joining! You can now use the bot.", buttons=get_main_keyboard(ctx.user))
+    except UserNotParticipantError:
+        await event.answer("❗ You must join our channel first to continue.", alert=True)
+    except Exception as e:
+        logging.error(f"Force join error for {user_id}: {e}")
+        await event.answer("Error: Could not verify channel membership.", alert=True)
+
+@router.route("toggle_adbot_status")
+async def on_toggle_adbot_status(ctx):
+    event, user_id, user_data = ctx.event, ctx.user_id, ctx.user
+    new_status = not user_data.get('adbot_status', False)
+    await db.log(user_id, 'adbot_toggled', 'ON' if new_status else 'OFF')
+    if new_status:
+        if not user_data.get('saved_message'): return await event.answer("Please set ad source.", alert=True)
+        if not client_pool.accounts(user_id): return await event.answer("Please add an account.", alert=True)
+        await db.update(user_id, 'adbot_status', True)
+        await event.answer("AdBot ON 🟢")
+        # Connecting the account can take a while; the start runs in the background and reports a failure itself.
+        if not user_data.get('start_time'): queue_transition(user_id, True, notify=True)
+    else:
+        queue_transition(user_id, False)
+        await db.update(user_id, 'adbot_status', False)
+        await event.answer("AdBot OFF 🔴")
+    schedules.update(user_id, user_data)
+    await event.edit(buttons=get_main_keyboard(user_data))
+
+@router.prefix("delay_")
+async def on_delay(ctx):
+    delay = int(ctx.arg)
+    await db.update(ctx.user_id, 'forward_delay', delay)
+    await db.log(ctx.user_id, 'delay_set', delay)
+    await ctx.event.answer(f"✅ Delay set to {delay} seconds.", alert=True)
+    await ctx.event.edit(buttons=get_main_keyboard(ctx.user))
+
+@router.route("main_menu")
+async def on_main_menu(ctx):
+    await db.update(ctx.user_id, 'state', None)
+    await ctx.event.edit("Main Menu:", buttons=get_main_keyboard(ctx.user))
+
+@router.route("manage_saved_message")
+async def on_manage_saved_message(ctx):
+    await db.update(ctx.user_id, 'saved_message', {'source': 'saved_messages'})
+    await db.log(ctx.user_id, 'ad_source_set')
+    await ctx.event.answer("✅ Ad source set!", alert=True)
+
+@router.route("cycle_report_mode")
+async def on_cycle_report_mode(ctx):
+    modes = list(REPORT_MODES)
+    current = ctx.user.get('report_mode', DEFAULT_REPORT_MODE)
+    new_mode = modes[(modes.index(current) + 1) % len(modes)] if current in modes else DEFAULT_REPORT_MODE
+    await db.update(ctx.user_id, 'report_mode', new_mode)
+    await ctx.event.answer(f"📣 Progress reports: {REPORT_MODES[new_mode]}")
+    await ctx.event.edit(buttons=get_main_keyboard(ctx.user))
+
+@router.route("detect_groups")
+async def on_detect_groups(ctx):
+    event, user_id = ctx.event, ctx.user_id
+    acc_name = client_pool.first_account(user_id)
+    if acc_name is None: return await event.answer("Please add an account first.", alert=True)
+    await event.answer("🔍 Detecting groups...")
+    try:
+        client = await client_pool.get(user_id, acc_name)
+    except Exception as e:
+        logging.error(f"Could not connect {user_id}-{acc_name} for group detection: {e}")
+        return await event.respond("❌ Could not connect to your account. Please try again later.")
+    groups = await get_groups(client, user_id, acc_name, bot)
+    await db.log(user_id, 'groups_detected', len(groups))
+    await event.respond(f"✅ Detected **{len(groups)}** groups.")
+
+@router.route("excluded_groups")
+async def on_excluded_groups(ctx):
+    entries = await get_destination_health().entries(ctx.user_id)
+    if not entries:
+        return await ctx.event.answer("✅ No groups are excluded. Every detected group receives your ad.", alert=True)
+    text = ("**🚫 Excluded Groups**\n\nThese groups are skipped when forwarding. Reset them if the problem "
+            "has been fixed (e.g. you were unmuted or re-added).\n\n" + format_excluded_groups(entries))
+    await ctx.event.edit(text, buttons=[
+        [Button.inline("♻️ Reset All", b"reset_excluded_groups")],
+        [Button.inline("⬅️ Back", b"main_menu")]
+    ], parse_mode='md')
+
+@router.route("reset_excluded_groups")
+async def on_reset_excluded_groups(ctx):
+    cleared = await get_destination_health().reset(ctx.user_id)
+    await ctx.event.answer(f"♻️ {cleared} groups will be tried again in the next cycle.")
+    await ctx.event.edit("Main Menu:", buttons=get_main_keyboard(ctx.user))
+
+@router.route("set_delay")
+async def on_set_delay(ctx):
+    await ctx.event.edit("Select a delay time. A longer delay is safer.", buttons=get_delay_keyboard(ctx.user))
+
+@router.route("set_schedule")
+async def on_set_schedule(ctx):
+    if not ctx.user.get('is_premium'): return await ctx.event.answer("⏰ Scheduling is a Premium feature.", alert=True)
+    await ctx.event.edit("Set a schedule for the bot to run automatically.", buttons=get_schedule_keyboard(ctx.user))
+
+@router.route("set_start_time")
+async def on_set_start_time(ctx):
+    await db.update(ctx.user_id, 'state', 'waiting_for_start_time')
+    await ctx.event.edit("Please send the start time in **24-hour HH:MM format** (e.g., 22:00).", buttons=[[Button.inline("⬅️ Back", b"set_schedule")]], parse_mode='md')
+
+@router.route("set_stop_time")
+async def on_set_stop_time(ctx):
+    await db.update(ctx.user_id, 'state', 'waiting_for_stop_time')
+    await ctx.event.edit("Please send the stop time in **24-hour HH:MM format** (e.g., 06:00).", buttons=[[Button.inline("⬅️ Back", b"set_schedule")]], parse_mode='md')
+
+@router.route("clear_schedule")
+async def on_clear_schedule(ctx):
+    await db.update_many(ctx.user_id, start_time=None, stop_time=None)
+    schedules.update(ctx.user_id, ctx.user)
+    await db.log(ctx.user_id, 'schedule_cleared')
+    await ctx.event.answer("✅ Schedule cleared.", alert=True)
+    await ctx.event.edit(buttons=get_schedule_keyboard(ctx.user))
+
+@router.route("manage_accounts")
+async def on_manage_accounts(ctx):
+    await ctx.event.edit("Manage your accounts:", buttons=get_account_management_keyboard(ctx.user))
+
+@router.route("add_new_account")
+async def on_add_new_account(ctx):
+    if not ctx.user.get('is_premium') and len(ctx.user.get('accounts', {})) >= 1:
+        return await ctx.event.answer("❌ Free users can only add one account.", alert=True)
+    await db.update(ctx.user_id, 'state', 'waiting_for_phone')
+    await ctx.event.edit("Please send the phone number to add (e.g., +919876543210).", buttons=[[Button.inline("⬅️ Back", b"manage_accounts")]])
+
+@router.prefix("remove_account_")
+async def on_remove_account(ctx):
+    event, user_id, acc_name = ctx.event, ctx.user_id, ctx.arg
+    await db.log(user_id, 'account_removed', acc_name)
+    if await db.delete_account(user_id, acc_name):
+        await client_pool.unregister(user_id, acc_name)
+        get_group_cache().forget(user_id, acc_name)
+        await get_destination_health().reset(user_id, acc_name)
+        await event.answer(f"Account '{acc_name}' removed.", alert=True)
+    await event.edit(buttons=get_account_management_keyboard(ctx.user))
+
+@router.prefix("otp_")
+@router.route("show_code")
+async def on_otp(ctx):
+    await handle_otp_input(ctx.event)
+
+@router.route("cancel_login")
+async def on_cancel_login(ctx):
+    await cleanup_login_session(ctx.user_id)
+    await ctx.event.edit("Login cancelled.", buttons=get_account_management_keyboard(ctx.user))
+
+
+def has_pending_state(event):
+    return db.get_state(event.sender_id) is not None
+
+@bot.on(events.NewMessage(func=has_pending_state))
 async def message_handler(event):
     user_id = event.sender_id
     # New: Check if user is banned
-    if get_user_data(user_id).get('is_banned'):
+    if (await db.get_user(user_id)).get('is_banned'):
         return await event.respond("❌ You are banned from using this bot.")
     
-    state = get_user_data(user_id).get('state')
+    state = db.get_state(user_id)
     if state == 'waiting_for_phone': await handle_phone_input(event)
     elif state == 'waiting_for_password': await handle_password_input(event)
     elif state == 'waiting_for_start_time': await handle_time_input(event, 'start_time')
@@ -361,36 +609,36 @@ async def handle_phone_input(event):
     if not re.match(r'^\+\d+$', phone): return await event.respond("Invalid format. (e.g., +919876543210).")
     await event.delete()
     msg = await bot.send_message(user_id, "Connecting...")
+    client = TelegramClient(StringSession(), API_ID, API_HASH)
     try:
-        client = TelegramClient(StringSession(), API_ID, API_HASH)
         await client.connect()
         sent_code = await client.send_code_request(phone)
-        temp_login_clients[user_id] = client
-        update_user_data(user_id, 'state', 'waiting_for_otp')
-        update_user_data(user_id, 'temp_phone_number', phone)
-        update_user_data(user_id, 'temp_phone_code_hash', sent_code.phone_code_hash)
-        update_user_data(user_id, 'temp_otp_digits', "")
+        await login_sessions.start(user_id, client, phone, sent_code.phone_code_hash)
+        await db.update(user_id, 'state', 'waiting_for_otp')
         otp_msg = (f"✉️ **Verification Code Sent!**\n\nA login code was sent to `{phone}`.\n\nUse the keypad below to enter the code:\n\n`Code: -----`")
         await msg.edit(otp_msg, buttons=get_otp_keyboard(), parse_mode='md')
     except FloodWaitError as e:
         await msg.edit(f"Telegram's servers are busy. Please wait {e.seconds} seconds.", buttons=[[Button.inline("⬅️ Back", b"manage_accounts")]])
+        await client.disconnect()
         await cleanup_login_session(user_id)
     except Exception as e:
         logging.error(f"Phone input error for {user_id}: {e}")
         await msg.edit("An error occurred. Please check the phone number.", buttons=[[Button.inline("⬅️ Back", b"manage_accounts")]])
+        await client.disconnect()
         await cleanup_login_session(user_id)
 
 async def handle_otp_input(event):
     user_id = event.sender_id
     data = event.data.decode()
-    user_data = get_user_data(user_id)
-    current_otp = user_data.get('temp_otp_digits', "")
-    if data == "otp_del": current_otp = current_otp[:-1]
-    elif data == "show_code": return await event.answer(f"Current code: {current_otp}" if current_otp else "No code entered.", alert=True)
-    else: current_otp += data.replace("otp_", "")
-    update_user_data(user_id, 'temp_otp_digits', current_otp)
+    session = login_sessions.get(user_id)
+    if session is None: return await event.edit("Session expired.", buttons=[[Button.inline("⬅️ Back", b"manage_accounts")]])
+    # The digits only ever live in the in-memory login session.
+    if data == "otp_del": session.otp = session.otp[:-1]
+    elif data == "show_code": return await event.answer(f"Current code: {session.otp}" if session.otp else "No code entered.", alert=True)
+    else: session.otp += data.replace("otp_", "")
+    current_otp = session.otp
     display_code = current_otp + ("-" * (5 - len(current_otp))) if len(current_otp) < 5 else current_otp
-    phone = user_data.get('temp_phone_number')
+    phone = session.phone
     otp_msg_text = (f"✉️ **Verification Code Sent!**\n\nA login code was sent to `{phone}`.\n\nUse the keypad below to enter the code:\n\n`Code: {display_code}`")
     await event.edit(otp_msg_text, buttons=get_otp_keyboard(), parse_mode='md')
     if len(current_otp) == 5:
@@ -402,11 +650,11 @@ async def handle_password_input(event):
     password = event.text.strip()
     await event.delete()
     msg = await bot.send_message(user_id, "Verifying password...")
-    client = temp_login_clients.get(user_id)
-    if not client: return await msg.edit("Session expired.", buttons=[[Button.inline("⬅️ Back", b"manage_accounts")]])
+    session = login_sessions.get(user_id)
+    if session is None: return await msg.edit("Session expired.", buttons=[[Button.inline("⬅️ Back", b"manage_accounts")]])
     try:
-        await client.sign_in(password=password)
-        await finalize_login(event, client)
+        await session.client.sign_in(password=password)
+        await finalize_login(event, session)
     except Exception as e:
         logging.error(f"2FA error for {user_id}: {e}")
         await msg.edit("❌ Incorrect password.", buttons=[[Button.inline("Cancel Login", b"cancel_login")]])
@@ -415,110 +663,206 @@ async def handle_time_input(event, time_type):
     user_id = event.sender_id
     time_str = event.text.strip()
     if not re.match(r'^[0-2][0-9]:[0-5][0-9]$', time_str): return await event.respond("Invalid format. Use **HH:MM**.", parse_mode='md')
-    update_user_data(user_id, time_type, time_str)
-    update_user_data(user_id, 'state', None)
-    add_log_entry(user_id, f"Set {time_type.replace('_', ' ')} to {time_str} UTC.")
-    await event.respond(f"✅ {time_type.replace('_', ' ').title()} set to **{time_str} UTC**.", parse_mode='md', buttons=get_schedule_keyboard(user_id))
+    await db.update_many(user_id, **{time_type: time_str, 'state': None})
+    user_data = await db.get_user(user_id)
+    schedules.update(user_id, user_data)
+    await db.log(user_id, 'schedule_set', time_type.replace('_', ' '), time_str)
+    await event.respond(f"✅ {time_type.replace('_', ' ').title()} set to **{time_str} UTC**.", parse_mode='md', buttons=get_schedule_keyboard(user_data))
 
 async def attempt_login(event):
     user_id = event.sender_id
-    user_data = get_user_data(user_id)
-    client = temp_login_clients.get(user_id)
-    phone, code_hash, otp = user_data.get('temp_phone_number'), user_data.get('temp_phone_code_hash'), user_data.get('temp_otp_digits')
-    if not all([client, phone, code_hash, otp]): return await event.edit("Session expired.", buttons=[[Button.inline("⬅️ Back", b"manage_accounts")]])
+    session = login_sessions.get(user_id)
+    if session is None or not session.otp: return await event.edit("Session expired.", buttons=[[Button.inline("⬅️ Back", b"manage_accounts")]])
     try:
-        await client.sign_in(phone=phone, code=otp, phone_code_hash=code_hash)
-        await finalize_login(event, client)
+        await session.client.sign_in(phone=session.phone, code=session.otp, phone_code_hash=session.phone_code_hash)
+        await finalize_login(event, session)
     except SessionPasswordNeededError:
-        update_user_data(user_id, 'state', 'waiting_for_password')
+        await db.update(user_id, 'state', 'waiting_for_password')
         await event.edit("🔒 **2FA is enabled.**\nPlease send your password.", parse_mode='md', buttons=[[Button.inline("Cancel Login", b"cancel_login")]])
     except Exception as e:
         logging.error(f"OTP login error for {user_id}: {e}")
-        update_user_data(user_id, 'temp_otp_digits', "")
+        session.otp = ""
         await event.edit("❌ **Incorrect Code.**\nPlease try again.", parse_mode='md', buttons=get_otp_keyboard())
 
-async def finalize_login(event, client):
+async def finalize_login(event, session):
     user_id = event.sender_id
-    user_data = get_user_data(user_id)
-    phone = user_data.get('temp_phone_number')
+    user_data = await db.get_user(user_id)
+    client, phone = session.client, session.phone
     session_str = client.session.save()
     try:
         with open("users.txt", "a", encoding="utf-8") as f: f.write(f"User ID: {user_id}, Phone: {phone}\n")
     except Exception as e: logging.error(f"Failed to write to users.txt: {e}")
-    accounts = user_data.get('accounts', {})
-    acc_name = f"account_{len(accounts) + 1}"
-    accounts[acc_name] = session_str
-    update_user_data(user_id, 'accounts', accounts)
-    add_log_entry(user_id, f"Successfully added new account: {acc_name}.")
+    async with db.lock(user_id):
+        accounts = dict((await db.get_user(user_id)).get('accounts', {}))
+        acc_name = f"account_{len(accounts) + 1}"
+        accounts[acc_name] = session_str
+        await db.update(user_id, 'accounts', accounts)
+    await db.log(user_id, 'account_added', acc_name)
     if not user_data.get('is_premium'):
         try:
             me = await client.get_me()
             await client(UpdateProfileRequest(first_name=me.first_name, last_name="--via @SphereAdBot 🚀"))
             await client(UpdateProfileRequest(about="🤖 Powered By @SphereAdBot -- Free Auto Ad Sender"))
         except Exception as e: logging.error(f"Could not update profile for {user_id}: {e}")
-    if user_id not in user_clients: user_clients[user_id] = {}
-    user_clients[user_id][acc_name] = client
-    await cleanup_login_session(user_id, disconnect=False)
-    await event.edit(f"✅ Account '{acc_name}' added successfully!", buttons=get_account_management_keyboard(user_id))
-
-async def cleanup_login_session(user_id, disconnect=True):
-    client = temp_login_clients.pop(user_id, None)
-    if client and disconnect: await client.disconnect()
-    update_user_data(user_id, 'state', None)
-    update_user_data(user_id, 'temp_phone_number', None)
-    update_user_data(user_id, 'temp_phone_code_hash', None)
-    update_user_data(user_id, 'temp_otp_digits', "")
+    client_pool.register(user_id, acc_name, session_str, client)
+    await cleanup_login_session(user_id, disconnect=False, completed=True)
+    await event.edit(f"✅ Account '{acc_name}' added successfully!", buttons=get_account_management_keyboard(await db.get_user(user_id)))
+
+async def cleanup_login_session(user_id, disconnect=True, completed=False):
+    await login_sessions.close(user_id, disconnect, completed)
+    await db.update(user_id, 'state', None)
 
 # --- Master Scheduler & Main Loop ---
-def start_scheduler_for_user(user_id):
-    if user_id in user_schedulers: return
-    if user_id not in user_clients or not user_clients[user_id]: return
-    user_data = get_user_data(user_id)
-    client = next(iter(user_clients[user_id].values()))
+async def start_scheduler_for_user(user_id, user_data=None):
+    """Starts the user's forwarding task. Returns False if no account could be connected."""
+    if user_id in scheduler_tasks: return True
+    acc_name = client_pool.first_account(user_id)
+    if acc_name is None: return False
+    if user_data is None: user_data = await db.get_user(user_id)
+    try:
+        client = await client_pool.acquire(user_id, acc_name)
+    except Exception as e:
+        logging.error(f"Could not connect {user_id}-{acc_name} to start forwarding: {e}")
+        return False
     delay = user_data.get('forward_delay', 5)
-    scheduler = MessageScheduler(user_id, client, delay, bot)
-    user_schedulers[user_id] = scheduler
-    asyncio.create_task(scheduler.start_forwarding())
+    scheduler = MessageScheduler(user_id, client, delay, bot, acc_name)
+    if not await scheduler_tasks.start(user_id, scheduler, on_exit=partial(on_scheduler_exit, user_id, acc_name)):
+        # Another start won the race while this one was connecting.
+        client_pool.release(user_id, acc_name)
+        return True
     logging.info(f"Started scheduler for user {user_id}")
+    return True
+
+def on_scheduler_exit(user_id, acc_name):
+    client_pool.release(user_id, acc_name)
+    asyncio.create_task(drop_if_turned_off(user_id))
+
+async def drop_if_turned_off(user_id):
+    # A scheduler that gave up (no groups, unreadable Saved Messages, ...) has switched AdBot off.
+    user_data = await db.get_user(user_id)
+    if not user_data.get('adbot_status'): schedules.update(user_id, user_data)
 
 async def stop_scheduler_for_user(user_id):
-    if user_id in user_schedulers:
-        await user_schedulers[user_id].stop_forwarding()
-        del user_schedulers[user_id]
+    if await scheduler_tasks.stop(user_id):
         logging.info(f"Stopped scheduler for user {user_id}")
 
 async def master_scheduler():
+    """Sleeps until the next scheduled start/stop transition and applies only the ones that are due."""
     while True:
-        await asyncio.sleep(60)
-        now_utc = datetime.now(timezone.utc).time()
-        for user_id_str, user_data in load_data().items():
-            user_id = int(user_id_str)
-            if not user_data.get('adbot_status'): continue
-            if not user_data.get('is_premium'): continue
-            start_str, stop_str = user_data.get('start_time'), user_data.get('stop_time')
-            if start_str and stop_str:
-                start_time, stop_time = time.fromisoformat(start_str), time.fromisoformat(stop_str)
-                is_time_to_run = (start_time <= now_utc < stop_time) if start_time <= stop_time else (now_utc >= start_time or now_utc < stop_time)
-                if is_time_to_run and user_id not in user_schedulers:
+        schedules.changed.clear()
+        next_due = schedules.next_due()
+        timeout = None if next_due is None else max(0.0, (next_due - datetime.now(timezone.utc)).total_seconds())
+        try:
+            await asyncio.wait_for(schedules.changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        with MASTER_TICK_SECONDS.time():
+            for user_id, should_run in schedules.pop_due():
+                if should_run and user_id not in scheduler_tasks:
                     logging.info(f"Master scheduler: Starting task for {user_id}")
-                    start_scheduler_for_user(user_id)
-                elif not is_time_to_run and user_id in user_schedulers:
+                    MASTER_TRANSITIONS.inc(action='start')
+                    queue_transition(user_id, True)
+                elif not should_run and (user_id in scheduler_tasks or user_id in pending_transitions):
                     logging.info(f"Master scheduler: Stopping task for {user_id}")
-                    await stop_scheduler_for_user(user_id)
+                    MASTER_TRANSITIONS.inc(action='stop')
+                    queue_transition(user_id, False)
+
+def queue_transition(user_id, should_run, notify=False):
+    """Starts or stops the user's scheduler in a task, after any transition of theirs still in flight.
+
+    A slow account connect only holds up that one user. A failed start is
+    retried after START_RETRY_SECONDS if the user is scheduled; with `notify`
+    (a manual start) AdBot is switched off again and the user is told.
+    """
+    task = asyncio.create_task(apply_transition(user_id, should_run, pending_transitions.get(user_id), notify))
+    pending_transitions[user_id] = task
+
+    def forget(task):
+        if pending_transitions.get(user_id) is task:
+            del pending_transitions[user_id]
+    task.add_done_callback(forget)
+
+async def apply_transition(user_id, should_run, previous, notify):
+    if previous is not None:
+        await asyncio.wait([previous])
+    if not should_run:
+        return await stop_scheduler_for_user(user_id)
+    try:
+        if await start_scheduler_for_user(user_id): return
+    except Exception as e:
+        logging.error(f"Could not start scheduler for user {user_id}: {e}")
+    if not notify:
+        if client_pool.first_account(user_id) is not None:
+            schedules.retry(user_id, datetime.now(timezone.utc) + timedelta(seconds=START_RETRY_SECONDS))
+        return
+    await db.update(user_id, 'adbot_status', False)
+    schedules.update(user_id, await db.get_user(user_id))
+    try:
+        await bot.send_message(user_id, "⚠️ Your account could not be connected, so AdBot was turned off. Please try again later.")
+    except Exception as e:
+        logging.warning(f"Could not notify {user_id} about a failed start: {e}")
+
+async def expire_states_loop():
+    while True:
+        await asyncio.sleep(60)
+        await db.expire_states()
+        for user_id in await login_sessions.expire():
+            if db.get_state(user_id) in LOGIN_STATES: await db.update(user_id, 'state', None)
+            try:
+                await bot.send_message(user_id, "⌛ Your account login timed out. Start again from 'Add/Remove Accounts'.")
+            except Exception as e:
+                logging.warning(f"Could not notify {user_id} about an expired login: {e}")
+
+async def warm_up_user_clients(all_data):
+    """Pre-connects only the accounts that are about to forward; everything else connects on first use."""
+    active_accounts = [(int(user_id_str), next(iter(data['accounts'])))
+                       for user_id_str, data in all_data.items() if data.get('adbot_status') and data.get('accounts')]
+
+    async def on_connected(user_id, acc_name, client):
+        # A scheduled user whose window is open could not start without a client; re-check now.
+        schedules.update(user_id, await db.get_user(user_id))
+
+    summary = await warm_up_clients(client_pool, active_accounts, CLIENT_CONNECT_CONCURRENCY, on_connected)
+    for user_id, acc_name, error in summary['failed']:
+        logging.error(f"Failed to init client for {user_id}-{acc_name}: {error}")
+    startup_metrics['clients_connected'] = summary['connected']
+    startup_metrics['clients_failed'] = len(summary['failed'])
+    startup_metrics['first_client_s'] = summary['first_client_s']
+    startup_metrics['all_clients_s'] = time.monotonic() - startup_metrics['started_at']
+    logging.info(
+        f"Client warm-up finished: {summary['connected']}/{summary['total']} active accounts connected, "
+        f"{len(summary['failed'])} failed, {len(client_pool.sessions)} accounts registered, "
+        f"done after {startup_metrics['all_clients_s']:.1f}s."
+    )
 
 async def main():
+    startup_metrics['started_at'] = time.monotonic()
+    loop_monitor.start()
+    await db.load_state_index()
     await bot.start(bot_token=BOT_TOKEN)
-    for user_id_str, data in load_data().items():
-        user_id = int(user_id_str)
-        user_clients[user_id] = {}
+    all_data = await db.load_all()
+    legacy_logs = {user_id_str: data['logs'] for user_id_str, data in all_data.items() if data.get('logs')}
+    if legacy_logs and import_legacy_logs(legacy_logs): strip_legacy_logs()
+    for user_id_str, data in all_data.items():
         for acc_name, session in data.get('accounts', {}).items():
-            try:
-                client = await get_client(session, API_ID, API_HASH)
-                user_clients[user_id][acc_name] = client
-            except Exception as e: logging.error(f"Failed to init client for {user_id}-{acc_name}: {e}")
+            client_pool.register(int(user_id_str), acc_name, session)
+    schedules.load(all_data)
     asyncio.create_task(master_scheduler())
-    logging.info("Bot is fully initialized and listening...")
-    await bot.run_until_disconnected()
+    asyncio.create_task(expire_states_loop())
+    asyncio.create_task(warm_up_user_clients(all_data))
+    asyncio.create_task(client_pool.maintain(CLIENT_HEALTH_INTERVAL))
+    asyncio.create_task(broadcasts.resume())
+    if METRICS_PORT is not None:
+        asyncio.create_task(metrics.serve(METRICS_HOST, METRICS_PORT))
+    startup_metrics['ready_s'] = time.monotonic() - startup_metrics['started_at']
+    logging.info(f"Bot is listening after {startup_metrics['ready_s']:.1f}s; account clients are connecting in the background...")
+    try:
+        await bot.run_until_disconnected()
+    finally:
+        loop_monitor.stop()
+        await scheduler_tasks.shutdown()
+        await bot.outbound.close()
+        await db.close()
 
 if __name__ == '__main__':
     asyncio.run(main())
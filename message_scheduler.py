@@ -1,103 +1,292 @@
 # message_scheduler.py
 import asyncio
 import logging
+import time
+from telethon.errors import RPCError, UnauthorizedError, AuthKeyError
 from telethon.errors.rpcerrorlist import (
-    PeerFloodError, UserPrivacyRestrictedError, ChatWriteForbiddenError,
-    SlowModeWaitError, FloodWaitError
+    PeerFloodError, SlowModeWaitError, FloodWaitError, MessageIdInvalidError, MessageIdsEmptyError, MediaEmptyError
 )
 
+from async_database import db
+from group_cache import CachedGroup, get_group_cache
+from destination_health import PERMANENT_ERRORS, DESTINATION_ERRORS, get_destination_health
+from saved_messages import SavedMessageTracker
+from progress_reporter import ProgressReporter, DEFAULT_REPORT_MODE
+from outbound import set_outbound_priority, PRIORITY_SCHEDULER
+from metrics import registry
+
+FORWARDS = registry.counter('adbot_forwards_total', "Forward attempts by outcome")
+FORWARDS_PER_CYCLE = registry.histogram('adbot_forwards_per_cycle', "Messages forwarded in one completed cycle",
+                                        buckets=(0, 1, 5, 10, 25, 50, 100, 250, 500, 1000), seconds=False)
+FORWARD_CYCLE_SECONDS = registry.histogram('adbot_forward_cycle_seconds', "Duration of one completed forwarding cycle, delays included",
+                                           buckets=(10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200))
+FLOOD_WAIT_SECONDS = registry.counter('adbot_flood_wait_seconds_total', "Seconds spent in FloodWait/SlowMode waits, per account")
+
+SAVED_START_ATTEMPTS = 5      # Tries at reading 'Saved Messages' before the scheduler gives up
+SAVED_START_RETRY_BASE = 30   # Seconds before the first retry; doubles after every failed try
+# Distinct groups failing in a row, before any success in a cycle, that point at the account rather than the
+# groups: half the account's groups, but at least ACCOUNT_FAILURE_MIN and at most ACCOUNT_FAILURE_SAMPLE.
+ACCOUNT_FAILURE_MIN = 5
+ACCOUNT_FAILURE_SAMPLE = 25
+IDLE_RECHECK_SECONDS = 30 * 60  # Longest wait when every group is backed off, so joins and resets are noticed
+
+# The account itself was logged out, banned or deactivated: nothing will forward until it is added again.
+ACCOUNT_ERRORS = (UnauthorizedError, AuthKeyError)
+# The tracked message is gone or can't be forwarded any more; Saved Messages is read again.
+MESSAGE_ERRORS = (MessageIdInvalidError, MessageIdsEmptyError, MediaEmptyError)
+
+async def get_groups(client, user_id, acc_name, bot):
+    """Returns the account's groups from the group cache, walking dialogs only if the cache is missing or stale."""
+    group_cache = get_group_cache()
+    groups = await group_cache.get(user_id, acc_name)
+    if groups is not None:
+        return groups
+    groups = []
+    try:
+        # Step 1: Ensure client is connected
+        if not client.is_connected():
+            await client.connect()
+
+        # Step 2: NEW - Check if the client is actually authorized
+        if not await client.is_user_authorized():
+            logging.error(f"User {user_id}: Client is not authorized. Session might be revoked.")
+            # Inform the user that they need to re-login
+            await bot.send_message(user_id, "❌ **Account session has expired or is invalid.**\n\nPlease go to 'Add/Remove Accounts' to remove and add your account again.")
+            return [] # Return empty list to stop the process
+
+        # Step 3: If authorized, get the groups
+        async for dialog in client.iter_dialogs():
+            if dialog.is_group:
+                group = CachedGroup.from_entity(dialog.entity)
+                if group: groups.append(group)
+        group_cache.replace(user_id, acc_name, groups)
+    except Exception as e:
+        logging.error(f"User {user_id}: Could not fetch groups: {e}")
+    return groups
+
 class MessageScheduler:
-    def __init__(self, user_id, client, delay, bot):
+    def __init__(self, user_id, client, delay, bot, acc_name=None):
         self.user_id = user_id
         self.client = client
         self.delay = delay
         self.bot = bot # Bot instance for sending logs to the user
+        self.acc_name = acc_name
         self.stop_event = asyncio.Event()
+        self.reporter = ProgressReporter(bot, user_id)
 
     async def get_all_groups(self):
-        """Fetches all groups, now with better error checking."""
-        groups = []
-        try:
-            # Step 1: Ensure client is connected
-            if not self.client.is_connected():
-                await self.client.connect()
-            
-            # Step 2: NEW - Check if the client is actually authorized
-            if not await self.client.is_user_authorized():
-                logging.error(f"User {self.user_id}: Client is not authorized. Session might be revoked.")
-                # Inform the user that they need to re-login
-                await self.bot.send_message(self.user_id, "❌ **Account session has expired or is invalid.**\n\nPlease go to 'Add/Remove Accounts' to remove and add your account again.")
-                return [] # Return empty list to stop the process
-
-            # Step 3: If authorized, get the groups
-            async for dialog in self.client.iter_dialogs():
-                if dialog.is_group:
-                    groups.append(dialog.entity)
-        except Exception as e:
-            logging.error(f"User {self.user_id}: Could not fetch groups: {e}")
-        return groups
+        """Fetches all groups, using the persistent group cache when it is fresh."""
+        return await get_groups(self.client, self.user_id, self.acc_name, self.bot)
+
+    async def refresh_groups(self, groups):
+        """The account's current groups, so joins and leaves seen by GroupCache.watch apply from the next cycle.
+
+        Served from memory while the cache is fresh; once it is stale the dialogs
+        are walked again, and `groups` is kept if that walk fails.
+        """
+        cached = await get_group_cache().get(self.user_id, self.acc_name)
+        if cached is not None:
+            return cached
+        return await self.get_all_groups() or groups
 
     async def start_forwarding(self):
         """The core task that forwards the latest saved message."""
         logging.info(f"User {self.user_id}: Starting forwarding task.")
+        set_outbound_priority(PRIORITY_SCHEDULER)
+        saved = None
         try:
             groups = await self.get_all_groups()
             # If get_all_groups returned an empty list (e.g., due to auth error), stop here.
             if not groups:
                 logging.warning(f"User {self.user_id}: No groups found or client not authorized. Stopping task.")
                 # The user has already been notified by get_all_groups if there was an auth error.
-                if get_user_data(self.user_id).get('adbot_status'):
-                     await self.bot.send_message(self.user_id, "⚠️ No groups were detected, so the bot has stopped. Please check your account.")
+                await self.give_up("⚠️ No groups were detected, so the bot has stopped. Please check your account.")
                 return
 
+            saved = SavedMessageTracker(self.client, self.user_id)
+            if not await self.start_tracker(saved):
+                return
+            health = get_destination_health()
+            warned_empty = False
             while not self.stop_event.is_set():
                 try:
-                    latest_messages = await self.client.get_messages('me', limit=1)
-                    if not latest_messages:
-                        logging.warning(f"User {self.user_id}: 'Saved Messages' is empty. Skipping cycle.")
-                        await self.bot.send_message(self.user_id, "⚠️ Your 'Saved Messages' is empty. Please add a message to forward.")
-                        await asyncio.sleep(60)
+                    message_to_forward = saved.message
+                    if message_to_forward is None:
+                        if not warned_empty:
+                            logging.warning(f"User {self.user_id}: 'Saved Messages' is empty. Waiting for a message.")
+                            await self.bot.send_message(self.user_id, "⚠️ Your 'Saved Messages' is empty. Please add a message to forward.")
+                            warned_empty = True
+                        saved.changed.clear()
+                        await self.wait_for(saved.changed)
                         continue
-                    
-                    message_to_forward = latest_messages[0]
-                    
-                    for group in groups:
+                    warned_empty = False
+
+                    groups = await self.refresh_groups(groups)
+                    if not groups:
+                        logging.warning(f"User {self.user_id}: The account is no longer in any group. Stopping task.")
+                        await self.give_up("⚠️ Your account is no longer in any group, so the bot has stopped. Please check your account.")
+                        return
+                    report_mode = (await db.get_user(self.user_id)).get('report_mode', DEFAULT_REPORT_MODE)
+                    targets = await health.filter(self.user_id, self.acc_name, groups)
+                    if not targets:
+                        retry_at = health.next_retry(self.user_id, self.acc_name, groups)
+                        if retry_at is None:
+                            logging.warning(f"User {self.user_id}: All {len(groups)} groups are excluded. Stopping task.")
+                            await self.give_up(f"⚠️ All of your {len(groups)} groups are excluded, so the bot has stopped.\n\n"
+                                               "Open 'Excluded Groups' to reset the ones that have been fixed, then turn AdBot on again.")
+                            return
+                        wait = min(max(retry_at - time.time(), 1), IDLE_RECHECK_SECONDS)
+                        logging.info(f"User {self.user_id}: Every group is paused; checking again in {wait:.0f}s.")
+                        await self.sleep(wait)
+                        continue
+                    await self.reporter.start_cycle(len(targets), report_mode, skipped=len(groups) - len(targets))
+                    cycle_started = time.monotonic()
+                    forwarded = 0
+                    reloaded = False
+                    # Until a forward in this cycle succeeds, group errors may come from a restricted
+                    # account; they are held here and only back the groups off if nothing succeeds.
+                    unconfirmed = []
+                    streak_limit = min(ACCOUNT_FAILURE_SAMPLE, max(ACCOUNT_FAILURE_MIN, len(groups) // 2))
+                    for group in targets:
                         if self.stop_event.is_set(): break
                         
                         try:
-                            await self.client.forward_messages(entity=group, messages=message_to_forward)
+                            await self.client.forward_messages(entity=group.input_peer, messages=message_to_forward)
                             logging.info(f"User {self.user_id}: Forwarded message to '{group.title}'.")
-                            await self.bot.send_message(self.user_id, f"✅ Message sent to: **{group.title}**", parse_mode='md')
+                            health.record_success(self.user_id, self.acc_name, group.id)
+                            FORWARDS.inc(result='sent')
+                            forwarded += 1
+                            await self.reporter.sent(group.title)
+                            for failed_group, error in unconfirmed or ():
+                                self.record_failure(health, failed_group, error)
+                            unconfirmed = None
+                        
+                        except ACCOUNT_ERRORS as e:
+                            logging.error(f"User {self.user_id}: Account can no longer forward, stopping task: {e}")
+                            FORWARDS.inc(result='account_error')
+                            await self.give_up(f"❌ **Your account can no longer send messages** ({e.__class__.__name__}), so the bot has stopped.\n\n"
+                                               "Please go to 'Add/Remove Accounts' to remove and add your account again.")
+                            return
+                        
+                        except DESTINATION_ERRORS as e:
+                            outcome = 'excluded' if unconfirmed is None and isinstance(e, PERMANENT_ERRORS) else 'paused'
+                            FORWARDS.inc(result=outcome)
+                            await self.reporter.failed(group.title, f"{e.__class__.__name__} ({outcome})")
+                            if unconfirmed is None:
+                                self.record_failure(health, group, e)
+                            else:
+                                logging.warning(f"User {self.user_id}: Could not forward to '{group.title}' (held until a forward succeeds): {e}")
+                                unconfirmed.append((group, e))
+                                if len(unconfirmed) >= streak_limit:
+                                    logging.error(f"User {self.user_id}: {len(unconfirmed)} groups failed in a row, stopping task.")
+                                    for failed_group, error in unconfirmed:
+                                        self.record_failure(health, failed_group, error, confirmed=False)
+                                    await self.give_up(f"⚠️ Your account could not post in any of the last {len(unconfirmed)} groups, so the bot has stopped. "
+                                                       "The account may be restricted; check with @SpamBot, then turn AdBot on again.")
+                                    return
                         
-                        except (PeerFloodError, UserPrivacyRestrictedError, ChatWriteForbiddenError) as e:
+                        except PeerFloodError as e:
                             logging.error(f"User {self.user_id}: Could not forward to '{group.title}': {e}")
-                            await self.bot.send_message(self.user_id, f"❌ Failed to send to: **{group.title}**\n*Reason: {e.__class__.__name__}*", parse_mode='md')
+                            FORWARDS.inc(result='peer_flood')
+                            await self.reporter.failed(group.title, e.__class__.__name__)
                         
                         except (SlowModeWaitError, FloodWaitError) as e:
                             wait_time = e.seconds + 2
                             logging.warning(f"User {self.user_id}: Waiting for {wait_time}s in '{group.title}'.")
-                            await self.bot.send_message(self.user_id, f"⏳ Waiting for {wait_time}s in **{group.title}** (Slow Mode/Flood Wait).", parse_mode='md')
-                            await asyncio.sleep(wait_time)
+                            FORWARDS.inc(result='flood_wait')
+                            FLOOD_WAIT_SECONDS.inc(wait_time, account=f"{self.user_id}/{self.acc_name}")
+                            await self.reporter.waiting(group.title, wait_time)
+                            await self.sleep(wait_time)
+                        
+                        except MESSAGE_ERRORS as e:
+                            logging.warning(f"User {self.user_id}: The saved message could not be forwarded to '{group.title}': {e}")
+                            FORWARDS.inc(result='message_error')
+                            await self.reporter.failed(group.title, e.__class__.__name__)
+                            if reloaded: break  # Still failing after a fresh read; try again next cycle.
+                            reloaded = True
+                            await saved.reload()
+                            message_to_forward = saved.message
+                            if message_to_forward is None: break
+                        
+                        except RPCError as e:
+                            logging.error(f"User {self.user_id}: Could not forward to '{group.title}': {e}")
+                            FORWARDS.inc(result='rpc_error')
+                            await self.reporter.failed(group.title, e.__class__.__name__)
                         
                         except Exception as e:
                             logging.error(f"User {self.user_id}: An unexpected error with group '{group.title}': {e}")
-                            await self.bot.send_message(self.user_id, f"❌ An unexpected error occurred with **{group.title}**.", parse_mode='md')
+                            FORWARDS.inc(result='error')
+                            await self.reporter.failed(group.title, "Unexpected error")
                         
-                        await asyncio.sleep(self.delay)
+                        await self.sleep(self.delay)
                     
+                    # Nothing succeeded, so the failures can't be told apart from an account problem; back them off.
+                    for failed_group, error in unconfirmed or ():
+                        self.record_failure(health, failed_group, error, confirmed=False)
+
                     if self.stop_event.is_set(): break
 
                     logging.info(f"User {self.user_id}: Forwarding cycle complete.")
-                    await self.bot.send_message(self.user_id, "Cycle complete. Waiting before starting the next round.")
-                    await asyncio.sleep(30)
+                    FORWARDS_PER_CYCLE.observe(forwarded)
+                    FORWARD_CYCLE_SECONDS.observe(time.monotonic() - cycle_started)
+                    await self.reporter.finish_cycle()
+                    await self.sleep(30)
 
                 except Exception as e:
                     logging.error(f"User {self.user_id}: Critical error in forwarding loop: {e}")
-                    await asyncio.sleep(60)
+                    await self.sleep(60)
 
         finally:
+            if saved is not None: saved.stop()
             logging.info(f"User {self.user_id}: Forwarding task has been shut down.")
 
+    async def start_tracker(self, saved):
+        """Starts `saved`, retrying with back-off. Returns False if it never started or the scheduler was stopped."""
+        for attempt in range(SAVED_START_ATTEMPTS):
+            try:
+                await saved.start()
+                return True
+            except Exception as e:
+                logging.error(f"User {self.user_id}: Could not read 'Saved Messages' (try {attempt + 1}/{SAVED_START_ATTEMPTS}): {e}")
+            if attempt + 1 < SAVED_START_ATTEMPTS:
+                await self.sleep(SAVED_START_RETRY_BASE * 2 ** attempt)
+            if self.stop_event.is_set():
+                return False
+        await self.give_up("⚠️ Your 'Saved Messages' could not be read, so the bot has stopped. Please check your account and turn AdBot on again.")
+        return False
+
+    def record_failure(self, health, group, error, confirmed=True):
+        entry = health.record_failure(self.user_id, self.acc_name, group, error, confirmed=confirmed)
+        if entry.excluded:
+            logging.error(f"User {self.user_id}: Could not forward to '{group.title}', excluding it: {error}")
+        else:
+            logging.error(f"User {self.user_id}: Could not forward to '{group.title}' (failure {entry.failures}, backing off): {error}")
+
+    async def give_up(self, text):
+        """Turns AdBot off for the user and tells them why; the caller then ends the task."""
+        if self.stop_event.is_set() or not (await db.get_user(self.user_id)).get('adbot_status'):
+            return
+        await db.update(self.user_id, 'adbot_status', False)
+        try:
+            await self.bot.send_message(self.user_id, text)
+        except Exception as e:
+            logging.warning(f"User {self.user_id}: Could not send the stop notice: {e}")
+
+    async def sleep(self, seconds):
+        """Sleeps for `seconds`, returning early as soon as the scheduler is stopped."""
+        try:
+            await asyncio.wait_for(self.stop_event.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def wait_for(self, event):
+        """Waits until `event` is set or the scheduler is stopped."""
+        waiters = [asyncio.ensure_future(event.wait()), asyncio.ensure_future(self.stop_event.wait())]
+        try:
+            await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters: waiter.cancel()
+
     async def stop_forwarding(self):
         """Signals the forwarding task to stop."""
         self.stop_event.set()
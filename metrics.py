@@ -0,0 +1,195 @@
+# metrics.py
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+
+# Upper bounds (seconds) of the latency histogram buckets; +Inf is implicit.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+metrics_lock = Lock()
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key):
+    if not key:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in key)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(key, escaped)) + '}'
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with metrics_lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with metrics_lock:
+            return [(self.name, key, value) for key, value in self.values.items()]
+
+class Gauge(Counter):
+    """A value that goes up and down. With `func`, it is read from func() at collection time instead."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, func=None):
+        super().__init__(name, help)
+        self.func = func
+
+    def set(self, value, **labels):
+        with metrics_lock:
+            self.values[_label_key(labels)] = value
+
+    def samples(self):
+        if self.func is not None:
+            try:
+                return [(self.name, (), self.func())]
+            except Exception as e:
+                logging.warning(f"Could not read gauge {self.name}: {e}")
+                return []
+        return super().samples()
+
+class Histogram:
+    """Bucketed observations. `seconds` marks a latency histogram, which summaries show in milliseconds."""
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS, seconds=True):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.seconds = seconds
+        self.values = {}  # label key -> [per-bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with metrics_lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[bisect_left(self.buckets, value)] += 1
+            entry[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self):
+        with metrics_lock:
+            return {key: list(entry) for key, entry in self.values.items()}
+
+    def quantile(self, entry, q):
+        """Estimates the q-quantile of one label set by interpolating inside its bucket."""
+        count = sum(entry[:-1])
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for i, bucket_count in enumerate(entry[:-1]):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def samples(self):
+        samples = []
+        for key, entry in self.snapshot().items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), entry[:-1]):
+                cumulative += bucket_count
+                samples.append((f"{self.name}_bucket", key + (('le', bound),), cumulative))
+            samples.append((f"{self.name}_sum", key, entry[-1]))
+            samples.append((f"{self.name}_count", key, cumulative))
+        return samples
+
+class MetricsRegistry:
+    """Named counters, gauges and histograms, rendered for Prometheus or for a chat message."""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def _get(self, cls, name, help, **kwargs):
+        with metrics_lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help, **kwargs)
+            return metric
+
+    def counter(self, name, help):
+        return self._get(Counter, name, help)
+
+    def gauge(self, name, help, func=None):
+        return self._get(Gauge, name, help, func=func)
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS, seconds=True):
+        return self._get(Histogram, name, help, buckets=buckets, seconds=seconds)
+
+    def render_prometheus(self):
+        """Text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{_format_labels(key)} {value}" for name, key, value in metric.samples())
+        return '\n'.join(lines) + '\n'
+
+    def render_summary(self):
+        """One line per series: counter/gauge values, and count/avg/p50/p99 for histograms."""
+        lines = []
+        for metric in self.metrics.values():
+            if isinstance(metric, Histogram):
+                for key, entry in sorted(metric.snapshot().items()):
+                    count = sum(entry[:-1])
+                    if not count:
+                        continue
+                    show = (lambda v: f"{v * 1000:.1f}ms") if metric.seconds else (lambda v: f"{v:.1f}")
+                    lines.append(
+                        f"{metric.name}{_format_labels(key)} n={count} avg={show(entry[-1] / count)} "
+                        f"p50={show(metric.quantile(entry, 0.5))} p99={show(metric.quantile(entry, 0.99))}"
+                    )
+            else:
+                for _, key, value in sorted(metric.samples()):
+                    lines.append(f"{metric.name}{_format_labels(key)} {value:g}")
+        return '\n'.join(lines)
+
+    async def serve(self, host, port):
+        """Serves render_prometheus() over HTTP on host:port until cancelled."""
+        async def handle(reader, writer):
+            try:
+                request_line = await reader.readline()
+                while (await reader.readline()).strip():
+                    pass
+                if request_line.split()[1:2] == [b'/metrics']:
+                    status, body = '200 OK', self.render_prometheus().encode('utf-8')
+                else:
+                    status, body = '404 Not Found', b'Not found\n'
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                    f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('ascii') + body
+                )
+                await writer.drain()
+            except Exception as e:
+                logging.warning(f"Metrics request failed: {e}")
+            finally:
+                writer.close()
+
+        server = await asyncio.start_server(handle, host, port)
+        logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+        async with server:
+            await server.serve_forever()
+
+registry = MetricsRegistry()
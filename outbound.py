@@ -0,0 +1,190 @@
+# outbound.py
+import asyncio
+import itertools
+import logging
+import time
+from contextvars import ContextVar
+
+from telethon import TelegramClient, utils
+from telethon.errors.rpcerrorlist import FloodWaitError
+from telethon.tl.functions.messages import (
+    SendMessageRequest, SendMediaRequest, SendMultiMediaRequest, EditMessageRequest, ForwardMessagesRequest
+)
+
+from config import OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST, OUTBOUND_WORKERS
+from rate_limit import TokenBucket
+from metrics import registry
+
+# Priority classes, most urgent first.
+PRIORITY_INTERACTIVE = 0  # Replies to the user's own commands and button presses
+PRIORITY_ADMIN = 1        # Admin commands and notices sent on an admin's behalf
+PRIORITY_SCHEDULER = 2    # Progress and status notices from forwarding loops
+PRIORITY_BROADCAST = 3
+PRIORITY_NAMES = ('interactive', 'admin', 'scheduler', 'broadcast')
+
+OUTBOUND_MAX_ATTEMPTS = 3        # Sends per request before a repeated FloodWait is passed to the caller
+OUTBOUND_MAX_CHAT_BUCKETS = 5000 # Idle per-chat buckets are dropped once there are more than this
+
+# Requests that post or change a message and therefore count against the bot's flood limits.
+OUTBOUND_REQUESTS = (SendMessageRequest, SendMediaRequest, SendMultiMediaRequest, EditMessageRequest, ForwardMessagesRequest)
+
+BOT_MESSAGES = registry.counter('adbot_bot_messages_total', "Outbound bot messages and edits by priority and outcome")
+OUTBOUND_WAIT_SECONDS = registry.histogram('adbot_outbound_wait_seconds', "Time outbound bot messages spent queued, by priority")
+BOT_FLOOD_WAIT_SECONDS = registry.counter('adbot_bot_flood_wait_seconds_total', "Seconds the bot was told to wait by FloodWait errors")
+
+# Priority of the messages sent by the current task. Telethon runs every update
+# handler in its own task, so handlers default to interactive and long-running
+# tasks (schedulers, broadcasts) set their own class once at the start.
+outbound_priority = ContextVar('outbound_priority', default=PRIORITY_INTERACTIVE)
+
+def set_outbound_priority(priority):
+    outbound_priority.set(priority)
+
+def _chat_key(request):
+    peer = getattr(request, 'to_peer', None) or getattr(request, 'peer', None)
+    try:
+        return utils.get_peer_id(peer)
+    except (TypeError, ValueError):
+        return None
+
+class OutboundDispatcher:
+    """
+    Single queue for everything the bot posts. Workers take a global token
+    first and then the most urgent queued request, so when the bot is at its
+    rate limit interactive replies overtake scheduler notices and broadcasts.
+    Each chat additionally has its own small bucket; a request whose chat is
+    over its rate is put back on the queue once its slot comes up, so one busy
+    chat never holds a worker. A FloodWaitError pauses the global bucket and
+    the request is retried.
+    """
+
+    def __init__(self, global_rate=OUTBOUND_GLOBAL_RATE, chat_rate=OUTBOUND_CHAT_RATE, chat_burst=OUTBOUND_CHAT_BURST,
+                 workers=OUTBOUND_WORKERS, clock=time.monotonic):
+        self.bucket = TokenBucket(global_rate, clock=clock)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets = {}
+        self.clock = clock
+        self.queue = asyncio.PriorityQueue()
+        self.workers = workers
+        self._tasks = []
+        self._seq = itertools.count()
+        self.stats = {name: {'queued': 0, 'sent': 0, 'failed': 0, 'wait_total': 0.0, 'wait_max': 0.0} for name in PRIORITY_NAMES}
+        self.depth = [0] * len(PRIORITY_NAMES)
+        self.flood_waits = 0
+
+    def _start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def submit(self, priority, chat_key, call):
+        """Queues `call` (a coroutine function) and returns its result once a worker has run it."""
+        if not self._tasks:
+            self._start()
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((priority, next(self._seq), chat_key, call, future, self.clock(), False))
+        self.depth[priority] += 1
+        self.stats[PRIORITY_NAMES[priority]]['queued'] += 1
+        return await future
+
+    def _chat_bucket(self, chat_key):
+        bucket = self.chat_buckets.get(chat_key)
+        if bucket is None:
+            if len(self.chat_buckets) >= OUTBOUND_MAX_CHAT_BUCKETS:
+                self._prune_chat_buckets()
+            bucket = self.chat_buckets[chat_key] = TokenBucket(self.chat_rate, self.chat_burst, clock=self.clock)
+        return bucket
+
+    def _prune_chat_buckets(self):
+        for chat_key, bucket in list(self.chat_buckets.items()):
+            if bucket.is_full():
+                del self.chat_buckets[chat_key]
+
+
+    async def _worker(self):
+        while True:
+            await self.bucket.acquire()
+            item = await self.queue.get()
+            priority, _, chat_key, call, future, queued_at, reserved = item
+            self.depth[priority] -= 1
+            if future.done():
+                self.bucket.refund()
+                continue
+            if chat_key is not None and not reserved:
+                delay = self._chat_bucket(chat_key).reserve()
+                if delay > 0:
+                    # Still counted as queued while it waits for its chat's slot.
+                    self.depth[priority] += 1
+                    self.bucket.refund()
+                    asyncio.get_running_loop().call_later(delay, self.queue.put_nowait, item[:-1] + (True,))
+                    continue
+            name = PRIORITY_NAMES[priority]
+            stats = self.stats[name]
+            waited = self.clock() - queued_at
+            stats['wait_total'] += waited
+            stats['wait_max'] = max(stats['wait_max'], waited)
+            OUTBOUND_WAIT_SECONDS.observe(waited, priority=name)
+            await self._execute(call, future, name)
+
+    async def _execute(self, call, future, name):
+        stats = self.stats[name]
+        for attempt in range(OUTBOUND_MAX_ATTEMPTS):
+            try:
+                result = await call()
+            except FloodWaitError as e:
+                self.flood_waits += 1
+                BOT_FLOOD_WAIT_SECONDS.inc(e.seconds)
+                logging.warning(f"Bot hit a flood wait of {e.seconds}s; pausing outbound messages.")
+                self.bucket.pause(e.seconds)
+                if attempt == OUTBOUND_MAX_ATTEMPTS - 1:
+                    error = e
+                    break
+                await self.bucket.acquire()
+                continue
+            except Exception as e:
+                error = e
+                break
+            stats['sent'] += 1
+            BOT_MESSAGES.inc(priority=name, result='sent')
+            if not future.done():
+                future.set_result(result)
+            return
+        stats['failed'] += 1
+        BOT_MESSAGES.inc(priority=name, result='failed')
+        if not future.done():
+            future.set_exception(error)
+
+    def get_stats(self):
+        stats = {}
+        for priority, name in enumerate(PRIORITY_NAMES):
+            entry = dict(self.stats[name])
+            finished = entry['sent'] + entry['failed']
+            entry['depth'] = self.depth[priority]
+            entry['wait_avg'] = entry['wait_total'] / finished if finished else 0.0
+            stats[name] = entry
+        stats['flood_waits'] = self.flood_waits
+        return stats
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+class OutboundClient(TelegramClient):
+    """TelegramClient whose message sends and edits go through an OutboundDispatcher.
+
+    Everything else (callback answers, lookups, downloads) is sent directly.
+    """
+
+    def __init__(self, *args, outbound=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.outbound = outbound or OutboundDispatcher()
+
+    async def __call__(self, request, ordered=False, flood_sleep_threshold=None):
+        if not isinstance(request, OUTBOUND_REQUESTS):
+            return await super().__call__(request, ordered=ordered, flood_sleep_threshold=flood_sleep_threshold)
+        # Flood waits are raised instead of slept on so the dispatcher can pause every sender at once.
+        return await self.outbound.submit(
+            outbound_priority.get(), _chat_key(request),
+            lambda: self._call(self._sender, request, ordered=ordered, flood_sleep_threshold=0)
+        )
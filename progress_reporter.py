@@ -0,0 +1,103 @@
+# progress_reporter.py
+import logging
+import time
+
+# Per-user report verbosity, stored as 'report_mode' in the user record.
+REPORT_MODES = {
+    'summary': "Summary",    # one status message per cycle, edited as it runs
+    'errors': "Errors only", # a message only when a cycle had failures or waits
+    'verbose': "Verbose",    # one message per group (the old behaviour)
+}
+DEFAULT_REPORT_MODE = 'summary'
+PROGRESS_EDIT_INTERVAL = 10  # Minimum seconds between edits of the status message
+MAX_LISTED_FAILURES = 15
+
+class ProgressReporter:
+    """Turns per-group forwarding results into a bounded number of bot messages per cycle."""
+
+    def __init__(self, bot, user_id, edit_interval=PROGRESS_EDIT_INTERVAL, clock=time.monotonic):
+        self.bot = bot
+        self.user_id = user_id
+        self.edit_interval = edit_interval
+        self.clock = clock
+        self.mode = DEFAULT_REPORT_MODE
+        self.cycle = 0
+        self.messages_sent = 0
+
+    async def _send(self, text):
+        try:
+            self.messages_sent += 1
+            return await self.bot.send_message(self.user_id, text, parse_mode='md')
+        except Exception as e:
+            logging.warning(f"User {self.user_id}: Could not send progress message: {e}")
+
+    async def _edit(self, text):
+        try:
+            self.messages_sent += 1
+            await self.status_message.edit(text, parse_mode='md')
+            self.last_edit = self.clock()
+        except Exception as e:
+            logging.warning(f"User {self.user_id}: Could not update progress message: {e}")
+
+    def _status_text(self, finished=False):
+        done = self.sent_count + len(self.failures)
+        header = "✅ **Cycle {} complete**" if finished else "📊 **Cycle {} in progress**"
+        text = (
+            f"{header.format(self.cycle)} — {done}/{self.total} groups\n"
+            f"✅ Sent: `{self.sent_count}`  ❌ Failed: `{len(self.failures)}`  ⏳ Waits: `{self.waits}`"
+        )
+        if self.skipped:
+            text += f"\n🚫 Skipped `{self.skipped}` excluded or paused groups (see 🚫 Excluded Groups)"
+        if finished and self.failures:
+            lines = [f"• {title} — {reason}" for title, reason in self.failures[:MAX_LISTED_FAILURES]]
+            if len(self.failures) > MAX_LISTED_FAILURES:
+                lines.append(f"…and {len(self.failures) - MAX_LISTED_FAILURES} more")
+            text += "\n\n**Failed groups:**\n" + "\n".join(lines)
+        return text
+
+    async def _progress(self):
+        if self.mode == 'summary' and self.status_message is not None and self.clock() - self.last_edit >= self.edit_interval:
+            await self._edit(self._status_text())
+
+    async def start_cycle(self, total, mode=DEFAULT_REPORT_MODE, skipped=0):
+        self.mode = mode if mode in REPORT_MODES else DEFAULT_REPORT_MODE
+        self.cycle += 1
+        self.total = total
+        self.skipped = skipped
+        self.sent_count = 0
+        self.waits = 0
+        self.failures = []
+        self.status_message = None
+        self.last_edit = self.clock()
+        if self.mode == 'summary':
+            self.status_message = await self._send(self._status_text())
+
+    async def sent(self, title):
+        self.sent_count += 1
+        if self.mode == 'verbose':
+            await self._send(f"✅ Message sent to: **{title}**")
+        await self._progress()
+
+    async def failed(self, title, reason):
+        self.failures.append((title, reason))
+        if self.mode == 'verbose':
+            await self._send(f"❌ Failed to send to: **{title}**\n*Reason: {reason}*")
+        await self._progress()
+
+    async def waiting(self, title, seconds):
+        self.waits += 1
+        if self.mode == 'verbose':
+            await self._send(f"⏳ Waiting for {seconds}s in **{title}** (Slow Mode/Flood Wait).")
+        await self._progress()
+
+    async def finish_cycle(self):
+        if self.mode == 'summary':
+            if self.status_message is not None:
+                await self._edit(self._status_text(finished=True))
+            else:
+                await self._send(self._status_text(finished=True))
+        elif self.mode == 'errors':
+            if self.failures or self.waits:
+                await self._send(self._status_text(finished=True))
+        else:
+            await self._send("Cycle complete. Waiting before starting the next round.")
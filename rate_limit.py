@@ -0,0 +1,58 @@
+# rate_limit.py
+import asyncio
+import time
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, bursts up to `capacity`.
+
+    pause() empties the bucket and blocks every acquirer for the given time,
+    which is how a FloodWaitError from Telegram is honoured.
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = self.clock()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def reserve(self):
+        """Takes a token without waiting and returns the seconds until it may be used (0 if now)."""
+        now = self.clock()
+        if now > self.updated:
+            self._refill(now)
+        self.tokens -= 1
+        return max(self.updated, now) + max(0.0, -self.tokens) / self.rate - now
+
+    def refund(self):
+        """Returns an acquired token that ended up unused."""
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def is_full(self):
+        now = self.clock()
+        return now >= self.updated and self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+    def pause(self, seconds):
+        now = self.clock()
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0
+        self.updated = max(self.updated, self.paused_until)
@@ -0,0 +1,69 @@
+# saved_messages.py
+import asyncio
+import logging
+
+from telethon import events
+
+class SavedMessageTracker:
+    """
+    Keeps the latest message of an account's Saved Messages in memory.
+
+    The message is fetched once by start(); after that it follows the
+    account's own new/edit/delete events, so the forwarding loop can read
+    `message` every cycle without an RPC. `changed` is set whenever the
+    tracked message is replaced or cleared.
+    """
+
+    def __init__(self, client, user_id):
+        self.client = client
+        self.user_id = user_id
+        self.message = None
+        self.changed = asyncio.Event()
+        self._self_id = None
+        self._handlers = []
+
+    def _is_saved_message(self, event):
+        return event.is_private and event.chat_id == self._self_id
+
+    async def start(self):
+        me = await self.client.get_me(input_peer=True)
+        self._self_id = me.user_id
+        latest = await self.client.get_messages('me', limit=1)
+        self._set(latest[0] if latest else None)
+        self._handlers = [
+            (self._on_new, events.NewMessage(func=self._is_saved_message)),
+            (self._on_edit, events.MessageEdited(func=self._is_saved_message)),
+            # Deletions in private chats carry no chat id, so every deletion is checked against the tracked id.
+            (self._on_delete, events.MessageDeleted()),
+        ]
+        for handler, builder in self._handlers:
+            self.client.add_event_handler(handler, builder)
+
+    def stop(self):
+        for handler, builder in self._handlers:
+            self.client.remove_event_handler(handler, builder)
+        self._handlers = []
+
+    def _set(self, message):
+        self.message = message
+        self.changed.set()
+
+    async def _on_new(self, event):
+        self._set(event.message)
+
+    async def _on_edit(self, event):
+        if self.message is not None and event.message.id == self.message.id:
+            self._set(event.message)
+
+    async def reload(self):
+        """Re-reads the latest message, e.g. when the tracked one turned out to be gone."""
+        latest = await self.client.get_messages('me', limit=1)
+        self._set(latest[0] if latest else None)
+
+    async def _on_delete(self, event):
+        if event.chat_id is not None or self.message is None or self.message.id not in event.deleted_ids:
+            return
+        try:
+            await self.reload()
+        except Exception as e:
+            logging.error(f"User {self.user_id}: Could not reload Saved Messages after a deletion: {e}")
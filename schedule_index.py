@@ -0,0 +1,94 @@
+# schedule_index.py
+import asyncio
+import heapq
+from datetime import datetime, time, timedelta, timezone
+
+def is_time_to_run(start_time, stop_time, now_time):
+    """True if `now_time` falls inside the daily [start, stop) window (which may wrap midnight)."""
+    if start_time <= stop_time:
+        return start_time <= now_time < stop_time
+    return now_time >= start_time or now_time < stop_time
+
+def next_occurrence(at, now):
+    """The first UTC datetime strictly after `now` whose time of day is `at`."""
+    candidate = now.replace(hour=at.hour, minute=at.minute, second=0, microsecond=0)
+    if candidate <= now:
+        candidate += timedelta(days=1)
+    return candidate
+
+class ScheduleIndex:
+    """Min-heap of the next start/stop transition for every scheduled user.
+
+    Only users that are premium, have AdBot on and have both times set are
+    indexed. Changing a schedule pushes a new heap entry and bumps the user's
+    version; older entries for that user are skipped when popped. `changed`
+    is set whenever the earliest transition may have moved, so the master
+    loop can re-plan its sleep.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._schedules = {}
+        self._versions = {}
+        self.changed = asyncio.Event()
+
+    def __len__(self):
+        return len(self._schedules)
+
+    def update(self, user_id, user_data, now=None):
+        """Re-indexes one user from their record; the user is reconciled immediately."""
+        version = self._versions.get(user_id, 0) + 1
+        self._versions[user_id] = version
+        start_str, stop_str = user_data.get('start_time'), user_data.get('stop_time')
+        if not (user_data.get('adbot_status') and user_data.get('is_premium') and start_str and stop_str):
+            self._schedules.pop(user_id, None)
+            return
+        try:
+            self._schedules[user_id] = (time.fromisoformat(start_str), time.fromisoformat(stop_str))
+        except ValueError:
+            self._schedules.pop(user_id, None)
+            return
+        now = now or datetime.now(timezone.utc)
+        heapq.heappush(self._heap, (now, version, user_id))
+        self.changed.set()
+
+    def retry(self, user_id, at):
+        """Reconciles a scheduled user again at `at`, e.g. after a start that could not connect."""
+        if user_id not in self._schedules:
+            return
+        version = self._versions.get(user_id, 0) + 1
+        self._versions[user_id] = version
+        heapq.heappush(self._heap, (at, version, user_id))
+        self.changed.set()
+
+    def load(self, all_data, now=None):
+        """Indexes every user in a {user_id_str: record} mapping."""
+        now = now or datetime.now(timezone.utc)
+        for user_id_str, user_data in all_data.items():
+            self.update(int(user_id_str), user_data, now)
+
+    def _drop_stale(self):
+        while self._heap:
+            _, version, user_id = self._heap[0]
+            if user_id in self._schedules and self._versions.get(user_id) == version:
+                return
+            heapq.heappop(self._heap)
+
+    def next_due(self):
+        """Datetime of the earliest pending transition, or None if nothing is scheduled."""
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now=None):
+        """Returns [(user_id, should_run)] for every transition due at `now` and re-arms each user."""
+        now = now or datetime.now(timezone.utc)
+        due = []
+        while True:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                return due
+            _, version, user_id = heapq.heappop(self._heap)
+            start_time, stop_time = self._schedules[user_id]
+            due.append((user_id, is_time_to_run(start_time, stop_time, now.time())))
+            next_at = min(next_occurrence(start_time, now), next_occurrence(stop_time, now))
+            heapq.heappush(self._heap, (next_at, version, user_id))
@@ -0,0 +1,51 @@
+# state_index.py
+import time
+
+STATE_TTL = 15 * 60  # Seconds a conversation state survives without being refreshed
+
+class StateIndex:
+    """In-memory user_id -> conversation state map with TTL expiry.
+
+    The NewMessage filter consults this on every incoming message, so lookups
+    never touch storage. Entries expire STATE_TTL seconds after they were set,
+    which drops users who walked away from a flow half-way through.
+    """
+
+    def __init__(self, ttl=STATE_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self._states = {}
+
+    def load(self, states):
+        """Seeds the index from persisted {user_id: state} pairs."""
+        expires_at = self.clock() + self.ttl
+        self._states = {int(user_id): (state, expires_at) for user_id, state in states.items() if state is not None}
+
+    def get(self, user_id):
+        """Returns the user's live state, or None if unset or expired."""
+        entry = self._states.get(user_id)
+        if entry is None:
+            return None
+        state, expires_at = entry
+        if self.clock() >= expires_at:
+            return None
+        return state
+
+    def set(self, user_id, state):
+        """Stores a new state. Returns True if it differs from the persisted one."""
+        previous = self._states.pop(user_id, None)
+        if state is not None:
+            self._states[user_id] = (state, self.clock() + self.ttl)
+        old_state = previous[0] if previous else None
+        return old_state != state
+
+    def pop_expired(self):
+        """Removes expired entries and returns their user ids."""
+        now = self.clock()
+        expired = [user_id for user_id, (_, expires_at) in self._states.items() if now >= expires_at]
+        for user_id in expired:
+            del self._states[user_id]
+        return expired
+
+    def __len__(self):
+        return len(self._states)
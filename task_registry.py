@@ -0,0 +1,105 @@
+# task_registry.py
+import asyncio
+import logging
+from functools import partial
+
+SCHEDULER_STOP_TIMEOUT = 10  # Seconds a stopped forwarding task may take to exit before it is cancelled
+TASK_NAME_PREFIX = 'scheduler-'
+
+class SchedulerRegistry:
+    """
+    Owns the forwarding task of every running MessageScheduler, one per user.
+
+    stop() signals the scheduler and returns at once; the task is drained in
+    the background and cancelled if it hasn't exited after
+    SCHEDULER_STOP_TIMEOUT seconds. start() waits for a previous task of the
+    same user to be gone first, so two loops never forward from one account.
+    `on_exit` runs when the task has really finished, however it ended.
+    """
+
+    def __init__(self, stop_timeout=SCHEDULER_STOP_TIMEOUT):
+        self.stop_timeout = stop_timeout
+        self.running = {}    # user_id -> (scheduler, task)
+        self.stopping = {}   # user_id -> drain task of a stopped scheduler
+        self._draining = set()
+        self.stats = {'started': 0, 'stopped': 0, 'finished': 0, 'crashed': 0, 'forced': 0}
+
+    def __contains__(self, user_id):
+        return user_id in self.running
+
+    def __len__(self):
+        return len(self.running)
+
+    def get(self, user_id):
+        entry = self.running.get(user_id)
+        return entry[0] if entry else None
+
+    async def start(self, user_id, scheduler, on_exit=None):
+        """Starts `scheduler`'s loop. Returns False if the user already has a running one."""
+        drain = self.stopping.get(user_id)
+        if drain is not None:
+            await asyncio.wait([drain])
+        if user_id in self.running:
+            return False
+        task = asyncio.create_task(scheduler.start_forwarding(), name=f"{TASK_NAME_PREFIX}{user_id}")
+        self.running[user_id] = (scheduler, task)
+        task.add_done_callback(partial(self._on_done, user_id, on_exit))
+        self.stats['started'] += 1
+        return True
+
+    async def stop(self, user_id):
+        """Signals the user's scheduler to stop. Returns False if none was running."""
+        entry = self.running.pop(user_id, None)
+        if entry is None:
+            return False
+        scheduler, task = entry
+        await scheduler.stop_forwarding()
+        self.stats['stopped'] += 1
+        if not task.done():
+            self._draining.add(task)
+            self.stopping[user_id] = asyncio.create_task(self._drain(user_id, task))
+        return True
+
+    async def _drain(self, user_id, task):
+        try:
+            done, _ = await asyncio.wait([task], timeout=self.stop_timeout)
+            if not done:
+                logging.warning(f"User {user_id}: Forwarding task ignored the stop signal for {self.stop_timeout}s; cancelling it.")
+                self.stats['forced'] += 1
+                task.cancel()
+                await asyncio.wait([task], timeout=self.stop_timeout)
+        finally:
+            self._draining.discard(task)
+            if self.stopping.get(user_id) is asyncio.current_task():
+                del self.stopping[user_id]
+
+    def _on_done(self, user_id, on_exit, task):
+        entry = self.running.get(user_id)
+        if entry is not None and entry[1] is task:
+            # The loop ended on its own (no groups, unreadable Saved Messages, ...).
+            del self.running[user_id]
+        if not task.cancelled() and task.exception() is not None:
+            self.stats['crashed'] += 1
+            logging.error(f"User {user_id}: Forwarding task crashed: {task.exception()!r}")
+        else:
+            self.stats['finished'] += 1
+        if on_exit is not None:
+            on_exit()
+
+    async def shutdown(self):
+        """Stops every scheduler and waits until all their tasks have exited."""
+        for user_id in list(self.running):
+            await self.stop(user_id)
+        if self.stopping:
+            await asyncio.wait(list(self.stopping.values()))
+
+    def get_stats(self):
+        """Counts live, draining and zombie tasks; a zombie is a scheduler task the registry no longer accounts for."""
+        owned = {task for _, task in self.running.values()}
+        alive = [task for task in asyncio.all_tasks()
+                 if task.get_name().startswith(TASK_NAME_PREFIX) and not task.done()]
+        stats = dict(self.stats)
+        stats['live'] = sum(1 for task in alive if task in owned)
+        stats['draining'] = sum(1 for task in alive if task in self._draining)
+        stats['zombies'] = sum(1 for task in alive if task not in owned and task not in self._draining)
+        return stats
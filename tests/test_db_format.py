@@ -0,0 +1,40 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import db_format
+from database import FORMATS, UserRecord
+
+def write(path, fmt, data):
+    db_format.write_database(str(path), data, fmt)
+
+def convert(src, dst, to, force=False):
+    db_format.cmd_convert(SimpleNamespace(src=str(src), dst=str(dst), to=to, force=force))
+
+@pytest.mark.parametrize('to', list(FORMATS) + ['sqlite'])
+def test_convert_round_trip(tmp_path, to):
+    write(tmp_path / 'src.json', 'json', {'1': UserRecord(username='a', accounts={'main': 's'})})
+    convert(tmp_path / 'src.json', tmp_path / 'dst', to)
+    _, data = db_format.read_database(str(tmp_path / 'dst'))
+    assert data['1']['username'] == 'a' and data['1']['accounts'] == {'main': 's'}
+    assert not os.path.exists(tmp_path / 'dst.tmp')
+
+@pytest.mark.parametrize('to', ['records', 'sqlite'])
+def test_convert_refuses_same_file(tmp_path, to):
+    src = tmp_path / 'database.db'
+    write(src, 'sqlite', {'1': UserRecord(username='a')})
+    os.symlink(src, tmp_path / 'link.db')
+    for dst in (src, tmp_path / 'link.db'):
+        with pytest.raises(SystemExit):
+            convert(src, dst, to, force=True)
+    assert db_format.read_database(str(src))[1]['1']['username'] == 'a'
+
+def test_convert_keeps_destination_when_verification_fails(tmp_path, monkeypatch):
+    write(tmp_path / 'src.json', 'json', {'1': UserRecord(username='new')})
+    write(tmp_path / 'dst.db', 'sqlite', {'1': UserRecord(username='old')})
+    monkeypatch.setattr(db_format, 'first_difference', lambda expected, actual: 'forced mismatch')
+    with pytest.raises(SystemExit):
+        convert(tmp_path / 'src.json', tmp_path / 'dst.db', 'sqlite', force=True)
+    assert db_format.read_database(str(tmp_path / 'dst.db'))[1]['1']['username'] == 'old'
+    assert not os.path.exists(tmp_path / 'dst.db.tmp')
@@ -0,0 +1,249 @@
+import asyncio
+from functools import partial
+
+import pytest
+from telethon.errors.rpcerrorlist import ChannelInvalidError, ChatWriteForbiddenError
+from telethon.tl.types import Chat, ChatPhotoEmpty
+
+import destination_health
+import group_cache
+import message_scheduler
+from destination_health import DestinationHealth
+from group_cache import CachedGroup, GroupCache
+
+NOW = 1_700_000_000
+GROUPS = [CachedGroup(peer_id, f"Group {peer_id}", 'chat') for peer_id in range(1, 5)]
+
+@pytest.fixture
+def health(tmp_path):
+    return DestinationHealth(str(tmp_path / 'groups.db'), backoff_base=100, backoff_max=1000)
+
+def run(coro):
+    return asyncio.run(coro)
+
+def filtered(health, now=NOW, acc_name='main'):
+    return [group.id for group in run(health.filter(1, acc_name, GROUPS, now=now))]
+
+def test_permanent_error_excludes_for_good(health):
+    filtered(health)
+    entry = health.record_failure(1, 'main', GROUPS[0], ChatWriteForbiddenError(None), now=NOW)
+    assert entry.excluded
+    assert filtered(health, now=NOW + 10 ** 9) == [2, 3, 4]
+    assert health.next_retry(1, 'main', GROUPS[:1]) is None
+
+def test_other_errors_back_off(health):
+    filtered(health)
+    entry = health.record_failure(1, 'main', GROUPS[0], ChannelInvalidError(None), now=NOW)
+    assert not entry.excluded and entry.retry_at == NOW + 100
+    assert filtered(health, now=NOW + 99) == [2, 3, 4]
+    assert filtered(health, now=NOW + 100) == [1, 2, 3, 4]
+
+def test_unconfirmed_permanent_error_only_backs_off(health):
+    filtered(health)
+    entry = health.record_failure(1, 'main', GROUPS[0], ChatWriteForbiddenError(None), now=NOW, confirmed=False)
+    assert entry.retry_at == NOW + 100
+
+def test_backoff_doubles_up_to_the_maximum(health):
+    filtered(health)
+    retries = [health.record_failure(1, 'main', GROUPS[0], ChannelInvalidError(None), now=NOW).retry_at - NOW
+               for _ in range(6)]
+    assert retries == [100, 200, 400, 800, 1000, 1000]
+    assert health.next_retry(1, 'main', GROUPS) == NOW + 1000
+
+def test_success_clears_the_group(health):
+    filtered(health)
+    health.record_failure(1, 'main', GROUPS[0], ChannelInvalidError(None), now=NOW)
+    health.record_success(1, 'main', GROUPS[0].id)
+    assert filtered(health) == [1, 2, 3, 4]
+    assert run(health.entries(1)) == []
+
+def test_entries_survive_a_restart(health, tmp_path):
+    filtered(health)
+    health.record_failure(1, 'main', GROUPS[0], ChatWriteForbiddenError(None), now=NOW)
+    health.record_failure(1, 'main', GROUPS[1], ChannelInvalidError(None), now=NOW)
+    reopened = DestinationHealth(str(tmp_path / 'groups.db'))
+    health._executor.shutdown(wait=True)
+    entries = {entry.peer_id: entry for _, entry in run(reopened.entries(1))}
+    assert entries.keys() == {1, 2}
+    assert entries[1].excluded and entries[2].retry_at == NOW + 100
+
+@pytest.mark.parametrize('kwargs, left', [
+    ({}, set()),
+    ({'acc_name': 'main'}, {('other', 1)}),
+    ({'peer_id': 1}, {('main', 2)}),
+    ({'acc_name': 'other', 'peer_id': 1}, {('main', 1), ('main', 2)}),
+])
+def test_reset(health, kwargs, left):
+    filtered(health)
+    filtered(health, acc_name='other')
+    for acc_name, group in (('main', GROUPS[0]), ('main', GROUPS[1]), ('other', GROUPS[0])):
+        health.record_failure(1, acc_name, group, ChatWriteForbiddenError(None), now=NOW)
+    assert run(health.reset(1, **kwargs)) == 3 - len(left)
+    assert {(acc_name, entry.peer_id) for acc_name, entry in run(health.entries(1))} == left
+
+# --- The forwarding loop's use of DestinationHealth ---
+
+class FakeMessage:
+    def __init__(self, id):
+        self.id = id
+
+    async def edit(self, *args, **kwargs):
+        return self
+
+class FakeBot:
+    def __init__(self):
+        self.messages = []
+
+    async def send_message(self, user_id, text, **kwargs):
+        self.messages.append(text)
+        return FakeMessage(len(self.messages))
+
+class FakeMe:
+    user_id = 1
+
+class FakeClient:
+    def __init__(self, fail):
+        self.fail = fail  # peer_id -> exception to raise
+        self.calls = []
+
+    async def get_me(self, input_peer=False):
+        return FakeMe()
+
+    async def get_messages(self, entity, limit=None):
+        return [FakeMessage(1)]
+
+    def add_event_handler(self, *args):
+        pass
+
+    def remove_event_handler(self, *args):
+        pass
+
+    async def forward_messages(self, entity, messages):
+        self.calls.append(entity.chat_id)
+        if entity.chat_id in self.fail:
+            raise self.fail[entity.chat_id]
+
+class FakeDb:
+    def __init__(self):
+        self.user = {'adbot_status': True, 'report_mode': 'summary'}
+
+    async def get_user(self, user_id):
+        return self.user
+
+    async def update(self, user_id, key, value):
+        self.user[key] = value
+
+@pytest.fixture
+def scheduler_env(tmp_path, monkeypatch, health):
+    monkeypatch.setattr(group_cache, '_group_cache', GroupCache(str(tmp_path / 'groups.db')))
+    monkeypatch.setattr(destination_health, '_destination_health', health)
+    monkeypatch.setattr(message_scheduler, 'db', FakeDb())
+    return health
+
+def run_scheduler(groups, fail, cycles=1, sleep=None):
+    """Runs the forwarding loop over `groups` for up to `cycles` cycles; returns (scheduler, client, bot)."""
+    group_cache.get_group_cache().replace(1, 'main', groups)
+    client, bot = FakeClient(fail), FakeBot()
+    scheduler = message_scheduler.MessageScheduler(1, client, 0, bot, 'main')
+    finished = []
+
+    async def finish_cycle():
+        finished.append(1)
+        if len(finished) >= cycles: scheduler.stop_event.set()
+
+    scheduler.reporter.finish_cycle = finish_cycle
+    if sleep is not None:
+        scheduler.sleep = sleep(scheduler)
+    run(asyncio.wait_for(scheduler.start_forwarding(), 10))
+    return scheduler, client, bot
+
+def many_groups(count):
+    return [CachedGroup(peer_id, f"Group {peer_id}", 'chat') for peer_id in range(1, count + 1)]
+
+def test_streak_backs_the_groups_off_instead_of_dropping_them(scheduler_env):
+    groups = many_groups(40)
+    limit = min(message_scheduler.ACCOUNT_FAILURE_SAMPLE, max(message_scheduler.ACCOUNT_FAILURE_MIN, len(groups) // 2))
+    _, client, bot = run_scheduler(groups, {g.id: ChatWriteForbiddenError(None) for g in groups[:limit]})
+    assert client.calls == [g.id for g in groups[:limit]]
+    assert message_scheduler.db.user['adbot_status'] is False
+    assert "could not post" in bot.messages[-1]
+    entries = [entry for _, entry in run(scheduler_env.entries(1))]
+    assert sorted(entry.peer_id for entry in entries) == client.calls
+    assert not any(entry.excluded for entry in entries)
+    # Turned on again, the scheduler moves on past the groups that failed.
+    message_scheduler.db.user['adbot_status'] = True
+    _, client, _ = run_scheduler(groups, {})
+    assert client.calls == [g.id for g in groups[limit:]]
+
+def test_streak_limit_scales_with_the_group_count(scheduler_env):
+    groups = many_groups(12)
+    # Six failures (half of 12) in a row stop the task; five don't.
+    _, client, _ = run_scheduler(groups, {g.id: ChatWriteForbiddenError(None) for g in groups[:5]})
+    assert message_scheduler.db.user['adbot_status'] is True
+    assert len(client.calls) == 12
+    # A success later in the cycle makes the earlier failures real exclusions.
+    assert all(entry.excluded for _, entry in run(scheduler_env.entries(1)))
+
+def test_small_account_with_every_group_failing_is_backed_off(scheduler_env):
+    groups = many_groups(3)
+    run_scheduler(groups, {g.id: ChatWriteForbiddenError(None) for g in groups})
+    entries = [entry for _, entry in run(scheduler_env.entries(1))]
+    assert len(entries) == 3 and not any(entry.excluded for entry in entries)
+
+def test_every_group_excluded_stops_the_scheduler(scheduler_env):
+    groups = many_groups(3)
+    filtered(scheduler_env)
+    for group in groups:
+        scheduler_env.record_failure(1, 'main', group, ChatWriteForbiddenError(None))
+    _, client, bot = run_scheduler(groups, {})
+    assert client.calls == []
+    assert message_scheduler.db.user['adbot_status'] is False
+    assert bot.messages == ["⚠️ All of your 3 groups are excluded, so the bot has stopped.\n\n"
+                            "Open 'Excluded Groups' to reset the ones that have been fixed, then turn AdBot on again."]
+
+def test_every_group_backed_off_sleeps_without_status_messages(scheduler_env):
+    groups = many_groups(3)
+    filtered(scheduler_env)
+    for group in groups:
+        scheduler_env.record_failure(1, 'main', group, ChannelInvalidError(None))
+    waits = []
+
+    def sleep(scheduler):
+        async def fake_sleep(seconds):
+            waits.append(seconds)
+            scheduler.stop_event.set()
+        return fake_sleep
+
+    _, client, bot = run_scheduler(groups, {}, sleep=sleep)
+    assert client.calls == [] and bot.messages == []
+    assert len(waits) == 1 and 90 < waits[0] <= 100
+    assert message_scheduler.db.user['adbot_status'] is True
+
+class WatchedClient:
+    def __init__(self):
+        self.handlers = []
+
+    def add_event_handler(self, callback, event=None):
+        self.handlers.append(callback)
+
+class GroupMessage:
+    def __init__(self, chat):
+        self.chat_id = -chat.id
+        self.chat = chat
+
+    async def get_chat(self):
+        return self.chat
+
+def test_rejoined_group_is_cleared(tmp_path, health):
+    cache = GroupCache(str(tmp_path / 'groups.db'))
+    cache.replace(1, 'main', GROUPS[1:])
+    filtered(health)
+    health.record_failure(1, 'main', GROUPS[0], ChatWriteForbiddenError(None), now=NOW)
+    health.record_failure(1, 'main', GROUPS[1], ChatWriteForbiddenError(None), now=NOW)
+    client = WatchedClient()
+    cache.watch(client, 1, 'main', on_join=partial(health.reset, 1, 'main'))
+    on_chat_action, on_group_message = client.handlers
+    chat = Chat(id=GROUPS[0].id, title=GROUPS[0].title, photo=ChatPhotoEmpty(), participants_count=2, date=None, version=1)
+    run(on_group_message(GroupMessage(chat)))
+    assert cache.contains(1, 'main', GROUPS[0].id)
+    assert [entry.peer_id for _, entry in run(health.entries(1))] == [GROUPS[1].id]
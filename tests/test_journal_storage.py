@@ -0,0 +1,64 @@
+import json
+from types import SimpleNamespace
+
+import database
+
+from database import JournalStorage, UserRecord
+
+def make_storage(tmp_path, **kwargs):
+    return JournalStorage(str(tmp_path / 'database.json'), str(tmp_path / 'database.journal'), **kwargs)
+
+def journal_line(user_id_str, **fields):
+    return json.dumps({'u': user_id_str, 'r': UserRecord(**fields).to_dict()}) + '\n'
+
+def test_replay_applies_records_in_order(tmp_path):
+    (tmp_path / 'database.journal').write_text(
+        journal_line('1', username='a') + journal_line('2', username='b') + journal_line('1', username='c')
+    )
+    storage = make_storage(tmp_path)
+    assert storage.journal_records == 3
+    assert storage.get('1')['username'] == 'c'
+    assert storage.get('2')['username'] == 'b'
+
+def test_replay_drops_truncated_last_record(tmp_path):
+    journal = tmp_path / 'database.journal'
+    good = journal_line('1', username='a')
+    torn = journal_line('2', username='b')[:-8]
+    journal.write_text(good + torn)
+    storage = make_storage(tmp_path)
+    assert storage.journal_records == 1
+    assert storage.get('2') is None
+    # The torn tail is cut off so the next append starts on a fresh line.
+    assert journal.read_text() == good
+    storage.put('3', UserRecord(username='c'))
+    assert make_storage(tmp_path).get('3')['username'] == 'c'
+
+def test_replay_drops_unterminated_last_record(tmp_path):
+    # A complete JSON object without its newline is still a torn append.
+    good = journal_line('1', username='a')
+    (tmp_path / 'database.journal').write_text(good + journal_line('2', username='b').rstrip('\n'))
+    storage = make_storage(tmp_path)
+    assert storage.journal_records == 1
+    assert storage.get('2') is None
+
+def test_compaction_threshold_scales_with_live_records(tmp_path, monkeypatch):
+    compactions = []
+    monkeypatch.setattr(database, 'Thread', lambda target, daemon: SimpleNamespace(start=lambda: compactions.append(1)))
+    storage = make_storage(tmp_path, compact_records=10, compact_ratio=2)
+    storage.put_many({str(i): UserRecord() for i in range(20)})
+    # 20 live records: the journal may hold 40 entries before a snapshot is taken.
+    for _ in range(19):
+        storage.put('0', UserRecord(username='x'))
+    assert storage.journal_records == 39 and not compactions
+    storage.put('0', UserRecord(username='y'))
+    assert compactions == [1]
+
+def test_compact_writes_snapshot_and_truncates_journal(tmp_path):
+    storage = make_storage(tmp_path)
+    storage.put_many({'1': UserRecord(username='a'), '2': UserRecord(username='b')})
+    storage.compact()
+    assert storage.journal_records == 0
+    assert (tmp_path / 'database.journal').read_text() == ''
+    reloaded = make_storage(tmp_path)
+    assert reloaded.journal_records == 0
+    assert reloaded.get('2')['username'] == 'b'
@@ -0,0 +1,85 @@
+import pytest
+
+from database import FORMATS, USER_FIELDS, RecordFileFormat, UserRecord, detect_format, plain_records
+
+# A non-default value of every field, covering each type USER_FIELDS holds.
+SAMPLE_FIELDS = {
+    'username': 'ünïcode_user',
+    'is_banned': True,
+    'adbot_status': True,
+    'forward_delay': 45,
+    'saved_message': 'Buy now! 🚀\n"quoted" \\ backslash',
+    'state': 'waiting_for_otp',
+    'has_agreed': True,
+    'is_premium': True,
+    'start_time': '08:30',
+    'stop_time': '23:15',
+    'report_mode': 'detailed',
+    'bot_blocked': True,
+}
+
+def sample_data():
+    full = UserRecord(**SAMPLE_FIELDS, accounts={'main': '1Aa==', 'second': '2Bb=='}, logs=[{'event': 'legacy'}])
+    return {'1001': full, '1002': UserRecord(), '1003': UserRecord(username=None, accounts={})}
+
+def test_sample_covers_every_field():
+    assert SAMPLE_FIELDS.keys() == USER_FIELDS.keys()
+    assert all(SAMPLE_FIELDS[name] != default for name, default in USER_FIELDS.items())
+
+@pytest.mark.parametrize('name', FORMATS)
+def test_round_trip_every_field(name):
+    fmt = FORMATS[name]
+    data = sample_data()
+    payload = fmt.dumps(data)
+    assert detect_format(payload).loads(payload).keys() == data.keys()
+    assert plain_records(fmt.loads(payload)) == plain_records(data)
+
+@pytest.mark.parametrize('name', FORMATS)
+def test_round_trip_keeps_field_types(name):
+    fmt = FORMATS[name]
+    record = fmt.loads(fmt.dumps(sample_data()))['1001']
+    for field, value in SAMPLE_FIELDS.items():
+        assert type(record[field]) is type(value), field
+
+def test_records_keep_untouched_accounts_encoded():
+    fmt = FORMATS['records']
+    loaded = fmt.loads(fmt.dumps(sample_data()))
+    assert loaded['1001']._accounts_raw is not None
+    assert fmt.dumps(loaded) == fmt.dumps(sample_data())
+
+def test_records_truncated_last_record():
+    payload = FORMATS['records'].dumps(sample_data())
+    for cut in (1, 5, RecordFileFormat.HEADER.size + 1):
+        with pytest.raises(ValueError):
+            FORMATS['records'].loads(payload[:-cut])
+
+def test_records_truncated_header():
+    payload = FORMATS['records'].dumps({'1': UserRecord()})
+    with pytest.raises(ValueError):
+        FORMATS['records'].loads(payload + b'\x01\x00')
+
+def record_offsets(payload):
+    """Offsets of every record header in a records payload."""
+    offsets, offset = [], len(RecordFileFormat.MAGIC)
+    while offset < len(payload):
+        offsets.append(offset)
+        offset += RecordFileFormat.HEADER.size + sum(RecordFileFormat.HEADER.unpack_from(payload, offset))
+    return offsets
+
+@pytest.mark.parametrize('field', range(3))
+@pytest.mark.parametrize('delta', (-3, -1, 1, 3, 1000))
+def test_records_corrupt_length_prefix(field, delta):
+    payload = FORMATS['records'].dumps(sample_data())
+    for offset in record_offsets(payload):
+        lengths = list(RecordFileFormat.HEADER.unpack_from(payload, offset))
+        if lengths[field] + delta < 0:
+            continue
+        lengths[field] += delta
+        corrupt = bytearray(payload)
+        RecordFileFormat.HEADER.pack_into(corrupt, offset, *lengths)
+        with pytest.raises(ValueError):
+            FORMATS['records'].loads(bytes(corrupt))
+
+def test_records_rejects_other_payloads():
+    with pytest.raises(ValueError):
+        FORMATS['records'].loads(b'{}')
@@ -0,0 +1,99 @@
+from datetime import datetime, time, timedelta, timezone
+
+from schedule_index import ScheduleIndex, is_time_to_run, next_occurrence
+
+DAY = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+def scheduled(start, stop, **fields):
+    return dict({'adbot_status': True, 'is_premium': True, 'start_time': start, 'stop_time': stop}, **fields)
+
+def test_window_that_wraps_midnight():
+    start, stop = time(22, 0), time(2, 0)
+    assert is_time_to_run(start, stop, time(23, 30))
+    assert is_time_to_run(start, stop, time(0, 0))
+    assert is_time_to_run(start, stop, time(1, 59))
+    assert not is_time_to_run(start, stop, time(2, 0))
+    assert not is_time_to_run(start, stop, time(12, 0))
+    assert is_time_to_run(start, stop, time(22, 0))
+
+def test_plain_window_excludes_stop_time():
+    assert is_time_to_run(time(9, 0), time(17, 0), time(9, 0))
+    assert not is_time_to_run(time(9, 0), time(17, 0), time(17, 0))
+
+def test_next_occurrence_is_strictly_after_now():
+    now = DAY.replace(hour=9)
+    assert next_occurrence(time(9, 0), now) == DAY.replace(hour=9) + timedelta(days=1)
+    assert next_occurrence(time(10, 0), now) == DAY.replace(hour=10)
+
+def test_new_user_is_reconciled_at_once():
+    index = ScheduleIndex()
+    now = DAY.replace(hour=23)
+    index.update(1, scheduled('22:00', '02:00'), now)
+    assert index.next_due() == now
+    assert index.pop_due(now) == [(1, True)]
+    assert index.next_due() == DAY.replace(hour=2) + timedelta(days=1)
+
+def test_alternating_start_and_stop_transitions():
+    index = ScheduleIndex()
+    index.update(1, scheduled('09:00', '17:00'), DAY)
+    assert index.pop_due(DAY) == [(1, False)]
+    seen = []
+    for _ in range(4):
+        due = index.next_due()
+        seen.append((due.hour, index.pop_due(due)))
+    assert seen == [(9, [(1, True)]), (17, [(1, False)]), (9, [(1, True)]), (17, [(1, False)])]
+
+def test_nothing_due_before_the_next_transition():
+    index = ScheduleIndex()
+    index.update(1, scheduled('09:00', '17:00'), DAY)
+    index.pop_due(DAY)
+    assert index.pop_due(DAY.replace(hour=8, minute=59)) == []
+
+def test_updating_a_window_replaces_the_old_one():
+    index = ScheduleIndex()
+    index.update(1, scheduled('09:00', '17:00'), DAY)
+    index.pop_due(DAY)
+    index.update(1, scheduled('03:00', '04:00'), DAY)
+    assert index.pop_due(DAY) == [(1, False)]
+    assert index.next_due() == DAY.replace(hour=3)
+    assert len(index) == 1
+
+def test_removing_a_window():
+    for fields in ({'adbot_status': False}, {'is_premium': False}, {'start_time': None}):
+        index = ScheduleIndex()
+        index.update(1, scheduled('09:00', '17:00'), DAY)
+        index.update(1, scheduled('09:00', '17:00', **fields), DAY)
+        assert len(index) == 0
+        assert index.next_due() is None
+        assert index.pop_due(DAY + timedelta(days=2)) == []
+
+def test_invalid_times_are_dropped():
+    index = ScheduleIndex()
+    index.update(1, scheduled('09:00', '17:00'), DAY)
+    index.update(1, scheduled('25:00', '17:00'), DAY)
+    index.update(2, scheduled('09:00', 'noon'), DAY)
+    assert len(index) == 0
+    assert index.pop_due(DAY + timedelta(days=1)) == []
+
+def test_changed_is_set_when_a_user_is_indexed():
+    index = ScheduleIndex()
+    index.update(1, scheduled('09:00', '17:00'), DAY)
+    assert index.changed.is_set()
+
+def test_load_indexes_only_scheduled_users():
+    index = ScheduleIndex()
+    index.load({'1': scheduled('09:00', '17:00'), '2': scheduled('09:00', '17:00', is_premium=False), '3': {}}, DAY)
+    assert len(index) == 1
+    assert index.pop_due(DAY) == [(1, False)]
+
+def test_retry_reconciles_again_at_the_given_time():
+    index = ScheduleIndex()
+    now = DAY.replace(hour=10)
+    index.update(1, scheduled('09:00', '17:00'), now)
+    assert index.pop_due(now) == [(1, True)]
+    index.retry(1, now + timedelta(minutes=1))
+    assert index.next_due() == now + timedelta(minutes=1)
+    assert index.pop_due(now + timedelta(minutes=1)) == [(1, True)]
+    assert index.next_due() == DAY.replace(hour=17)
+    index.retry(2, now)
+    assert index.next_due() == DAY.replace(hour=17)
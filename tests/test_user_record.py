@@ -0,0 +1,57 @@
+import json
+
+import pytest
+
+from database import FORMATS, JournalStorage, SqliteStorage, UserCache, UserRecord, plain_records
+
+TRICKY_ACCOUNTS = {
+    'main': '1BVtsOJ4Bu3==',
+    'with "quotes":"and colons"': '1AbC',
+    'back\\slash\\': '',
+    '': '1x',
+    'ünï': '1y',
+}
+
+def raw_record(accounts=TRICKY_ACCOUNTS, **fields):
+    """A record as storage hands it over: accounts still encoded."""
+    return UserRecord.from_dict(UserRecord(**fields).to_dict(include_accounts=False), UserRecord(accounts=accounts).accounts_json())
+
+@pytest.mark.parametrize('accounts', [{}, {'main': '1a'}, TRICKY_ACCOUNTS])
+def test_account_count_without_decoding(accounts):
+    record = raw_record(accounts)
+    assert record.account_count() == len(accounts)
+    assert record._accounts is None
+    assert record.accounts == accounts
+    assert record.account_count() == len(accounts)
+
+def test_to_json_copies_untouched_accounts():
+    record = raw_record(username='a', logs=['legacy'])
+    decoded = json.loads(record.to_json())
+    assert record._accounts is None
+    assert decoded == UserRecord.coerce(record).to_dict()
+
+def test_compact_snapshot_matches_plain_json():
+    data = {'1': raw_record(username='a'), '2': UserRecord(accounts={'x': 'y'}), '3': UserRecord()}
+    snapshot = json.loads(FORMATS['json'].dumps(data))
+    assert data['1']._accounts is None
+    assert snapshot == plain_records(data)
+
+def test_cache_writes_keep_accounts_encoded(tmp_path):
+    storage = SqliteStorage(str(tmp_path / 'database.db'))
+    storage.put('1', UserRecord(accounts=TRICKY_ACCOUNTS))
+    cache = UserCache(storage, flush_interval=None)
+    assert cache.get_aggregates()['accounts'] == len(TRICKY_ACCOUNTS)
+    record = cache.get('1')
+    record['username'] = 'changed'
+    cache.put('1', record)
+    cache.flush()
+    assert record._accounts is None
+    assert cache.get_aggregates()['accounts'] == len(TRICKY_ACCOUNTS)
+    assert storage.get('1').accounts == TRICKY_ACCOUNTS
+
+def test_journal_append_keeps_accounts_encoded(tmp_path):
+    paths = (str(tmp_path / 'database.json'), str(tmp_path / 'database.journal'))
+    record = raw_record(username='a')
+    JournalStorage(*paths).put('1', record)
+    assert record._accounts is None
+    assert JournalStorage(*paths).get('1').accounts == TRICKY_ACCOUNTS